@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 """分析标签分布"""
-import json
 from collections import Counter
 
-with open('clip_results.json', 'r', encoding='utf-8') as f:
-    data = json.load(f)
+from asset_store import open_default_store
+
+data = open_default_store().load_items(include_embeddings=False)
 
 tag_counter = Counter()
 for item in data:
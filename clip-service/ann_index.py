@@ -0,0 +1,284 @@
+"""
+本地近似最近邻索引（IVF 倒排列表）- 在search_index.py中集成
+不依赖 Qdrant 的检索路径：素材向量按球面 k-means 聚成 nlist 个簇，查询时只对
+与查询最接近的 nprobe 个簇内的素材精确打分，打分量约为全量的 nprobe / nlist。
+
+- 簇分配按素材存储的向量行号（vec_row）保存在与向量文件对应的分配文件中（int32，追加写入，memmap 读取），
+  新写入的素材只需计算自身的簇，重启后直接映射，无需重新分配
+- 向量文件压缩（行号改变）后按现有质心重新分配；素材数增长到训练时的 retrain_factor 倍后重新训练质心
+- calibrate() 以库内向量为查询，报告不同 nprobe 下相对精确检索的 recall@k 与耗时，用于按库规模选择参数
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "ivf_meta.json"
+CENTROIDS_FILE = "ivf_centroids.npy"
+
+
+def default_nlist(rows: int) -> int:
+    """簇数：约 4·√N，限制在 [16, 65536]"""
+    return int(min(65536, max(16, 4 * np.sqrt(rows))))
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """每个（已归一化）向量所属的簇（内积最大的质心），分块计算避免大矩阵"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk_size):
+        block = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assignments[start:start + chunk_size] = (block @ centroids.T).argmax(axis=1)
+    return assignments
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """球面 k-means（内积距离）：返回 (k, dim) 归一化质心；空簇用随机样本重新初始化"""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(vectors.shape[0], size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(vectors.shape[0], size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-8)
+    return centroids.astype(np.float32)
+
+
+class IVFLists(NamedTuple):
+    """某个快照的倒排列表（CSR）：簇 c 的行号为 order[offsets[c]:offsets[c + 1]]；整体替换，查询无需加锁"""
+    centroids: np.ndarray
+    order: np.ndarray
+    offsets: np.ndarray
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """与查询最接近的 nprobe 个簇内的全部行号（EmbeddingIndex 行号）"""
+        nprobe = max(1, min(nprobe, self.centroids.shape[0]))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+
+
+class IVFIndex:
+    """
+    IVF 倒排索引（只产生候选行，打分由 EmbeddingIndex 在候选行上精确完成）
+
+    - update(): 与 EmbeddingIndex 的快照同步（行号 → 向量行号 vec_rows），生成新的 lists
+    - lists.candidates(): 查询 → 候选行号（EmbeddingIndex 行号）
+    - 素材数少于 min_rows 时不建索引（全量矩阵乘已经足够快），lists 为 None
+    """
+
+    def __init__(
+        self,
+        root,
+        nlist: int = 0,
+        nprobe: int = 16,
+        min_rows: int = 20000,
+        retrain_factor: float = 4.0,
+    ):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.retrain_factor = retrain_factor
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self.vectors_file: Optional[str] = None
+        self._assign_rows = 0
+        self.lists: Optional[IVFLists] = None
+        self.build_seconds = 0.0
+        self._load()
+
+    # --------------------------------------------
+    # 持久化
+    # --------------------------------------------
+    def _assign_path(self, vectors_file: str) -> Path:
+        return self.root / f"ivf_{vectors_file}.assign"
+
+    def _load(self):
+        meta_path = self.root / META_FILE
+        if not meta_path.exists() or not (self.root / CENTROIDS_FILE).exists():
+            return
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.centroids = np.load(self.root / CENTROIDS_FILE, mmap_mode="r")
+        self.trained_rows = meta["trained_rows"]
+        self.vectors_file = meta["vectors_file"]
+        path = self._assign_path(self.vectors_file)
+        size = path.stat().st_size if path.exists() else 0
+        if size % 4:
+            # 崩溃时写了一半的尾部，截掉后由 update() 重新分配
+            with open(path, "r+b") as f:
+                f.truncate(size - size % 4)
+        self._assign_rows = size // 4
+        logger.info(f"已加载IVF索引: {self.centroids.shape[0]} 簇, 已分配 {self._assign_rows} 行")
+
+    def _save_meta(self):
+        meta_path = self.root / META_FILE
+        tmp_path = meta_path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps({"trained_rows": self.trained_rows, "vectors_file": self.vectors_file}),
+            encoding="utf-8",
+        )
+        os.replace(tmp_path, meta_path)
+
+    def _assignments(self) -> np.ndarray:
+        if not self._assign_rows:
+            return np.zeros(0, dtype=np.int32)
+        return np.memmap(self._assign_path(self.vectors_file), dtype=np.int32, mode="r", shape=(self._assign_rows,))
+
+    def _append_assignments(self, assignments: np.ndarray):
+        with open(self._assign_path(self.vectors_file), "ab") as f:
+            f.write(np.ascontiguousarray(assignments, dtype=np.int32).tobytes())
+        self._assign_rows += assignments.shape[0]
+
+    def _reset_assignments(self, vectors_file: str):
+        if self.vectors_file:
+            try:
+                self._assign_path(self.vectors_file).unlink()
+            except OSError:
+                pass
+        self.vectors_file = vectors_file
+        self._assign_path(vectors_file).write_bytes(b"")
+        self._assign_rows = 0
+
+    def _train(self, matrix: np.ndarray, vectors_file: str):
+        rows = matrix.shape[0]
+        nlist = min(self.nlist or default_nlist(rows), rows)
+        rng = np.random.default_rng(0)
+        sample_size = min(rows, max(32 * nlist, 10000))
+        sample = matrix[np.sort(rng.choice(rows, size=sample_size, replace=False))]
+        logger.info(f"训练IVF质心: {nlist} 簇, 样本 {sample_size} 行")
+        centroids = spherical_kmeans(sample, nlist)
+        tmp_path = self.root / (CENTROIDS_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, centroids)
+        os.replace(tmp_path, self.root / CENTROIDS_FILE)
+        self.centroids = centroids
+        self.trained_rows = rows
+        self._reset_assignments(vectors_file)
+
+    # --------------------------------------------
+    # 构建
+    # --------------------------------------------
+    def update(self, matrix: np.ndarray, vec_rows: np.ndarray, vectors_file: str):
+        """
+        与 EmbeddingIndex 快照同步
+
+        matrix 的第 i 行是向量文件第 vec_rows[i] 行（vec_rows 升序）；
+        向量文件只追加，vec_rows 超出已分配范围的行即新写入的素材。
+        """
+        rows = matrix.shape[0]
+        if rows < self.min_rows:
+            self.lists = None
+            return
+        start = time.perf_counter()
+        if (
+            self.centroids is None
+            or self.centroids.shape[1] != matrix.shape[1]
+            or rows > self.retrain_factor * self.trained_rows
+        ):
+            self._train(matrix, vectors_file)
+        elif vectors_file != self.vectors_file:
+            # 向量文件被压缩，行号已改变：质心不变，全部重新分配
+            logger.info("向量文件已切换，重新分配IVF簇")
+            self._reset_assignments(vectors_file)
+
+        new = np.flatnonzero(vec_rows >= self._assign_rows)
+        if new.size:
+            # 中间的空洞（被替换的旧行）填 -1，只为现存素材计算簇
+            last = int(vec_rows[-1]) + 1
+            assignments = np.full(last - self._assign_rows, -1, dtype=np.int32)
+            assignments[vec_rows[new] - self._assign_rows] = assign_lists(matrix[new], self.centroids)
+            self._append_assignments(assignments)
+        self._save_meta()
+
+        lists = np.asarray(self._assignments()[vec_rows], dtype=np.int64)
+        unassigned = np.flatnonzero(lists < 0)
+        if unassigned.size:
+            lists[unassigned] = assign_lists(matrix[unassigned], self.centroids)
+        counts = np.bincount(lists, minlength=self.centroids.shape[0])
+        self.lists = IVFLists(
+            np.asarray(self.centroids, dtype=np.float32),
+            np.argsort(lists, kind="stable"),
+            np.concatenate(([0], np.cumsum(counts))),
+        )
+        self.build_seconds = time.perf_counter() - start
+        if new.size:
+            logger.info(f"IVF索引已更新: 新分配 {new.size} 行, 共 {rows} 行, 耗时 {self.build_seconds:.2f}s")
+
+    # --------------------------------------------
+    # 查询
+    # --------------------------------------------
+    @property
+    def ready(self) -> bool:
+        return self.lists is not None
+
+    def calibrate(
+        self,
+        matrix: np.ndarray,
+        nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32, 64),
+        top_k: int = 10,
+        samples: int = 200,
+        queries: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        比较 IVF 与精确检索的 top-k（queries 为空时以随机抽取的库内向量为查询）
+
+        返回每个 nprobe 的 recall@k、平均打分行占比与平均耗时（毫秒）
+        """
+        lists = self.lists
+        if lists is None:
+            return []
+        if queries is None:
+            rng = np.random.default_rng(0)
+            picked = np.sort(rng.choice(matrix.shape[0], size=min(samples, matrix.shape[0]), replace=False))
+            queries = np.asarray(matrix[picked], dtype=np.float32)
+        k = min(top_k, matrix.shape[0])
+        truth = []
+        start = time.perf_counter()
+        for query in queries:
+            scores = matrix @ query
+            truth.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        report = []
+        for nprobe in nprobes:
+            if nprobe > lists.centroids.shape[0]:
+                break
+            found = 0
+            scanned = 0
+            start = time.perf_counter()
+            for query, expected in zip(queries, truth):
+                rows = lists.candidates(query, nprobe)
+                scores = matrix[rows] @ query
+                top = rows[np.argpartition(-scores, min(k, rows.size) - 1)[:k]] if rows.size else rows
+                found += len(expected.intersection(top.tolist()))
+                scanned += rows.size
+            report.append({
+                "nprobe": nprobe,
+                "recall": round(found / (k * len(queries)), 4),
+                "scanned_fraction": round(scanned / (matrix.shape[0] * len(queries)), 4),
+                "ms": round((time.perf_counter() - start) * 1000 / len(queries), 3),
+                "exact_ms": round(exact_ms, 3),
+            })
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "nlist": int(self.lists.centroids.shape[0]) if self.lists is not None else 0,
+            "nprobe": self.nprobe,
+            "min_rows": self.min_rows,
+            "trained_rows": self.trained_rows,
+            "build_seconds": round(self.build_seconds, 3),
+        }
@@ -0,0 +1,671 @@
+"""
+素材列式存储 - 替代 clip_results.json
+元数据行存入 SQLite（按 filePath 唯一），embeddings 存入追加写的二进制向量文件，
+通过行号寻址、np.memmap 零拷贝读取。改标签只更新一行，不再重写整个JSON文件。
+
+目录结构:
+    <root>/assets.sqlite3   元数据表 + 存储参数 + 变更发件箱（sync_outbox）
+    <root>/vectors.bin      (行数, dim) 的预归一化向量，float32 或 float16
+
+向量写入前按行归一化，原始范数存在元数据行中，导出旧版JSON时还原。
+
+每次写入（upsert / update_metadata / delete）在同一事务中把变更的 filePath 记入发件箱，
+下游同步（如 Qdrant）按发件箱增量推送，任何进程的写入都不会漏掉。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_DTYPES = ("float32", "float16")
+DEFAULT_VECTORS_FILE = "vectors.bin"
+
+# 素材顶层字段 → 列名（其余顶层字段进入 extra）
+ITEM_COLUMNS = {
+    "filePath": "file_path",
+    "shotId": "shot_id",
+    "label": "label",
+    "duration": "duration",
+    "status": "status",
+}
+# clipMetadata 中单独成列的字段（其余字段进入 meta_extra）
+METADATA_COLUMNS = ("tags", "description", "emotions")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_path TEXT NOT NULL UNIQUE,
+    shot_id TEXT,
+    label TEXT,
+    duration REAL,
+    status TEXT,
+    tags TEXT,
+    description TEXT,
+    emotions TEXT,
+    has_metadata INTEGER NOT NULL DEFAULT 1,
+    extra TEXT,
+    meta_extra TEXT,
+    vec_row INTEGER,
+    vec_norm REAL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_outbox (
+    file_path TEXT PRIMARY KEY,
+    op TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class IndexSnapshot(NamedTuple):
+    """index_snapshot() 的返回值"""
+    rows: List[Dict[str, Any]]      # 有向量素材的行元数据（按 vec_row 升序）
+    vectors: np.ndarray             # 对应的预归一化向量（行号连续时为 memmap 视图）
+    total: int                      # 素材总数（含无向量的条目）
+    generation: int
+    vec_rows: np.ndarray            # 每行在向量文件中的行号
+    vectors_file: str               # 向量文件名（压缩后改变，行号随之改变）
+
+
+# 变更发件箱操作类型
+OUTBOX_UPSERT = "upsert"
+OUTBOX_DELETE = "delete"
+
+
+class AssetStore:
+    """
+    素材存储
+
+    - 元数据：SQLite（WAL），按 filePath upsert，标签等字段可单行更新
+    - 向量：追加写文件，行号记录在元数据行的 vec_row；更新向量时追加新行并改写行号，
+      旧行成为死行，由 compact() 回收
+    - generation：每次写事务递增，供内存索引判断是否需要重建（跨进程有效）
+    - sync_outbox：按 filePath 合并的待同步变更（同一文件多次修改只保留最后一次）
+    """
+
+    def __init__(self, root: Path, dtype: str = "float32"):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root / "assets.sqlite3"
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+        stored_dtype = self._get_meta("dtype")
+        if stored_dtype is None:
+            if dtype not in SUPPORTED_DTYPES:
+                raise ValueError(f"不支持的向量类型: {dtype}")
+            self._set_meta("dtype", dtype)
+            self._conn.commit()
+            stored_dtype = dtype
+        elif stored_dtype != dtype:
+            logger.info(f"素材存储已使用 {stored_dtype} 向量，忽略参数 {dtype}")
+        self.dtype = np.dtype(stored_dtype)
+
+        dim = self._get_meta("dim")
+        self.dim = int(dim) if dim is not None else 0
+
+        self._mmap: Optional[np.memmap] = None
+        self._mmap_key: Optional[Tuple[Path, int]] = None
+        self._repair_vector_file()
+
+    # --------------------------------------------
+    # 内部工具
+    # --------------------------------------------
+    def _get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: Any):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _bump_generation(self):
+        self._conn.execute(
+            "INSERT INTO store_meta (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    @contextmanager
+    def _write_transaction(self):
+        """写事务：BEGIN IMMEDIATE 取得库级写锁（跨进程串行化），提交时递增 generation"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._bump_generation()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _record_changes(self, file_paths: Iterable[str], op: str):
+        """在写事务内记录待同步变更（覆盖同一文件之前未同步的记录）"""
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO sync_outbox (file_path, op, enqueued_at, attempts) VALUES (?, ?, ?, 0)",
+            [(file_path, op, now) for file_path in file_paths],
+        )
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    @property
+    def vectors_path(self) -> Path:
+        """当前向量文件（compact 会切换到新文件，旧文件保留到下一次压缩）"""
+        return self.root / (self._get_meta("vectors_file") or DEFAULT_VECTORS_FILE)
+
+    def _vector_file_rows(self, path: Optional[Path] = None) -> int:
+        path = path or self.vectors_path
+        if not self.dim or not path.exists():
+            return 0
+        return path.stat().st_size // self._row_bytes
+
+    def _repair_vector_file(self):
+        """截掉崩溃时写了一半的尾部行（向量先于元数据落盘，整行孤儿无害）"""
+        path = self.vectors_path
+        if not self.dim or not path.exists():
+            return
+        size = path.stat().st_size
+        whole = size - size % self._row_bytes
+        if whole != size:
+            logger.warning(f"向量文件尾部不完整，截断 {size - whole} 字节")
+            with open(path, "r+b") as f:
+                f.truncate(whole)
+
+    def _append_vectors(self, vectors: np.ndarray) -> int:
+        """追加向量行并落盘，返回首行行号（须在写事务内调用）"""
+        path = self.vectors_path
+        start = self._vector_file_rows(path)
+        with open(path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return start
+
+    def _vector_view(self, path: Optional[Path] = None) -> np.ndarray:
+        """整个向量文件的只读 memmap（文件增长或切换后重新映射）"""
+        path = path or self.vectors_path
+        rows = self._vector_file_rows(path)
+        if rows == 0:
+            return np.zeros((0, self.dim), dtype=self.dtype)
+        if self._mmap is None or self._mmap_key != (path, rows):
+            self._mmap = np.memmap(path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+            self._mmap_key = (path, rows)
+        return self._mmap
+
+    @staticmethod
+    def _loads(text: Optional[str], default):
+        return json.loads(text) if text else default
+
+    @staticmethod
+    def _dumps(value) -> Optional[str]:
+        return json.dumps(value, ensure_ascii=False) if value is not None else None
+
+    # --------------------------------------------
+    # 写入
+    # --------------------------------------------
+    def _split_item(self, item: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+        """旧版JSON条目 → (列值, 原始向量或None)"""
+        clip_metadata = item.get("clipMetadata")
+        metadata = dict(clip_metadata or {})
+        embeddings = metadata.pop("embeddings", None)
+
+        vector = None
+        if embeddings:
+            candidate = np.asarray(embeddings, dtype=np.float32)
+            if not self.dim or candidate.shape[0] == self.dim:
+                vector = candidate
+            else:
+                # 维度不一致（旧模型残留），原样留在 meta_extra 中以便导出
+                metadata["embeddings"] = embeddings
+
+        columns = {column: item.get(field) for field, column in ITEM_COLUMNS.items()}
+        columns["tags"] = self._dumps(metadata.pop("tags", None))
+        columns["description"] = metadata.pop("description", None)
+        columns["emotions"] = self._dumps(metadata.pop("emotions", None))
+        columns["has_metadata"] = 0 if clip_metadata is None else 1
+        extra = {k: v for k, v in item.items() if k not in ITEM_COLUMNS and k != "clipMetadata"}
+        columns["extra"] = self._dumps(extra or None)
+        columns["meta_extra"] = self._dumps(metadata or None)
+        return columns, vector
+
+    def upsert(self, items: Iterable[Dict[str, Any]]) -> int:
+        """
+        按 filePath 插入或整行替换素材（旧版JSON条目格式）
+
+        向量整批追加写入一次并 fsync，之后在同一事务中写元数据。
+        返回写入条数。
+        """
+        prepared = [item for item in items if item.get("filePath")]
+        if not prepared:
+            return 0
+
+        # 写锁覆盖向量追加，多个进程同时写入时行号不会冲突
+        with self._write_transaction():
+            dim = self._get_meta("dim")
+            self.dim = int(dim) if dim is not None else 0
+            rows = []
+            vectors = []
+            for item in prepared:
+                columns, vector = self._split_item(item)
+                if vector is not None:
+                    if not self.dim:
+                        self.dim = int(vector.shape[0])
+                        self._set_meta("dim", self.dim)
+                    norm = float(np.linalg.norm(vector))
+                    columns["vec_norm"] = norm
+                    columns["vec_row"] = len(vectors)
+                    vectors.append(vector / (norm + 1e-8))
+                else:
+                    columns["vec_norm"] = None
+                    columns["vec_row"] = None
+                rows.append(columns)
+
+            if vectors:
+                start = self._append_vectors(np.stack(vectors))
+                for columns in rows:
+                    if columns["vec_row"] is not None:
+                        columns["vec_row"] += start
+
+            now = time.time()
+            self._conn.executemany(
+                """
+                INSERT INTO assets (
+                    file_path, shot_id, label, duration, status, tags, description, emotions,
+                    has_metadata, extra, meta_extra, vec_row, vec_norm, updated_at
+                ) VALUES (
+                    :file_path, :shot_id, :label, :duration, :status, :tags, :description, :emotions,
+                    :has_metadata, :extra, :meta_extra, :vec_row, :vec_norm, :updated_at
+                )
+                ON CONFLICT(file_path) DO UPDATE SET
+                    shot_id = excluded.shot_id, label = excluded.label,
+                    duration = excluded.duration, status = excluded.status,
+                    tags = excluded.tags, description = excluded.description,
+                    emotions = excluded.emotions, has_metadata = excluded.has_metadata,
+                    extra = excluded.extra, meta_extra = excluded.meta_extra,
+                    vec_row = excluded.vec_row, vec_norm = excluded.vec_norm,
+                    updated_at = excluded.updated_at
+                """,
+                [dict(columns, updated_at=now) for columns in rows],
+            )
+            self._record_changes((columns["file_path"] for columns in rows), OUTBOX_UPSERT)
+        return len(rows)
+
+    def update_metadata(self, updates: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """
+        单行更新 clipMetadata 字段（tags / description / emotions），不触碰向量文件
+
+        Args:
+            updates: [(filePath, {"tags": [...], ...})]
+
+        返回实际更新的行数
+        """
+        statements = []
+        for file_path, fields in updates:
+            unknown = set(fields) - set(METADATA_COLUMNS)
+            if unknown:
+                raise ValueError(f"不支持单行更新的字段: {sorted(unknown)}")
+            if not fields:
+                continue
+            values = {
+                column: self._dumps(value) if column != "description" else value
+                for column, value in fields.items()
+            }
+            statements.append((file_path, values))
+        if not statements:
+            return 0
+
+        updated = 0
+        now = time.time()
+        with self._write_transaction():
+            changed = []
+            for file_path, values in statements:
+                assignments = ", ".join(f"{column} = ?" for column in values)
+                cursor = self._conn.execute(
+                    f"UPDATE assets SET {assignments}, has_metadata = 1, updated_at = ? WHERE file_path = ?",
+                    [*values.values(), now, file_path],
+                )
+                if cursor.rowcount:
+                    changed.append(file_path)
+                updated += cursor.rowcount
+            self._record_changes(changed, OUTBOX_UPSERT)
+        return updated
+
+    def delete(self, file_paths: Iterable[str]) -> int:
+        """删除素材（向量行成为死行，由 compact() 回收），返回删除条数"""
+        file_paths = list(dict.fromkeys(file_paths))
+        if not file_paths:
+            return 0
+        deleted = []
+        with self._write_transaction():
+            for file_path in file_paths:
+                cursor = self._conn.execute("DELETE FROM assets WHERE file_path = ?", (file_path,))
+                if cursor.rowcount:
+                    deleted.append(file_path)
+            self._record_changes(deleted, OUTBOX_DELETE)
+        return len(deleted)
+
+    # --------------------------------------------
+    # 变更发件箱
+    # --------------------------------------------
+    def outbox_peek(self, limit: int = 64, max_attempts: Optional[int] = None) -> List[Tuple[str, str, float, int]]:
+        """最早的待同步变更 [(filePath, op, enqueued_at, attempts)]"""
+        query = "SELECT file_path, op, enqueued_at, attempts FROM sync_outbox"
+        params: list = []
+        if max_attempts is not None:
+            query += " WHERE attempts < ?"
+            params.append(max_attempts)
+        query += " ORDER BY enqueued_at LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def outbox_ack(self, entries: Iterable[Tuple[str, float]]):
+        """
+        删除已同步的变更
+
+        entries 为 (filePath, enqueued_at)：发送期间该文件又有新变更时 enqueued_at 不同，记录保留到下一轮。
+        发件箱不属于素材数据，不递增 generation。
+        """
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM sync_outbox WHERE file_path = ? AND enqueued_at = ?", list(entries)
+            )
+            self._conn.commit()
+
+    def outbox_retry(self, file_paths: Iterable[str]):
+        """同步失败，累加重试次数"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE sync_outbox SET attempts = attempts + 1 WHERE file_path = ?",
+                [(file_path,) for file_path in file_paths],
+            )
+            self._conn.commit()
+
+    def outbox_size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sync_outbox").fetchone()[0]
+
+    def outbox_exhausted(self, max_attempts: int, limit: int = 100) -> Tuple[int, List[str]]:
+        """重试次数已达上限、不再被 outbox_peek 取出的变更：(条数, 最早的 limit 个 filePath)"""
+        with self._lock:
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM sync_outbox WHERE attempts >= ?", (max_attempts,)
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT file_path FROM sync_outbox WHERE attempts >= ? ORDER BY enqueued_at LIMIT ?",
+                (max_attempts, limit),
+            ).fetchall()
+        return count, [row[0] for row in rows]
+
+    def update_tags(self, file_path: str, tags: List[str]) -> bool:
+        """更新单个素材的标签"""
+        return self.update_metadata([(file_path, {"tags": tags})]) > 0
+
+    def dead_rows(self) -> int:
+        """向量文件中不再被引用的行数"""
+        with self._lock:
+            referenced = self._conn.execute(
+                "SELECT COUNT(*) FROM assets WHERE vec_row IS NOT NULL"
+            ).fetchone()[0]
+            return max(0, self._vector_file_rows() - referenced)
+
+    def compact(self):
+        """
+        重写向量文件，只保留仍被引用的行（回收更新向量后留下的死行）
+
+        新行写入新文件并在同一事务中切换，持有旧映射的读者不受影响；
+        上上一代的向量文件在此时删除。
+        """
+        with self._write_transaction():
+            old_path = self.vectors_path
+            records = self._conn.execute(
+                "SELECT id, vec_row FROM assets WHERE vec_row IS NOT NULL ORDER BY vec_row"
+            ).fetchall()
+            vectors = self._vector_view(old_path)
+            new_path = self.root / f"vectors.{self.generation + 1}.bin"
+            with open(new_path, "wb") as f:
+                if records:
+                    f.write(np.ascontiguousarray(vectors[[r for _, r in records]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._conn.executemany(
+                "UPDATE assets SET vec_row = ? WHERE id = ?",
+                [(new_row, asset_id) for new_row, (asset_id, _) in enumerate(records)],
+            )
+            self._set_meta("vectors_file", new_path.name)
+
+        # 旧文件可能仍被其他读者映射，保留一代；更早的文件删除（失败则下次再试）
+        for stale in self.root.glob("vectors*.bin"):
+            if stale not in (new_path, old_path):
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
+        logger.info(f"向量文件已压缩: {len(records)} 行 → {new_path.name}")
+
+    # --------------------------------------------
+    # 读取
+    # --------------------------------------------
+    def __len__(self) -> int:
+        # 连接在线程间共享，读取同样需要持锁，避免读到其他线程未提交的事务
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+    @property
+    def generation(self) -> int:
+        """写事务计数（其他进程的写入同样可见）"""
+        value = self._get_meta("generation")
+        return int(value) if value is not None else 0
+
+    def file_paths(self) -> set:
+        """已存储的全部 filePath"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT file_path FROM assets")}
+
+    def missing_paths(self, directory: Optional[str] = None) -> List[str]:
+        """文件已不存在的素材（directory 不为空时只检查该目录下的素材）"""
+        prefix = os.path.normcase(os.path.abspath(directory)) if directory else None
+        missing = []
+        for file_path in sorted(self.file_paths()):
+            if prefix and not os.path.normcase(os.path.abspath(file_path)).startswith(prefix):
+                continue
+            if not os.path.exists(file_path):
+                missing.append(file_path)
+        return missing
+
+    def vectors(self, vec_rows: Optional[np.ndarray] = None, path: Optional[Path] = None) -> np.ndarray:
+        """
+        读取预归一化向量
+
+        vec_rows 为连续区间（或不传）时返回 memmap 切片，零拷贝；否则按行号收集为新数组。
+        """
+        with self._lock:
+            view = self._vector_view(path)
+        if vec_rows is None:
+            return view
+        vec_rows = np.asarray(vec_rows, dtype=np.int64)
+        if vec_rows.size == 0:
+            return view[:0]
+        first = int(vec_rows[0])
+        if np.array_equal(vec_rows, np.arange(first, first + vec_rows.size)):
+            return view[first:first + vec_rows.size]
+        return view[vec_rows]
+
+    def index_snapshot(self) -> IndexSnapshot:
+        """供内存检索索引使用的一致性快照（单个读事务内读取元数据与当前向量文件）"""
+        rows = []
+        vec_rows = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                generation = self.generation
+                path = self.vectors_path
+                total = len(self)
+                cursor = self._conn.execute(
+                    "SELECT file_path, shot_id, label, duration, tags, description, emotions, vec_row "
+                    "FROM assets WHERE vec_row IS NOT NULL ORDER BY vec_row"
+                )
+                for file_path, shot_id, label, duration, tags, description, emotions, vec_row in cursor:
+                    rows.append({
+                        "filePath": file_path,
+                        "shotId": shot_id,
+                        "label": label or Path(file_path).stem,
+                        "duration": duration if duration is not None else 5.0,
+                        "tags": self._loads(tags, []),
+                        "description": description or "",
+                        "emotions": self._loads(emotions, []),
+                    })
+                    vec_rows.append(vec_row)
+            finally:
+                self._conn.commit()
+            vec_rows = np.asarray(vec_rows, dtype=np.int64)
+            vectors = self.vectors(vec_rows, path=path)
+        return IndexSnapshot(rows, vectors, total, generation, vec_rows, path.name)
+
+    def iter_items(
+        self, include_embeddings: bool = True, file_paths: Optional[Iterable[str]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """按插入顺序还原旧版JSON条目（file_paths 不为空时只读取这些素材）"""
+        query = (
+            "SELECT file_path, shot_id, label, duration, status, tags, description, emotions, "
+            "has_metadata, extra, meta_extra, vec_row, vec_norm FROM assets"
+        )
+        with self._lock:
+            vectors = self._vector_view() if include_embeddings else None
+            if file_paths is None:
+                records = self._conn.execute(query + " ORDER BY id").fetchall()
+            else:
+                keys = list(dict.fromkeys(file_paths))
+                records = []
+                # 分块查询，避免超过SQLite参数上限
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    records.extend(self._conn.execute(
+                        f"{query} WHERE file_path IN ({placeholders}) ORDER BY id", chunk
+                    ).fetchall())
+
+        for (file_path, shot_id, label, duration, status, tags, description, emotions,
+             has_metadata, extra, meta_extra, vec_row, vec_norm) in records:
+            item: Dict[str, Any] = {"filePath": file_path}
+            for field, value in (("shotId", shot_id), ("label", label),
+                                 ("duration", duration), ("status", status)):
+                if value is not None:
+                    item[field] = value
+            item.update(self._loads(extra, {}))
+
+            if has_metadata:
+                metadata: Dict[str, Any] = {}
+                if vectors is not None and vec_row is not None:
+                    metadata["embeddings"] = (
+                        vectors[vec_row].astype(np.float32) * np.float32(vec_norm)
+                    ).tolist()
+                if tags is not None:
+                    metadata["tags"] = self._loads(tags, [])
+                if description is not None:
+                    metadata["description"] = description
+                if emotions is not None:
+                    metadata["emotions"] = self._loads(emotions, [])
+                metadata.update(self._loads(meta_extra, {}))
+                item["clipMetadata"] = metadata
+            yield item
+
+    def load_items(self, include_embeddings: bool = True) -> List[Dict[str, Any]]:
+        return list(self.iter_items(include_embeddings=include_embeddings))
+
+    # --------------------------------------------
+    # 旧版JSON导入/导出
+    # --------------------------------------------
+    def import_json(self, json_path: Path, chunk_size: int = 1000) -> int:
+        """导入 clip_results.json（按 filePath upsert），返回导入条数"""
+        with open(json_path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        imported = 0
+        for start in range(0, len(items), chunk_size):
+            imported += self.upsert(items[start:start + chunk_size])
+        logger.info(f"已从 {json_path} 导入 {imported} 个素材")
+        return imported
+
+    def export_json(self, json_path: Path, include_embeddings: bool = True) -> int:
+        """导出为 clip_results.json 格式，返回导出条数"""
+        items = self.load_items(include_embeddings=include_embeddings)
+        json_path = Path(json_path)
+        tmp_path = json_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, json_path)
+        logger.info(f"已导出 {len(items)} 个素材到 {json_path}")
+        return len(items)
+
+    def close(self):
+        with self._lock:
+            self._mmap = None
+            self._mmap_key = None
+            self._conn.close()
+
+
+def open_default_store(base_dir: Optional[Path] = None) -> AssetStore:
+    """
+    打开 clip-service 默认素材存储（CLIP_ASSET_STORE_DIR，默认 clip-service/asset_store）
+
+    存储为空且同目录下存在 clip_results.json 时自动导入一次。
+    """
+    base_dir = Path(base_dir) if base_dir else Path(__file__).parent
+    root = Path(os.getenv("CLIP_ASSET_STORE_DIR", str(base_dir / "asset_store")))
+    store = AssetStore(root, dtype=os.getenv("CLIP_ASSET_STORE_DTYPE", "float32"))
+
+    legacy_json = base_dir / "clip_results.json"
+    if len(store) == 0 and legacy_json.exists():
+        logger.info(f"首次启动，从旧版结果文件迁移: {legacy_json}")
+        store.import_json(legacy_json)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="素材存储与旧版 clip_results.json 互相转换")
+    parser.add_argument("command", choices=["import", "export", "compact", "prune"])
+    parser.add_argument("json_path", nargs="?", default="clip_results.json",
+                        help="import/export 的JSON文件；prune 时为只检查的目录（可选）")
+    parser.add_argument("--store", default=None, help="存储目录（默认 CLIP_ASSET_STORE_DIR 或 ./asset_store）")
+    parser.add_argument("--dtype", choices=SUPPORTED_DTYPES, default="float32")
+    parser.add_argument("--no-embeddings", action="store_true", help="导出时不包含向量")
+    args = parser.parse_args()
+
+    store_root = args.store or os.getenv("CLIP_ASSET_STORE_DIR", str(Path(__file__).parent / "asset_store"))
+    asset_store = AssetStore(Path(store_root), dtype=args.dtype)
+    if args.command == "import":
+        asset_store.import_json(Path(args.json_path))
+    elif args.command == "export":
+        asset_store.export_json(Path(args.json_path), include_embeddings=not args.no_embeddings)
+    elif args.command == "prune":
+        # 删除文件已不存在的素材，下游同步经发件箱删除对应数据
+        directory = args.json_path if args.json_path != "clip_results.json" else None
+        print(f"删除 {asset_store.delete(asset_store.missing_paths(directory))} 个文件已不存在的素材")
+    else:
+        asset_store.compact()
+    asset_store.close()
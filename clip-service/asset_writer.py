@@ -0,0 +1,174 @@
+"""
+素材存储单写者 - 在clip_server.py中集成
+所有 save-results 写入经由一个后台线程串行执行：并发到达的请求合并为一次
+upsert（一次向量追加 + fsync、一次事务提交），空闲时按死行比例后台压缩向量文件。
+删除请求同样经由写线程，按提交顺序与 upsert 交错执行。
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from asset_store import AssetStore
+
+logger = logging.getLogger(__name__)
+
+
+class AssetWriter:
+    """
+    组提交写入线程
+
+    - submit(items) 返回 Future，结果为本次请求写入的条数
+    - 每轮取出队列中所有待写请求（最多 max_batch_items 条素材），合并提交一次
+    - 合并提交失败时逐个请求重试，失败只影响出错的请求
+    - 队列空闲且死行占比超过 compact_ratio 时压缩向量文件
+    - on_commit 在每轮提交后调用
+    - start=False 时不启动写线程（如服务启动时再调用 start()），此前提交的请求在启动后写入
+    """
+
+    def __init__(
+        self,
+        store: AssetStore,
+        max_batch_items: int = 5000,
+        compact_ratio: float = 0.25,
+        compact_min_rows: int = 1000,
+        on_commit: Optional[Callable[[], None]] = None,
+        start: bool = True,
+    ):
+        self.store = store
+        self.max_batch_items = max_batch_items
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        # 每轮写入提交后调用（如唤醒下游同步线程）
+        self.on_commit = on_commit
+        # 队列条目: (操作, 数据, Future)，操作为 "upsert"（素材列表）或 "delete"（filePath 列表）
+        self._queue: "queue.Queue[Optional[Tuple[str, list, Future]]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.commits = 0
+        self.compactions = 0
+        self._thread = threading.Thread(target=self._run, name="asset-writer", daemon=True)
+        if start:
+            self._thread.start()
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def submit(self, items: List[Dict[str, Any]]) -> Future:
+        """提交一批素材（旧版JSON条目格式），返回写入完成时结束的 Future"""
+        future: Future = Future()
+        self._queue.put(("upsert", list(items), future))
+        return future
+
+    def submit_delete(self, file_paths: List[str]) -> Future:
+        """提交删除，返回结果为实际删除条数的 Future"""
+        future: Future = Future()
+        self._queue.put(("delete", list(file_paths), future))
+        return future
+
+    def close(self, timeout: Optional[float] = None):
+        """写完队列中已有请求后停止线程"""
+        self._queue.put(None)
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _drain(self, first: Tuple[str, list, Future]) -> Tuple[list, bool]:
+        """取出当前排队的请求（合并上限 max_batch_items），返回 (请求列表, 是否收到停止信号)"""
+        group = [first]
+        size = len(first[1])
+        while size < self.max_batch_items:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                return group, True
+            group.append(entry)
+            size += len(entry[1])
+        return group, False
+
+    def _commit(self, group: list):
+        """按顺序执行：相邻的 upsert 合并提交，遇到 delete 时先提交之前的 upsert"""
+        upserts = []
+        for op, data, future in group:
+            if op == "upsert":
+                upserts.append((data, future))
+                continue
+            self._commit_upserts(upserts)
+            upserts = []
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.store.delete(data))
+                commits = 1
+            except Exception as e:
+                future.set_exception(e)
+                commits = 0
+            with self._stats_lock:
+                self.requests += 1
+                self.commits += commits
+        self._commit_upserts(upserts)
+
+    def _commit_upserts(self, group: list):
+        pending = [(items, future) for items, future in group if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+        try:
+            # 同一 filePath 在多个请求中出现时，按提交顺序后者覆盖前者
+            self.store.upsert([item for items, _ in pending for item in items])
+            for items, future in pending:
+                future.set_result(sum(1 for item in items if item.get("filePath")))
+            commits = 1
+        except Exception as e:
+            logger.warning(f"合并写入失败，逐个请求重试: {e}")
+            commits = 0
+            for items, future in pending:
+                try:
+                    future.set_result(self.store.upsert(items))
+                    commits += 1
+                except Exception as item_error:
+                    future.set_exception(item_error)
+
+        with self._stats_lock:
+            self.requests += len(pending)
+            self.commits += commits
+
+    def _maybe_compact(self):
+        dead = self.store.dead_rows()
+        if dead < self.compact_min_rows:
+            return
+        live = len(self.store)
+        if dead / max(1, dead + live) < self.compact_ratio:
+            return
+        try:
+            self.store.compact()
+            with self._stats_lock:
+                self.compactions += 1
+        except Exception as e:
+            logger.warning(f"向量文件后台压缩失败: {e}")
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            group, stopping = self._drain(entry)
+            self._commit(group)
+            if self.on_commit is not None:
+                self.on_commit()
+            if stopping:
+                return
+            if self._queue.empty():
+                self._maybe_compact()
+
+    def stats(self) -> Dict:
+        """写入统计（requests / commits 即平均每次提交合并的请求数）"""
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "commits": self.commits,
+                "compactions": self.compactions,
+                "queued": self._queue.qsize(),
+            }
@@ -5,10 +5,14 @@
 """
 
 import requests
-import json
 import os
 import time
 
+from asset_store import open_default_store
+
+# 服务端多进程扫描（-1 或大于1 = 使用服务端启动时创建的进程池，0/1 = 线程流水线）
+SCAN_WORKERS = int(os.getenv('CLIP_SCAN_PROCESSES', '-1'))
+
 def get_directory_structure(base_dir):
     """获取目录结构统计"""
     payload = {
@@ -48,35 +52,37 @@ def scan_directory(dir_name, base_dir):
         'directory': rf'{base_dir}\\{dir_name}',
         'file_patterns': ['*.mp4', '*.mov', '*.avi', '*.mkv'],
         'extract_keyframes': True,
-        'model_version': 'Chinese-CLIP ViT-B/16'
+        'model_version': 'Chinese-CLIP ViT-B/16',
+        'workers': SCAN_WORKERS,
+        # 服务端直接入库，不再下载向量后回传 save-results
+        'persist': True
     }
     
     try:
         print(f'正在扫描目录: {dir_name}')
-        response = requests.post('http://localhost:8000/clip/scan', json=scan_payload, timeout=600)
-        
-        if response.status_code == 200:
-            result = response.json()
-            processed_files = result.get('processedFiles', [])
-            print(f'扫描完成，处理了 {len(processed_files)} 个文件')
-            
-            if processed_files:
-                # 保存结果
-                save_payload = {'results': processed_files}
-                save_response = requests.post('http://localhost:8000/clip/save-results', json=save_payload, timeout=300)
-                
-                if save_response.status_code == 200:
-                    print('结果保存成功')
-                    return True, len(processed_files)
-                else:
-                    print(f'保存失败: {save_response.status_code}')
-                    return False, 0
-            else:
-                print('没有处理任何文件')
-                return True, 0
-        else:
+        # 提交扫描任务后轮询进度，不再用一个长超时请求等待整个目录
+        response = requests.post('http://localhost:8000/clip/jobs', json=scan_payload, timeout=30)
+        if response.status_code != 200:
             print(f'扫描失败: {response.status_code} - {response.text[:200]}')
             return False, 0
+        job_id = response.json()['job_id']
+        
+        while True:
+            time.sleep(2)
+            job = requests.get(f'http://localhost:8000/clip/jobs/{job_id}', timeout=30).json()
+            progress = job['progress']
+            print(f"  进度: {progress['done']}/{progress['total']} ({progress['percent']}%)", end='\r')
+            if job['status'] in ('completed', 'failed', 'cancelled'):
+                print()
+                break
+        
+        if job['status'] == 'failed':
+            print(f"扫描失败: {job['error']}")
+            return False, 0
+        
+        summary = job['summary']
+        print(f"扫描完成，入库 {summary['processed']} 个文件，跳过 {summary['skipped']} 个，失败 {summary['failed']} 个")
+        return True, summary['processed']
             
     except Exception as e:
         print(f'扫描异常: {e}')
@@ -87,6 +93,8 @@ def main():
     
     print('=== Chinese-CLIP 向量索引重建工具 ===')
     print(f'基础目录: {base_dir}')
+    # 扫描结果由服务端写入素材存储，这里只读取条数
+    store = open_default_store()
     
     # 获取目录结构
     print('\n正在获取目录结构...')
@@ -129,17 +137,12 @@ def main():
         time.sleep(2)
         
         # 检查当前总文件数
-        try:
-            with open('clip_results.json', 'r', encoding='utf-8') as f:
-                current_data = json.load(f)
-            print(f'当前总文件数: {len(current_data)}')
-        except:
-            pass
+        print(f'当前总文件数: {len(store)}')
     
     print(f'\n=== 处理完成 ===')
     print(f'成功处理目录: {success_count}/{len(target_dirs)}')
     print(f'总共处理文件: {processed_count}')
-    print(f'当前索引文件总数: {len(current_data)}')
+    print(f'当前索引文件总数: {len(store)}')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,11 +2,23 @@
 """
 批量扫描新素材文件夹
 直接使用CLIP模型处理，不依赖HTTP接口
+
+    python batch_scan.py [目录]                        单机扫描
+    python batch_scan.py [目录] --queue <队列.sqlite3>  分布式扫描：多台机器指向同一个共享队列文件，
+                                                      结果经检索服务（CLIP_SERVER_URL）写入素材存储
 """
 from clip_server import CLIPModelManager, PREDEFINED_TAGS, extract_keyframes_from_video
-import json
+from asset_store import open_default_store
+from ingest_pipeline import IngestPipeline
+from scan_workers import ProcessScanPool, fork_available, fork_pool
+from work_queue import LeaseLost, ScanWorkQueue, default_owner
+import argparse
+import hashlib
 import os
+import requests
 import sys
+import threading
+from typing import Optional
 from pathlib import Path
 from datetime import datetime
 
@@ -15,8 +27,13 @@ sys.path.insert(0, '.')
 
 # 配置
 NEW_FOLDER = r"U:\PreVis_Assets\originals\02类型-三渲二 二次元类"
-RESULTS_FILE = "clip_results.json"
 BATCH_SIZE = 50  # 每处理50个保存一次
+ENCODE_BATCH_SIZE = 16  # 视觉塔批量推理大小
+DECODE_WORKERS = int(os.getenv("CLIP_DECODE_WORKERS", "0"))  # 解码线程数（0 = 按CPU核数）
+SCAN_PROCESSES = int(os.getenv("CLIP_SCAN_PROCESSES", "0"))  # 多进程扫描进程数（0/1 = 单进程流水线；仅CPU+fork平台）
+SCAN_THREADS = int(os.getenv("CLIP_SCAN_THREADS", "0"))  # 每个进程的torch线程数（0 = CPU核数 ÷ 进程数）
+LEASE_SECONDS = float(os.getenv("CLIP_LEASE_SECONDS", "300"))  # 工作队列租约时长，处理期间每1/3时长续约一次
+SERVER_URL = os.getenv("CLIP_SERVER_URL", "http://localhost:8000")  # 分布式模式的写入端：素材存储的唯一写者
 
 
 def find_video_files(directory: str) -> list:
@@ -37,85 +54,89 @@ def safe_text(text: str) -> str:
         return text.encode("utf-8", "replace").decode("utf-8")
 
 
-def main():
-    print("=" * 60)
-    print("批量扫描新素材文件夹")
-    print("=" * 60)
+CORE_CATEGORIES = ['shot_type', 'subject', 'emotion']
 
-    # 加载现有数据
-    print("\n1. 加载现有素材数据...")
-    if os.path.exists(RESULTS_FILE):
-        with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
-    else:
-        existing_data = []
+# 多进程扫描的工作进程通过 fork 继承的模型（start_scan_pool 中设置）
+_worker_model = None
 
-    # 获取已处理的文件路径
-    processed_paths = {item.get('filePath', '') for item in existing_data}
-    print(f"   已有素材: {len(existing_data)}")
 
-    # 查找新文件
-    print(f"\n2. 扫描目录: {NEW_FOLDER}")
-    all_files = find_video_files(NEW_FOLDER)
-    print(f"   发现视频文件: {len(all_files)}")
+def decode_frame(filepath):
+    keyframes = extract_keyframes_from_video(filepath, num_frames=1)
+    return (keyframes[0] if keyframes else None), None
 
-    # 过滤已处理的
-    new_files = [f for f in all_files if f not in processed_paths]
-    print(f"   待处理文件: {len(new_files)}")
 
-    if not new_files:
-        print("\n没有新文件需要处理!")
-        return
+def infer_frames(clip_manager, frames):
+    """计算向量（整批一次前向），并按类别选择标签"""
+    # 标签向量在模型加载时已预计算（已归一化）
+    tag_embeddings = clip_manager.tag_embeddings.cpu().numpy()
+    embeddings = clip_manager.encode_images(frames, batch_size=ENCODE_BATCH_SIZE)
+    similarities_batch = embeddings @ tag_embeddings.T
+    outputs = []
+    for embedding, similarities in zip(embeddings, similarities_batch):
+        selected_tags = []
+        idx = 0
 
-    # 初始化CLIP模型
-    print("\n3. 加载CLIP模型...")
-    clip_manager = CLIPModelManager()
-    clip_manager.load_model()
-    print("   模型加载完成")
+        for category, tags in PREDEFINED_TAGS.items():
+            cat_sims = similarities[idx:idx+len(tags)]
+            best_idx = cat_sims.argmax()
+            best_sim = cat_sims[best_idx]
 
-    # 处理文件
-    print(f"\n4. 开始处理 {len(new_files)} 个文件...")
-    processed = 0
-    errors = 0
+            if category in CORE_CATEGORIES or best_sim > 0.15:
+                selected_tags.append(tags[best_idx])
 
-    for i, filepath in enumerate(new_files):
-        try:
-            # 提取关键帧
-            keyframes = extract_keyframes_from_video(filepath, num_frames=1)
-            if not keyframes:
-                print(
-                    f"   [{i+1}/{len(new_files)}] 跳过(无法提取帧): {safe_text(Path(filepath).name)[:30]}")
-                errors += 1
-                continue
-            keyframe = keyframes[0]
-
-            # 计算向量
-            embeddings = clip_manager._get_image_features(keyframe).detach()
-            embeddings_list = embeddings.cpu().numpy().tolist()[0]
-
-            # 计算标签
-            all_tags = []
-            for category, tags in PREDEFINED_TAGS.items():
-                all_tags.extend(tags)
-
-            tag_embeddings = clip_manager._get_text_features(all_tags).detach()
-            similarities = (embeddings @ tag_embeddings.T).cpu().numpy()[0]
-
-            # 选择标签
-            selected_tags = []
-            idx = 0
-            core_categories = ['shot_type', 'subject', 'emotion']
-
-            for category, tags in PREDEFINED_TAGS.items():
-                cat_sims = similarities[idx:idx+len(tags)]
-                best_idx = cat_sims.argmax()
-                best_sim = cat_sims[best_idx]
-
-                if category in core_categories or best_sim > 0.15:
-                    selected_tags.append(tags[best_idx])
-
-                idx += len(tags)
+            idx += len(tags)
+        outputs.append((embedding, selected_tags))
+    return outputs
 
+
+def scan_chunk_task(chunk):
+    """在工作进程中执行：逐文件解码，整块一次批量推理"""
+    outcomes, frames = [], []
+    for filepath in chunk:
+        try:
+            frame, _ = decode_frame(filepath)
+        except Exception as e:
+            outcomes.append((filepath, "error", str(e)))
+            continue
+        outcomes.append((filepath, "ok" if frame is not None else "empty", None))
+        if frame is not None:
+            frames.append(frame)
+    try:
+        outputs = iter(infer_frames(_worker_model, frames) if frames else [])
+    except Exception as e:
+        return [(path, "error", str(e)) if kind == "ok" else (path, kind, extra) for path, kind, extra in outcomes]
+    return [(path, kind, next(outputs)) if kind == "ok" else (path, kind, extra) for path, kind, extra in outcomes]
+
+
+def start_scan_pool(clip_manager):
+    """
+    按 CLIP_SCAN_PROCESSES 创建多进程扫描进程池，未启用或不可用时返回 None
+
+    须在模型加载之后、任何线程（解码线程池、租约续约线程）启动之前调用：
+    fork 只复制调用线程，其他线程持有的锁在子进程中不会释放。
+    """
+    global _worker_model
+    if SCAN_PROCESSES <= 1 or clip_manager.device != "cpu" or not fork_available():
+        return None
+    # 模型已在本进程加载，fork 后各工作进程按写时复制共享权重
+    _worker_model = clip_manager
+    return fork_pool(scan_chunk_task, SCAN_PROCESSES, SCAN_THREADS)
+
+
+def scan_files(clip_manager, files: list, save, shot_id_for, pool=None) -> dict:
+    """
+    解码 → 推理 → 生成记录，按批调用 save(records)
+
+    pool 为 start_scan_pool() 创建的进程池时使用多进程扫描，否则使用线程流水线。
+    返回失败的文件 {路径: 错误信息}
+    """
+    counters = {"processed": 0}
+    failures = {}
+    counter_lock = threading.Lock()
+
+    def persist(records):
+        batch = []
+        for filepath, _, (embedding, selected_tags) in records:
             # 从文件名添加标签
             filename_lower = filepath.lower()
             if '三渲二' in filename_lower or '二次元' in filename_lower:
@@ -124,51 +145,221 @@ def main():
                 selected_tags.append('游戏CG')
 
             # 创建记录
-            shot_id = f"shot_{len(existing_data) + processed + 1}"
             label = Path(filepath).stem
-
-            record = {
-                "shotId": shot_id,
+            batch.append({
+                "shotId": shot_id_for(filepath),
                 "filePath": filepath,
                 "label": label,
                 "duration": 5.0,  # 默认时长
                 "clipMetadata": {
-                    "embeddings": embeddings_list,
+                    "embeddings": embedding.tolist(),
                     "tags": list(set(selected_tags)),
                     "description": f"三渲二素材: {label}",
                     "emotions": [],
                     "processed_at": datetime.now().isoformat()
                 }
-            }
+            })
+
+        save(batch)
+        with counter_lock:
+            counters["processed"] += len(batch)
+        print(f"   已处理: {counters['processed']}, 错误: {len(failures)}")
+
+    def on_error(filepath, error):
+        with counter_lock:
+            failures[filepath] = str(error)
+        print(f"   错误: {safe_text(Path(filepath).name)[:30]} - {safe_text(str(error))[:50]}")
+
+    def on_empty(filepath):
+        with counter_lock:
+            failures[filepath] = "无法提取帧"
+        print(f"   跳过(无法提取帧): {safe_text(Path(filepath).name)[:30]}")
+
+    if pool is not None:
+        def merge_chunk(chunk, outcomes):
+            records = []
+            for filepath, kind, extra in outcomes:
+                if kind == "ok":
+                    records.append((filepath, None, extra))
+                elif kind == "empty":
+                    on_empty(filepath)
+                else:
+                    on_error(filepath, Exception(extra))
+            if records:
+                persist(records)
+
+        scan = ProcessScanPool(pool, SCAN_PROCESSES, SCAN_THREADS)
+        scan.run(files, merge_chunk, chunk_size=ENCODE_BATCH_SIZE)
+        stats = scan.stats()
+        print(f"   耗时 {stats['wall_seconds']}s，{stats['workers']} 进程 × {stats['threads_per_worker']} 线程，"
+              f"利用率 {stats['stages']['worker']['utilization']:.0%}")
+    else:
+        # 解码线程池与模型推理、写入存储互相重叠
+        pipeline = IngestPipeline(
+            decode_fn=decode_frame,
+            infer_fn=lambda frames: infer_frames(clip_manager, frames),
+            persist_fn=persist,
+            on_error=on_error,
+            on_empty=on_empty,
+            decode_workers=DECODE_WORKERS,
+            batch_size=ENCODE_BATCH_SIZE,
+        )
+        pipeline.run(files)
+
+        stats = pipeline.stats()
+        print(f"   耗时 {stats['wall_seconds']}s，帧队列峰值 {stats['queues']['frames_max']}/{stats['queues']['frames_capacity']}")
+        for stage, stage_stats in stats["stages"].items():
+            print(f"   {stage}: 利用率 {stage_stats['utilization']:.0%} ({stage_stats['workers']} 线程)")
+    return failures
+
+
+def stable_shot_id(filepath: str) -> str:
+    """由路径生成的稳定 shotId：多台机器并行扫描时不依赖本地计数"""
+    return "shot_" + hashlib.blake2b(filepath.encode("utf-8"), digest_size=6).hexdigest()
+
+
+def load_model():
+    print("\n3. 加载CLIP模型...")
+    clip_manager = CLIPModelManager()
+    clip_manager.load_model()
+    print("   模型加载完成")
+    return clip_manager
+
+
+def save_to_server(records: list) -> int:
+    """经检索服务的 /clip/save-results 写入素材存储（服务端单写者组提交），失败时抛出异常"""
+    resp = requests.post(f"{SERVER_URL}/clip/save-results", json={"results": records}, timeout=300)
+    resp.raise_for_status()
+    return resp.json()["saved"]
+
+
+def run_queue_worker(queue_path: str, directory: Optional[str]):
+    """
+    分布式模式：从共享工作队列租用文件批次处理，可在多台机器上同时运行
+
+    指定目录时先把目录中的文件加入队列（已在队列中的文件不受影响）。
+    结果不直接写素材存储：SQLite WAL、向量文件按本进程计算的偏移追加、压缩时删除旧文件，
+    都不能在多台机器之间共享，因此统一 POST 到检索服务（CLIP_SERVER_URL），由服务端唯一的写者提交。
+    """
+    queue = ScanWorkQueue(queue_path, lease_seconds=LEASE_SECONDS)
+    if directory:
+        added = queue.enqueue(find_video_files(directory))
+        print(f"   队列新增文件: {added}")
+    print(f"   队列状态: {queue.stats()}")
+
+    clip_manager = load_model()
+    # 在租约续约线程启动之前 fork
+    pool = start_scan_pool(clip_manager)
+    owner = default_owner()
+    committed = 0
+    while True:
+        lease = queue.lease(BATCH_SIZE, owner)
+        if lease is None:
+            break
+        print(f"\n领取 {len(lease.paths)} 个文件（租约 {lease.token[:8]}）")
+        records = {}
+        try:
+            with queue.keep_alive(lease) as lost:
+                failures = scan_files(
+                    clip_manager, lease.paths,
+                    save=lambda batch: records.update((record["filePath"], record) for record in batch),
+                    shot_id_for=stable_shot_id,
+                    pool=pool,
+                )
+                if lost.is_set():
+                    print("   租约已失效，放弃本批")
+                    continue
+                # 写入服务期间不持有队列写锁，续约照常进行；写入失败时不做标记，租约到期后重新处理
+                succeeded = queue.commit(
+                    lease,
+                    lambda paths: save_to_server([records[path] for path in paths if path in records]),
+                    failed={path: failures.get(path, "无结果") for path in lease.paths if path not in records},
+                )
+            committed += len(succeeded)
+            print(f"   已提交 {len(succeeded)} 个，累计 {committed} 个")
+        except LeaseLost:
+            print("   租约已失效，放弃本批")
+        except BaseException:
+            queue.release(lease)
+            raise
+
+    if pool is not None:
+        pool.terminate()
+    print(f"\n队列已处理完: {queue.stats()}，本机提交 {committed} 个")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量扫描新素材文件夹")
+    parser.add_argument("directory", nargs="?", default=None, help=f"扫描目录（默认 {NEW_FOLDER}）")
+    parser.add_argument("--queue", default=os.getenv("CLIP_WORK_QUEUE"),
+                        help="共享工作队列文件，多台机器使用同一队列并行扫描")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("批量扫描新素材文件夹")
+    print("=" * 60)
 
-            existing_data.append(record)
-            processed += 1
+    if args.queue:
+        run_queue_worker(args.queue, args.directory)
+        return
 
-            if (i + 1) % 10 == 0:
-                print(
-                    f"   [{i+1}/{len(new_files)}] 已处理: {processed}, 错误: {errors}")
+    folder = args.directory or NEW_FOLDER
 
-            # 定期保存
-            if processed % BATCH_SIZE == 0:
-                with open(RESULTS_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(existing_data, f, ensure_ascii=False, indent=2)
-                print(f"   >> 已保存 {len(existing_data)} 条记录")
+    # 加载现有数据
+    print("\n1. 加载现有素材数据...")
+    store = open_default_store()
 
-        except Exception as e:
-                print(
-                    f"   [{i+1}/{len(new_files)}] 错误: {safe_text(Path(filepath).name)[:30]} - {safe_text(str(e))[:50]}")
-                errors += 1
+    # 获取已处理的文件路径
+    processed_paths = store.file_paths()
+    existing_count = len(processed_paths)
+    print(f"   已有素材: {existing_count}")
+
+    # 查找新文件
+    print(f"\n2. 扫描目录: {folder}")
+    all_files = find_video_files(folder)
+    print(f"   发现视频文件: {len(all_files)}")
+
+    # 过滤已处理的
+    new_files = [f for f in all_files if f not in processed_paths]
+    print(f"   待处理文件: {len(new_files)}")
+
+    if not new_files:
+        print("\n没有新文件需要处理!")
+        return
+
+    # 初始化CLIP模型（多进程扫描时随即 fork 进程池）
+    clip_manager = load_model()
+    pool = start_scan_pool(clip_manager)
+
+    # 处理文件
+    print(f"\n4. 开始处理 {len(new_files)} 个文件...")
+    # 待写入的新记录，每 BATCH_SIZE 条追加写入一次（只在持久化线程中访问）
+    pending_records = []
+    shot_numbers = iter(range(existing_count + 1, existing_count + len(new_files) + 1))
+
+    def save(batch):
+        pending_records.extend(batch)
+        # 定期保存（只追加本批记录）
+        if len(pending_records) >= BATCH_SIZE:
+            store.upsert(pending_records)
+            pending_records.clear()
+            print(f"   >> 已保存，共 {len(store)} 条记录")
+
+    failures = scan_files(clip_manager, new_files, save, lambda filepath: f"shot_{next(shot_numbers)}", pool=pool)
+    if pool is not None:
+        pool.terminate()
+    errors = len(failures)
+    processed = len(new_files) - errors
 
     # 最终保存
     print("\n5. 保存结果...")
-    with open(RESULTS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(existing_data, f, ensure_ascii=False, indent=2)
+    store.upsert(pending_records)
 
     print(f"\n" + "=" * 60)
     print(f"处理完成!")
     print(f"  新增: {processed}")
     print(f"  错误: {errors}")
-    print(f"  总计: {len(existing_data)}")
+    print(f"  总计: {len(store)}")
     print("=" * 60)
 
 
@@ -20,8 +20,11 @@ import os
 # Configure HF mirror
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 import json
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import threading
+from typing import List, Dict, Optional, Tuple, Union
 from pathlib import Path
 from datetime import datetime
 
@@ -31,10 +34,28 @@ from PIL import Image
 import cv2
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from transformers import ChineseCLIPProcessor, ChineseCLIPModel
+from huggingface_hub.constants import HF_HUB_CACHE
+
+from asset_store import open_default_store
+from asset_writer import AssetWriter
+from point_vectors import PointVectorCache
+from qdrant_search import qdrant_service
+from qdrant_sync import QdrantSyncWorker
+from scan_manifest import FileFingerprint, ScanManifest, plan_scan
+from scan_workers import ProcessScanPool, fork_available, fork_pool
+from scan_jobs import ScanJob, ScanJobManager, CANCELLED, FAILED, FINISHED_STATES, RUNNING
+from ingest_pipeline import IngestPipeline
+from ann_index import IVFIndex
+from filter_index import qdrant_filter
+from pca_projection import PROJECTION_FILE, PCAProjection
+from quantization import QuantizedVectors
+from search_index import SEARCH_MODES, EmbeddingIndex
+from text_cache import QueryEmbeddingCache
+from video_decode import DecodeStats, get_decoder, seek_cost_model
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -71,25 +92,52 @@ PREDEFINED_TAGS = {
 
 # 所有标签平铺列表
 ALL_TAGS = []
+# 各类别在 ALL_TAGS 中的切片位置，用于从整体标签矩阵中切出类别子矩阵
+CATEGORY_SLICES: Dict[str, slice] = {}
 for category, tags in PREDEFINED_TAGS.items():
+    CATEGORY_SLICES[category] = slice(len(ALL_TAGS), len(ALL_TAGS) + len(tags))
     ALL_TAGS.extend(tags)
+# 标签 → 类别（过滤表达式的 category 字段）
+TAG_CATEGORIES = {tag: category for category, tags in PREDEFINED_TAGS.items() for tag in tags}
+
+# 图像输入：PIL图像或RGB数组（解码后端直接输出 HxWx3 uint8，无需经过PIL）
+ImageInput = Union[Image.Image, np.ndarray]
+
+# 派生缓存目录（与HF模型缓存相邻），存放预计算的标签向量等与模型绑定的结果
+CACHE_DIR = Path(os.getenv("CLIP_CACHE_DIR", str(Path(HF_HUB_CACHE).parent / "clip-service")))
 
 # ============================================
 # CLIP模型管理
 # ============================================
 class CLIPModelManager:
-    def __init__(self, model_name: str = "OFA-Sys/chinese-clip-vit-base-patch16"):
+    def __init__(
+        self,
+        model_name: str = "OFA-Sys/chinese-clip-vit-base-patch16",
+        query_cache: Optional[QueryEmbeddingCache] = None,
+    ):
         self.model_name = model_name
+        # 查询文本向量缓存（进程内LRU + SQLite持久化），None 表示不缓存
+        self.query_cache = query_cache
         self.model = None
         self.processor = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.tag_embeddings = None
+        self.category_embeddings: Dict[str, torch.Tensor] = {}
+        self.emotion_embeddings = None
+        # 扫描线程与请求处理可能同时触发首次加载；_loaded 在标签向量就绪后才置位
+        self._load_lock = threading.Lock()
+        self._loaded = False
         
     def load_model(self):
         """加载CLIP模型"""
-        if self.model is not None:
+        if self._loaded:
             return
-            
+        with self._load_lock:
+            if not self._loaded:
+                self._load_model()
+                self._loaded = True
+
+    def _load_model(self):
         logger.info(f"加载CLIP模型: {self.model_name}")
         logger.info(f"使用设备: {self.device}")
         
@@ -112,74 +160,145 @@ class CLIPModelManager:
             pooled_output = text_outputs.last_hidden_state[:, 0, :]
         return self.model.text_projection(pooled_output)
 
-    def _get_image_features(self, image: Image.Image) -> torch.Tensor:
+    def _get_image_features(self, image: Union[ImageInput, List[ImageInput]]) -> torch.Tensor:
         inputs = self.processor(images=image, return_tensors="pt")
         pixel_values = inputs["pixel_values"].to(self.device)
         vision_outputs = self.model.vision_model(pixel_values=pixel_values, return_dict=True)
         pooled_output = vision_outputs.last_hidden_state[:, 0, :]
         return self.model.visual_projection(pooled_output)
         
+    def _tag_cache_path(self) -> Path:
+        """标签向量缓存文件，按模型名与标签库内容区分"""
+        digest = hashlib.sha1(
+            json.dumps(PREDEFINED_TAGS, ensure_ascii=False, sort_keys=False).encode("utf-8")
+        ).hexdigest()[:12]
+        model_slug = self.model_name.replace("/", "--")
+        return CACHE_DIR / f"tag_embeddings_{model_slug}_{digest}.npy"
+
     def _precompute_tag_embeddings(self):
-        """预计算所有标签的文本embeddings"""
-        logger.info("预计算标签embeddings...")
+        """
+        预计算所有标签的文本embeddings
+
+        ALL_TAGS 按类别顺序平铺，因此各类别矩阵和情绪矩阵都是整体矩阵的切片，
+        不需要再单独跑文本塔。结果持久化到 CACHE_DIR，重启时直接加载。
+        """
+        cache_path = self._tag_cache_path()
+        tag_matrix = None
+
+        if cache_path.exists():
+            try:
+                tag_matrix = np.load(cache_path)
+                if tag_matrix.shape[0] != len(ALL_TAGS):
+                    tag_matrix = None
+                else:
+                    logger.info(f"从缓存加载标签embeddings: {cache_path}")
+            except Exception as e:
+                logger.warning(f"标签embeddings缓存读取失败，将重新计算: {e}")
+                tag_matrix = None
+
+        if tag_matrix is None:
+            logger.info("预计算标签embeddings...")
+            with torch.no_grad():
+                text_features = self._get_text_features(ALL_TAGS)
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+            tag_matrix = text_features.cpu().numpy().astype(np.float32)
+
+            try:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_suffix(".tmp")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, tag_matrix)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning(f"标签embeddings缓存写入失败: {e}")
+
+        self.tag_embeddings = torch.from_numpy(tag_matrix).to(self.device)
+        self.category_embeddings = {
+            category: self.tag_embeddings[CATEGORY_SLICES[category]]
+            for category in PREDEFINED_TAGS
+        }
+        self.emotion_embeddings = self.category_embeddings["emotion"]
 
-        with torch.no_grad():
-            text_features = self._get_text_features(ALL_TAGS)
-            self.tag_embeddings = text_features / text_features.norm(dim=-1, keepdim=True)
-            
         logger.info(f"✅ 预计算完成, 标签数: {len(ALL_TAGS)}")
         
-    def encode_image(self, image: Image.Image) -> np.ndarray:
-        """编码图像为CLIP向量"""
+    def _encode_normalized(self, image: Union[ImageInput, List[ImageInput]]) -> torch.Tensor:
+        """视觉塔前向 + 归一化，返回 (N, dim) 张量"""
         with torch.no_grad():
             image_features = self._get_image_features(image)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            return image_features.cpu().numpy()[0]
-            
-    def get_tags(self, image: Image.Image, top_k: int = 5) -> List[Dict]:
-        """获取图像的标签（基于相似度）"""
+            return image_features / image_features.norm(dim=-1, keepdim=True)
+
+    def encode_image(self, image: ImageInput) -> np.ndarray:
+        """编码图像为CLIP向量"""
+        return self._encode_normalized(image).cpu().numpy()[0]
+
+    def encode_images(self, frames: List[ImageInput], batch_size: int = 16) -> np.ndarray:
+        """
+        批量编码图像为CLIP向量
+
+        将多个视频的关键帧按 batch_size 切分为定长批次送入视觉塔，
+        避免逐帧调用的固定开销（CPU推理时尤为明显）。
+
+        返回:
+            (len(frames), dim) 的归一化float32矩阵，行顺序与输入一致
+        """
+        if not frames:
+            return np.zeros((0, self.model.config.projection_dim), dtype=np.float32)
+
+        batch_size = max(1, batch_size)
+        outputs = []
+        for start in range(0, len(frames), batch_size):
+            image_features = self._encode_normalized(frames[start:start + batch_size])
+            outputs.append(image_features.cpu().numpy().astype(np.float32))
+        return np.concatenate(outputs, axis=0)
+
+    # --------------------------------------------
+    # 基于已归一化图像向量的推导（不再重复视觉前向）
+    # --------------------------------------------
+    def _tags_from_features(self, image_features: torch.Tensor, top_k: int = 5) -> List[Dict]:
+        """从图像向量计算 top-k 标签"""
         with torch.no_grad():
-            image_features = self._get_image_features(image)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-            # 计算相似度
             similarities = (image_features @ self.tag_embeddings.T).squeeze(0)
-            
-            # 获取top-k标签
             top_indices = similarities.argsort(descending=True)[:top_k]
-            
+
             results = []
             for idx in top_indices:
                 tag = ALL_TAGS[idx.item()]
                 score = similarities[idx].item()
                 results.append({"tag": tag, "confidence": round(score, 3)})
-                
+
             return results
-            
-    def get_tags_by_category(self, image: Image.Image) -> Dict[str, str]:
-        """按类别获取最佳标签"""
+
+    def _tags_by_category_from_features(self, image_features: torch.Tensor) -> Dict[str, str]:
+        """从图像向量计算每个类别的最佳标签"""
         with torch.no_grad():
-            image_features = self._get_image_features(image)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+            # 一次矩阵乘得到全部标签相似度，再按类别切片取最大
+            similarities = (image_features @ self.tag_embeddings.T).squeeze(0)
 
             results = {}
             for category, tags in PREDEFINED_TAGS.items():
-                # 计算该类别标签的embeddings
-                cat_features = self._get_text_features(tags)
-                cat_features = cat_features / cat_features.norm(dim=-1, keepdim=True)
-                
-                # 计算相似度
-                similarities = (image_features @ cat_features.T).squeeze(0)
-                best_idx = similarities.argmax().item()
+                best_idx = similarities[CATEGORY_SLICES[category]].argmax().item()
                 results[category] = tags[best_idx]
-                
+
             return results
 
-    def generate_description(self, image: Image.Image) -> str:
-        """生成图像描述"""
-        tags_by_cat = self.get_tags_by_category(image)
-        
-        # 组合描述
+    def _emotions_from_features(self, image_features: torch.Tensor) -> List[str]:
+        """从图像向量检测情绪"""
+        emotion_tags = PREDEFINED_TAGS["emotion"]
+
+        with torch.no_grad():
+            similarities = (image_features @ self.emotion_embeddings.T).squeeze(0)
+
+            # 返回相似度>0.2的情绪
+            emotions = []
+            for i, score in enumerate(similarities):
+                if score > 0.2:
+                    emotions.append(emotion_tags[i].replace("氛围", ""))
+
+            return emotions if emotions else ["中性"]
+
+    @staticmethod
+    def _describe(tags_by_cat: Dict[str, str]) -> str:
+        """由各类别最佳标签组合描述"""
         parts = []
         if tags_by_cat.get("scene"):
             parts.append(tags_by_cat["scene"])
@@ -189,36 +308,83 @@ class CLIPModelManager:
             parts.append(tags_by_cat["subject"])
         if tags_by_cat.get("emotion"):
             parts.append(tags_by_cat["emotion"])
-            
+
         return "，".join(parts) if parts else "通用镜头"
-        
-    def detect_emotions(self, image: Image.Image) -> List[str]:
-        """检测情绪"""
-        emotion_tags = PREDEFINED_TAGS["emotion"]
 
-        with torch.no_grad():
-            image_features = self._get_image_features(image)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+    def _analyze_features(self, image_features: torch.Tensor, top_k: int = 5) -> Dict:
+        """由单行归一化图像向量 (1, dim) 推导全部元数据"""
+        tags_by_category = self._tags_by_category_from_features(image_features)
+        return {
+            "embeddings": image_features.cpu().numpy()[0].tolist(),
+            "tags": [t["tag"] for t in self._tags_from_features(image_features, top_k=top_k)],
+            "tags_by_category": tags_by_category,
+            "description": self._describe(tags_by_category),
+            "emotions": self._emotions_from_features(image_features),
+        }
 
-            em_features = self._get_text_features(emotion_tags)
-            em_features = em_features / em_features.norm(dim=-1, keepdim=True)
-            
-            similarities = (image_features @ em_features.T).squeeze(0)
-            
-            # 返回相似度>0.2的情绪
-            emotions = []
-            for i, score in enumerate(similarities):
-                if score > 0.2:
-                    emotions.append(emotion_tags[i].replace("氛围", ""))
+    def analyze_frame(self, image: ImageInput, top_k: int = 5) -> Dict:
+        """
+        单次视觉前向完成帧分析
+
+        只计算一次归一化图像向量，由它推导标签、各类别最佳标签、描述、情绪和存储向量。
+
+        返回:
+            {"embeddings", "tags", "tags_by_category", "description", "emotions"}
+        """
+        return self._analyze_features(self._encode_normalized(image), top_k=top_k)
+
+    def analyze_frames(self, frames: List[ImageInput], batch_size: int = 16, top_k: int = 5) -> List[Dict]:
+        """批量版 analyze_frame：视觉塔按批前向，结果顺序与输入一致"""
+        embeddings = self.encode_images(frames, batch_size=batch_size)
+        features = torch.from_numpy(embeddings).to(self.device, dtype=self.tag_embeddings.dtype)
+        return [self._analyze_features(features[i:i + 1], top_k=top_k) for i in range(len(frames))]
+
+    def get_tags(self, image: ImageInput, top_k: int = 5) -> List[Dict]:
+        """获取图像的标签（基于相似度）"""
+        return self._tags_from_features(self._encode_normalized(image), top_k=top_k)
             
-            return emotions if emotions else ["中性"]
+    def get_tags_by_category(self, image: ImageInput) -> Dict[str, str]:
+        """按类别获取最佳标签"""
+        return self._tags_by_category_from_features(self._encode_normalized(image))
+
+    def generate_description(self, image: ImageInput) -> str:
+        """生成图像描述"""
+        return self._describe(self.get_tags_by_category(image))
+        
+    def detect_emotions(self, image: ImageInput) -> List[str]:
+        """检测情绪"""
+        return self._emotions_from_features(self._encode_normalized(image))
 
     def encode_text(self, text: str) -> np.ndarray:
         """编码文本为CLIP向量"""
-        with torch.no_grad():
-            text_features = self._get_text_features([text])
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            return text_features.cpu().numpy()[0]
+        return self.encode_texts([text])[0]
+
+    def encode_texts(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        批量编码文本为CLIP向量
+
+        所有文本统一分词后按批送入文本塔，返回 (len(texts), dim) 归一化矩阵
+        """
+        if not texts:
+            return np.zeros((0, self.model.config.projection_dim), dtype=np.float32)
+
+        cached = self.query_cache.get_many(self.model_name, texts) if self.query_cache else {}
+        # 只对未命中的文本（去重后）跑文本塔
+        missing = [text for text in dict.fromkeys(texts) if text not in cached]
+
+        if missing:
+            outputs = []
+            with torch.no_grad():
+                for start in range(0, len(missing), batch_size):
+                    text_features = self._get_text_features(missing[start:start + batch_size])
+                    text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+                    outputs.append(text_features.cpu().numpy().astype(np.float32))
+            encoded = dict(zip(missing, np.concatenate(outputs, axis=0)))
+            if self.query_cache:
+                self.query_cache.put_many(self.model_name, encoded)
+            cached.update(encoded)
+
+        return np.stack([cached[text] for text in texts])
 
     def compute_similarity(self, text_embedding: np.ndarray, image_embedding: List[float]) -> float:
         """计算文本和图像向量的余弦相似度"""
@@ -229,7 +395,13 @@ class CLIPModelManager:
         return float(np.dot(text_norm, image_norm))
 
 # 全局模型实例
-clip_manager = CLIPModelManager()
+clip_manager = CLIPModelManager(
+    query_cache=QueryEmbeddingCache(
+        db_path=CACHE_DIR / "query_embeddings.sqlite3",
+        max_entries=int(os.getenv("CLIP_QUERY_CACHE_SIZE", "4096")),
+        max_disk_entries=int(os.getenv("CLIP_QUERY_CACHE_DISK_SIZE", "100000")),
+    )
+)
 
 # ============================================
 # API数据模型
@@ -240,7 +412,13 @@ class ScanRequest(BaseModel):
     skip_processed: bool = True
     extract_keyframes: bool = True
     model_version: str = "Chinese-CLIP ViT-B/16"
-    batch_size: int = 5
+    batch_size: int = 16                # 视觉塔批量推理大小
+    keyframes_only: bool = False        # 只解码I帧（采样点取最近的关键帧，需要PyAV）
+    decode_workers: int = 0             # 解码线程数（0 = CLIP_DECODE_WORKERS / 按CPU核数）
+    queue_size: int = 0                 # 解码帧队列容量（0 = 4 × batch_size）
+    workers: int = -1                   # 多进程扫描（-1/>1 = 使用启动时按 CLIP_SCAN_PROCESSES 创建的进程池，0/1 = 线程流水线）
+    persist: bool = False               # 服务端直接入库，响应与任务结果中不再包含向量
+    stream: bool = False                # /clip/scan 以 NDJSON 流逐文件返回结果（配合 persist 时每行只有状态）
 
 class ProcessRequest(BaseModel):
     file_path: str
@@ -259,7 +437,11 @@ class SearchRequest(BaseModel):
     top_k: int = 10                     # 返回结果数量
     # Chinese-CLIP 相似度整体偏低，默认放宽阈值
     threshold: float = 0.02             # 相似度阈值，低于此值不返回
-    filter_tags: Optional[List[str]] = None  # 可选：按标签过滤
+    filter_tags: Optional[List[str]] = None  # 可选：按标签过滤（任一命中）
+    filter: Optional[Dict] = None       # 可选：过滤表达式（tag / emotion / category / path，and / or / not），与 filter_tags 同时满足
+    mode: str = "auto"                  # 检索模式：auto / exact / ivf / binary / pca
+    nprobe: int = 0                     # IVF 探测簇数（0 = CLIP_ANN_NPROBE）
+    shortlist: int = 0                  # 粗筛后精确重排的行数（0 = CLIP_INDEX_RERANK / CLIP_BINARY_SHORTLIST / CLIP_PCA_SHORTLIST）
 
 class CLIPMetadata(BaseModel):
     embeddings: List[float]
@@ -273,49 +455,41 @@ class CLIPMetadata(BaseModel):
 # ============================================
 # 视频处理工具
 # ============================================
-def extract_keyframes_from_video(video_path: str, num_frames: int = 5) -> List[Image.Image]:
-    """从视频中提取关键帧"""
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        raise ValueError(f"无法打开视频: {video_path}")
-    
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    if total_frames == 0:
-        raise ValueError(f"视频帧数为0: {video_path}")
-    
-    # 均匀采样帧
-    frame_indices = np.linspace(0, total_frames - 1, num_frames, dtype=int)
+def extract_keyframes_with_stats(
+    video_path: str, num_frames: int = 5, keyframes_only: bool = False
+) -> Tuple[List[np.ndarray], DecodeStats]:
+    """
+    从视频中提取关键帧（RGB数组，短边已缩放到 CLIP_DECODE_SIZE），同时返回解码耗时统计
+
+    keyframes_only: 采样点取其之前最近的I帧，只解码I帧（需要PyAV后端）
+    """
+    decoded, stats = get_decoder().sample(video_path, num_frames, keyframes_only=keyframes_only)
     
     all_frames = []
     frames = []
     last_hist = None
-    for idx in frame_indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ret, frame = cap.read()
-        if ret:
-            # BGR转RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(frame_rgb)
-            all_frames.append(image)
-
-            # 镜头变化检测（基于灰度直方图相似度）
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
-            cv2.normalize(hist, hist)
-
-            if last_hist is None:
-                frames.append(image)
+    for _, frame_rgb in decoded:
+        all_frames.append(frame_rgb)
+
+        # 镜头变化检测（基于灰度直方图相似度）
+        gray = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2GRAY)
+        hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
+        cv2.normalize(hist, hist)
+
+        if last_hist is None:
+            frames.append(frame_rgb)
+            last_hist = hist
+        else:
+            similarity = cv2.compareHist(last_hist, hist, cv2.HISTCMP_CORREL)
+            if similarity < 0.9:
+                frames.append(frame_rgb)
                 last_hist = hist
-            else:
-                similarity = cv2.compareHist(last_hist, hist, cv2.HISTCMP_CORREL)
-                if similarity < 0.9:
-                    frames.append(image)
-                    last_hist = hist
     
-    cap.release()
-    return frames if frames else all_frames
+    return (frames if frames else all_frames), stats
+
+def extract_keyframes_from_video(video_path: str, num_frames: int = 5, keyframes_only: bool = False) -> List[np.ndarray]:
+    """从视频中提取关键帧（RGB数组）"""
+    return extract_keyframes_with_stats(video_path, num_frames=num_frames, keyframes_only=keyframes_only)[0]
 
 def get_video_files(directory: str, patterns: List[str]) -> List[str]:
     """获取目录下的视频文件"""
@@ -352,8 +526,99 @@ def get_video_duration(video_path: str) -> float:
 # API路由
 # ============================================
 
-# 处理结果存储路径
-RESULTS_FILE = Path(__file__).parent / "clip_results.json"
+# 素材存储（SQLite元数据 + memmap向量，首次启动时自动导入 clip_results.json）
+asset_store = open_default_store(Path(__file__).parent)
+
+# 增量扫描清单（与素材存储同目录）
+scan_manifest = ScanManifest(asset_store.root / "scan_manifest.sqlite3")
+
+# 单写者：并发的 save-results 合并为一次提交，空闲时后台压缩向量文件
+# Qdrant 增量同步：消费素材存储的变更发件箱（CLIP_QDRANT_SYNC=0 关闭）
+# 写入 /clip/qdrant-search 检索的同一个 collection（QDRANT_URL / QDRANT_COLLECTION）
+# 两个后台线程在服务启动时（start_background_workers）才启动：命令行脚本导入本模块复用
+# CLIPModelManager 等时，不会在脚本进程里另起写线程或与服务争抢同步发件箱
+qdrant_sync = (
+    QdrantSyncWorker(
+        asset_store,
+        qdrant_url=qdrant_service.base_url,
+        collection=qdrant_service.collection_name,
+        start=False,
+    )
+    if os.getenv("CLIP_QDRANT_SYNC", "1") != "0"
+    else None
+)
+
+asset_writer = AssetWriter(asset_store, on_commit=qdrant_sync.notify if qdrant_sync else None, start=False)
+
+# 内存向量索引（按素材存储的 generation 失效重建）
+# 素材数达到 CLIP_ANN_MIN_ROWS 后自动建立 IVF 近似索引（CLIP_ANN=0 关闭，始终精确检索）
+# CLIP_INDEX_QUANTIZATION=float16/int8：常驻内存的是压缩向量，短名单（CLIP_INDEX_RERANK 行）用全精度向量重排
+INDEX_QUANTIZATION = os.getenv("CLIP_INDEX_QUANTIZATION", "none")
+PCA_PROJECTION = Path(os.getenv("CLIP_PCA_PROJECTION") or asset_store.root / PROJECTION_FILE)
+search_index = EmbeddingIndex(
+    asset_store,
+    ann=IVFIndex(
+        asset_store.root / "ann",
+        nlist=int(os.getenv("CLIP_ANN_NLIST", "0")),
+        nprobe=int(os.getenv("CLIP_ANN_NPROBE", "16")),
+        min_rows=int(os.getenv("CLIP_ANN_MIN_ROWS", "20000")),
+    ) if os.getenv("CLIP_ANN", "1") != "0" else None,
+    quantizer=QuantizedVectors(INDEX_QUANTIZATION) if INDEX_QUANTIZATION != "none" else None,
+    rerank=int(os.getenv("CLIP_INDEX_RERANK", "0")),
+    # binary 检索模式：每个素材64字节的符号位编码（CLIP_BINARY_INDEX=0 关闭）
+    binary=QuantizedVectors("binary") if os.getenv("CLIP_BINARY_INDEX", "1") != "0" else None,
+    binary_shortlist=int(os.getenv("CLIP_BINARY_SHORTLIST", "2000")),
+    # pca 检索模式：离线拟合的降维投影（python pca_projection.py fit），不存在时不启用
+    pca=(
+        QuantizedVectors("pca", projection=PCAProjection.load(PCA_PROJECTION))
+        if PCA_PROJECTION.exists() else None
+    ),
+    pca_shortlist=int(os.getenv("CLIP_PCA_SHORTLIST", "200")),
+    # 过滤命中占比不超过 CLIP_PREFILTER_FRACTION 时只对命中行打分，否则全量打分后屏蔽
+    prefilter_fraction=float(os.getenv("CLIP_PREFILTER_FRACTION", "0.15")),
+    tag_categories=TAG_CATEGORIES,
+    # 写入后在后台线程重建，两次重建至少间隔 CLIP_INDEX_REFRESH_INTERVAL 秒（期间的写入合并）
+    refresh_interval=float(os.getenv("CLIP_INDEX_REFRESH_INTERVAL", "1.0")),
+)
+
+async def refresh_search_index(wait: bool = False):
+    """
+    有新写入时在后台重建检索索引，不阻塞事件循环
+
+    默认用当前快照检索（新写入在重建完成后可见）；尚未建立过索引或 wait=True 时等待重建完成
+    """
+    pending = search_index.refresh_async()
+    if pending is not None and (wait or not search_index.ready):
+        await asyncio.wrap_future(pending)
+
+def build_where(filter_tags: Optional[List[str]], filter_expr: Optional[Dict]) -> Optional[Dict]:
+    """filter_tags（任一标签）与过滤表达式按 and 组合"""
+    parts = []
+    if filter_tags:
+        parts.append({"tag": filter_tags})
+    if filter_expr:
+        parts.append(filter_expr)
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else {"and": parts}
+
+# Qdrant 检索的 MMR 候选向量按 point id 从本地向量文件读取，不再让 Qdrant 以JSON返回向量
+point_vectors = PointVectorCache(search_index) if os.getenv("CLIP_QDRANT_VECTOR_CACHE", "1") != "0" else None
+if point_vectors is not None:
+    qdrant_service.vector_lookup = point_vectors.lookup
+
+def format_search_match(row: Dict, similarity: float) -> Dict:
+    """将索引行元数据格式化为搜索结果"""
+    return {
+        "filePath": row.get('filePath'),
+        "shotId": row.get('shotId'),
+        "label": row.get('label'),
+        "similarity": round(similarity, 4),
+        "tags": row.get('tags', []),
+        "description": row.get('description', ''),
+        "emotions": row.get('emotions', []),
+        "duration": row.get('duration', 5.0)
+    }
 
 @app.get("/", response_class=HTMLResponse)
 async def admin_page():
@@ -371,54 +636,77 @@ async def clip_status():
         "model": clip_manager.model_name,
         "device": clip_manager.device,
         "tags_count": len(ALL_TAGS),
-        "categories": list(PREDEFINED_TAGS.keys())
+        "categories": list(PREDEFINED_TAGS.keys()),
+        "query_cache": clip_manager.query_cache.stats() if clip_manager.query_cache else None,
+        "writer": asset_writer.stats(),
+        "qdrant_sync": qdrant_sync.stats() if qdrant_sync else None,
+        "point_vectors": point_vectors.stats() if point_vectors else None,
+        "search_index": search_index.stats(),
+        "scan_manifest": scan_manifest.stats(),
+        "decode_backend": get_decoder().name,
+        "decode_cost": {**seek_cost_model.stats(), "seek_gap": seek_cost_model.seek_gap()},
+        "ingest": {
+            job.id: job.pipeline.stats()
+            for job in scan_jobs.list()
+            if job.status == RUNNING and job.pipeline is not None
+        }
     }
 
+@app.on_event("startup")
+async def start_background_workers():
+    """启动单写者与 Qdrant 增量同步线程（扫描任务线程池在提交第一个任务时才创建线程）"""
+    # 多进程扫描的进程池须在任何后台线程启动之前 fork
+    start_scan_pool()
+    asset_writer.start()
+    if qdrant_sync is not None:
+        qdrant_sync.start()
+
+@app.on_event("shutdown")
+async def flush_asset_writer():
+    """停止前取消进行中的扫描任务，写完排队中的保存请求，并关闭 Qdrant 连接池"""
+    scan_jobs.shutdown()
+    if scan_pool is not None:
+        scan_pool.terminate()
+    await asyncio.to_thread(asset_writer.close, 30)
+    if qdrant_sync is not None:
+        await asyncio.to_thread(qdrant_sync.close, 10)
+    await qdrant_service.aclose()
+
 class SaveResultsRequest(BaseModel):
     results: List[Dict]
 
 @app.post("/clip/save-results")
 async def save_results(request: SaveResultsRequest):
-    """保存处理结果到JSON文件"""
+    """保存处理结果到素材存储（按文件路径upsert，经单写者组提交）"""
     try:
-        # 加载现有结果
-        existing = []
-        if RESULTS_FILE.exists():
-            with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
-                existing = json.load(f)
-        
-        # 合并新结果（按文件路径去重）
-        existing_paths = {r.get('filePath') for r in existing}
-        for result in request.results:
-            if result.get('filePath') not in existing_paths:
-                existing.append(result)
-            else:
-                # 更新已存在的
-                for i, e in enumerate(existing):
-                    if e.get('filePath') == result.get('filePath'):
-                        existing[i] = result
-                        break
+        saved = await asyncio.wrap_future(asset_writer.submit(request.results))
+        total = len(asset_store)
         
-        # 保存
-        with open(RESULTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(existing, f, ensure_ascii=False, indent=2)
+        logger.info(f"保存了 {saved} 个结果，总计 {total} 个")
         
-        logger.info(f"保存了 {len(request.results)} 个结果，总计 {len(existing)} 个")
-        
-        return {"status": "success", "saved": len(request.results), "total": len(existing)}
+        return {"status": "success", "saved": saved, "total": total}
     except Exception as e:
         logger.error(f"保存结果失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class PruneRequest(BaseModel):
+    directory: Optional[str] = None     # 只检查该目录下的素材（默认全部）
+    dry_run: bool = False
+
+@app.post("/clip/prune")
+async def prune_missing(request: PruneRequest):
+    """删除文件已不存在的素材（Qdrant 中对应的点经发件箱同步删除）"""
+    missing = await asyncio.to_thread(asset_store.missing_paths, request.directory)
+    deleted = 0
+    if missing and not request.dry_run:
+        deleted = await asyncio.wrap_future(asset_writer.submit_delete(missing))
+    logger.info(f"清理不存在的文件: 发现 {len(missing)} 个，删除 {deleted} 个")
+    return {"status": "success", "missing": missing, "deleted": deleted, "total": len(asset_store)}
+
 @app.get("/clip/results")
 async def get_results():
-    """获取已处理的结果"""
-    if not RESULTS_FILE.exists():
-        return {"results": [], "total": 0}
-    
-    with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
-        results = json.load(f)
-    
+    """获取已处理的结果（旧版JSON格式）"""
+    results = asset_store.load_items()
     return {"results": results, "total": len(results)}
 
 # ============================================
@@ -441,74 +729,43 @@ async def search_by_text(request: SearchRequest):
     - "紧张的氛围"
     """
     logger.info(f"文字搜索: '{request.query}', top_k={request.top_k}")
+    if request.mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode 须为 {', '.join(SEARCH_MODES)}")
     
-    # 确保模型已加载
-    clip_manager.load_model()
+    # 确保模型已加载（首次加载耗时数秒，不在事件循环中执行）
+    await asyncio.to_thread(clip_manager.load_model)
     
-    # 加载已处理的结果
-    if not RESULTS_FILE.exists():
-        return {
-            "status": "success",
-            "query": request.query,
-            "results": [],
-            "total": 0,
-            "message": "暂无已处理的视频数据，请先使用 /clip/scan 扫描视频目录"
-        }
+    await refresh_search_index()
     
-    with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
-        all_results = json.load(f)
-    
-    if not all_results:
+    if search_index.total_items == 0:
         return {
             "status": "success",
             "query": request.query,
             "results": [],
             "total": 0,
-            "message": "暂无已处理的视频数据"
+            "message": "暂无已处理的视频数据，请先使用 /clip/scan 扫描视频目录"
         }
     
-    # 编码查询文本
-    query_embedding = clip_manager.encode_text(request.query)
-    
-    # 计算相似度
-    matches = []
-    for item in all_results:
-        # 检查是否有embeddings
-        clip_metadata = item.get('clipMetadata', {})
-        embeddings = clip_metadata.get('embeddings')
-        
-        if not embeddings:
-            continue
-        
-        # 标签过滤
-        if request.filter_tags:
-            item_tags = clip_metadata.get('tags', [])
-            if not any(tag in item_tags for tag in request.filter_tags):
-                continue
-        
-        # 计算相似度
-        similarity = clip_manager.compute_similarity(query_embedding, embeddings)
-        
-        # 阈值过滤
-        if similarity < request.threshold:
-            continue
-        
-        matches.append({
-            "filePath": item.get('filePath'),
-            "shotId": item.get('shotId'),
-            "label": item.get('label', Path(item.get('filePath', '')).stem),
-            "similarity": round(similarity, 4),
-            "tags": clip_metadata.get('tags', []),
-            "description": clip_metadata.get('description', ''),
-            "emotions": clip_metadata.get('emotions', []),
-            "duration": item.get('duration', 5.0)
-        })
-    
-    # 按相似度排序
-    matches.sort(key=lambda x: x['similarity'], reverse=True)
-    
-    # 取top_k
-    top_matches = matches[:request.top_k]
+    def encode_and_search():
+        # 编码查询文本
+        query_embedding = clip_manager.encode_text(request.query)
+        # 一次矩阵-向量乘 + top-k（已按相似度降序、已应用阈值）；过滤条件经倒排索引限定参与打分的行
+        return search_index.search(
+            query_embedding,
+            top_k=request.top_k,
+            threshold=request.threshold,
+            mode=request.mode,
+            nprobe=request.nprobe,
+            shortlist=request.shortlist,
+            where=build_where(request.filter_tags, request.filter),
+        )
+
+    # 文本塔前向与打分都是CPU密集计算，在线程中执行，不阻塞事件循环上的其他请求
+    try:
+        hits = await asyncio.to_thread(encode_and_search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    top_matches = [format_search_match(row, similarity) for row, similarity in hits]
     
     logger.info(f"搜索完成: 找到 {len(top_matches)} 个匹配结果")
     
@@ -521,15 +778,15 @@ async def search_by_text(request: SearchRequest):
         "query": request.query,
         "results": top_matches,
         "total": len(top_matches),
-        "searched": len(all_results),
+        "searched": search_index.total_items,
         "min_similarity": round(min_similarity, 4),
         "avg_similarity": round(avg_similarity, 4)
     }
 
 @app.get("/clip/search")
-async def search_by_text_get(query: str, top_k: int = 10, threshold: float = 0.3):
+async def search_by_text_get(query: str, top_k: int = 10, threshold: float = 0.3, mode: str = "auto"):
     """GET方式的文字搜索（便于浏览器测试）"""
-    request = SearchRequest(query=query, top_k=top_k, threshold=threshold)
+    request = SearchRequest(query=query, top_k=top_k, threshold=threshold, mode=mode)
     return await search_by_text(request)
 
 class MultiSearchRequest(BaseModel):
@@ -550,52 +807,206 @@ async def search_multi_query(request: MultiSearchRequest):
     top_k = request.top_k
     logger.info(f"多条件搜索: {queries}")
     
-    clip_manager.load_model()
+    await asyncio.to_thread(clip_manager.load_model)
     
-    if not RESULTS_FILE.exists():
-        return {"status": "success", "results": [], "total": 0}
+    await refresh_search_index()
     
-    with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
-        all_results = json.load(f)
+    if search_index.total_items == 0 or not queries:
+        return {"status": "success", "queries": queries, "results": [], "total": 0}
     
-    # 编码所有查询
-    query_embeddings = [clip_manager.encode_text(q) for q in queries]
+    # 所有查询一次文本塔前向，再与素材矩阵做一次矩阵乘（在线程中执行）
+    hits = await asyncio.to_thread(
+        lambda: search_index.search_combined(clip_manager.encode_texts(queries), top_k=top_k)
+    )
     
     matches = []
-    for item in all_results:
-        clip_metadata = item.get('clipMetadata', {})
-        embeddings = clip_metadata.get('embeddings')
-        
-        if not embeddings:
-            continue
-        
-        # 计算每个查询的相似度，取平均
-        similarities = [
-            clip_manager.compute_similarity(qe, embeddings) 
-            for qe in query_embeddings
-        ]
-        avg_similarity = sum(similarities) / len(similarities)
-        
+    for row, avg_similarity, similarities in hits:
         matches.append({
-            "filePath": item.get('filePath'),
-            "shotId": item.get('shotId'),
-            "label": item.get('label', Path(item.get('filePath', '')).stem),
+            "filePath": row.get('filePath'),
+            "shotId": row.get('shotId'),
+            "label": row.get('label'),
             "similarity": round(avg_similarity, 4),
             "query_scores": {q: round(s, 4) for q, s in zip(queries, similarities)},
-            "tags": clip_metadata.get('tags', []),
-            "description": clip_metadata.get('description', ''),
-            "duration": item.get('duration', 5.0)
+            "tags": row.get('tags', []),
+            "description": row.get('description', ''),
+            "duration": row.get('duration', 5.0)
         })
     
-    matches.sort(key=lambda x: x['similarity'], reverse=True)
-    
     return {
         "status": "success",
         "queries": queries,
-        "results": matches[:top_k],
-        "total": len(matches[:top_k])
+        "results": matches,
+        "total": len(matches)
     }
 
+class BatchSearchRequest(BaseModel):
+    """批量搜索请求：每个查询独立返回 top-k"""
+    queries: List[str]
+    top_k: int = 10
+    threshold: float = 0.02
+    filter_tags: Optional[List[str]] = None
+    filter: Optional[Dict] = None       # 过滤表达式，同 SearchRequest.filter
+    mode: str = "auto"
+    nprobe: int = 0
+    shortlist: int = 0
+
+@app.post("/clip/search-batch")
+async def search_batch(request: BatchSearchRequest):
+    """
+    批量文字搜索
+
+    一次请求提交多个查询（如整部分镜的所有段落），
+    查询统一批量编码、与素材矩阵一次矩阵乘，每个查询返回独立的 top-k 结果。
+    """
+    queries = request.queries
+    logger.info(f"批量搜索: {len(queries)} 个查询, top_k={request.top_k}")
+    if request.mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode 须为 {', '.join(SEARCH_MODES)}")
+    
+    await asyncio.to_thread(clip_manager.load_model)
+    
+    await refresh_search_index()
+    
+    if search_index.total_items == 0 or not queries:
+        return {
+            "status": "success",
+            "results": [{"query": q, "results": [], "total": 0} for q in queries],
+            "total": len(queries),
+            "searched": 0
+        }
+    
+    def encode_and_search():
+        return search_index.search_batch(
+            clip_manager.encode_texts(queries),
+            top_k=request.top_k,
+            threshold=request.threshold,
+            mode=request.mode,
+            nprobe=request.nprobe,
+            shortlist=request.shortlist,
+            where=build_where(request.filter_tags, request.filter),
+        )
+
+    # 批量编码与打分在线程中执行，不阻塞事件循环
+    try:
+        batch_hits = await asyncio.to_thread(encode_and_search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    results = []
+    for query, hits in zip(queries, batch_hits):
+        matches = [format_search_match(row, similarity) for row, similarity in hits]
+        results.append({"query": query, "results": matches, "total": len(matches)})
+    
+    return {
+        "status": "success",
+        "results": results,
+        "total": len(results),
+        "searched": search_index.total_items
+    }
+
+class AnnCalibrateRequest(BaseModel):
+    """近似检索召回率校准：对比精确检索"""
+    mode: str = "ivf"                     # ivf：按 nprobe；binary / pca / auto：按短名单大小
+    nprobes: Optional[List[int]] = None   # 默认 1,2,4,...,64
+    shortlists: Optional[List[int]] = None  # 默认 500,1000,2000,5000（binary）/ 50,100,200,500（pca / auto）
+    queries: Optional[List[str]] = None   # 文字查询；为空时以库内向量为查询
+    top_k: int = 10
+    samples: int = 200
+
+@app.get("/clip/ann")
+async def ann_status():
+    """检索索引状态（IVF 近似索引、压缩向量与内存占用）"""
+    await refresh_search_index(wait=True)
+    return {"status": "success", **search_index.stats()}
+
+@app.post("/clip/ann/calibrate")
+async def ann_calibrate(request: AnnCalibrateRequest):
+    """
+    报告近似检索相对精确检索的 recall@k 与单次查询耗时，用于按库规模选择参数：
+    ivf 报告各 nprobe（CLIP_ANN_NPROBE），binary / pca / auto 报告各短名单大小
+    （CLIP_BINARY_SHORTLIST / CLIP_PCA_SHORTLIST / CLIP_INDEX_RERANK）
+    """
+    await refresh_search_index(wait=True)
+    query_vectors = None
+    if request.queries:
+        await asyncio.to_thread(clip_manager.load_model)
+        query_vectors = await asyncio.to_thread(clip_manager.encode_texts, request.queries)
+
+    if request.mode == "ivf":
+        if search_index.ann is None or not search_index.ann.ready:
+            raise HTTPException(status_code=409, detail="IVF 索引未启用或素材数不足 CLIP_ANN_MIN_ROWS")
+        report = await asyncio.to_thread(
+            search_index.ann_recall, request.nprobes, request.top_k, request.samples, query_vectors
+        )
+    elif request.mode in ("binary", "pca", "auto"):
+        if request.mode == "binary" and search_index.binary is None:
+            raise HTTPException(status_code=409, detail="符号位粗筛未启用（CLIP_BINARY_INDEX=0）")
+        if request.mode == "pca" and search_index.pca is None:
+            raise HTTPException(status_code=409, detail="PCA 降维未启用（先运行 python pca_projection.py fit）")
+        shortlists = request.shortlists or ([500, 1000, 2000, 5000] if request.mode == "binary" else [50, 100, 200, 500])
+        report = await asyncio.to_thread(
+            search_index.recall_report,
+            [{"mode": request.mode, "shortlist": size} for size in shortlists],
+            request.top_k,
+            request.samples,
+            query_vectors,
+        )
+    else:
+        raise HTTPException(status_code=400, detail="mode 须为 ivf、binary、pca 或 auto")
+    return {"status": "success", "rows": len(search_index), "top_k": request.top_k, "report": report}
+
+class QdrantSearchRequest(BaseModel):
+    """Qdrant 混合检索请求（向量检索 + 标签/场景过滤 + MMR）"""
+    queries: List[str]
+    top_k: int = 10
+    threshold: float = 25.0             # 百分制
+    filter_tags: Optional[List[str]] = None
+    filter_scene: Optional[str] = None
+    filter: Optional[Dict] = None       # 过滤表达式（不支持 path），转换为 Qdrant 索引字段上的 must / should / must_not
+    enable_mmr: bool = True
+    mmr_lambda: float = 0.7
+
+@app.post("/clip/qdrant-search")
+async def qdrant_search(request: QdrantSearchRequest):
+    """
+    基于 Qdrant 的批量混合检索
+
+    查询统一批量编码，所有查询合并为一次 search/batch 请求（连接池复用、异步I/O，不阻塞事件循环），
+    每个查询独立做 MMR 多样性重排。
+    """
+    queries = request.queries
+    if not queries:
+        return {"status": "success", "results": [], "total": 0}
+    logger.info(f"Qdrant检索: {len(queries)} 个查询, top_k={request.top_k}")
+
+    try:
+        payload_filter = qdrant_filter(request.filter, TAG_CATEGORIES) if request.filter else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await asyncio.to_thread(clip_manager.load_model)
+    query_embeddings = await asyncio.to_thread(clip_manager.encode_texts, queries)
+    try:
+        batch = await qdrant_service.ahybrid_search_batch(
+            [embedding.tolist() for embedding in query_embeddings],
+            top_k=request.top_k,
+            threshold=request.threshold,
+            filter_tags=request.filter_tags,
+            filter_scene=request.filter_scene,
+            enable_mmr=request.enable_mmr,
+            mmr_lambda=request.mmr_lambda,
+            payload_filter=payload_filter,
+        )
+    except Exception as e:
+        logger.error(f"Qdrant检索失败: {e}")
+        raise HTTPException(status_code=502, detail=f"Qdrant检索失败: {e}")
+
+    results = [
+        {"query": query, "results": hits, "total": len(hits)}
+        for query, hits in zip(queries, batch)
+    ]
+    return {"status": "success", "results": results, "total": len(results)}
+
 @app.post("/clip/list")
 async def list_files(request: ListRequest):
     """快速列出目录中的视频文件（不做CLIP处理）"""
@@ -636,99 +1047,358 @@ async def list_files(request: ListRequest):
         }
     }
 
-@app.get("/clip")
-async def clip_status():
-    """CLIP服务状态"""
+def fingerprint_for(fingerprint: FileFingerprint) -> FileFingerprint:
+    """未做增量判定的文件（skip_processed=False）在记录清单时补充 stat"""
+    if fingerprint.size >= 0:
+        return fingerprint
+    st = os.stat(fingerprint.path)
+    return FileFingerprint(fingerprint.path, st.st_size, st.st_mtime_ns)
+
+def scan_error_entry(video_path: str, error: str) -> Dict:
     return {
-        "status": "ok",
-        "model": clip_manager.model_name,
-        "device": clip_manager.device,
-        "tags_count": len(ALL_TAGS),
-        "categories": list(PREDEFINED_TAGS.keys())
+        "filePath": video_path,
+        "shotId": f"shot_{hash(video_path) % 100000}",
+        "clipMetadata": {},
+        "status": "error",
+        "error": error
     }
 
-@app.post("/clip/scan")
-async def scan_directory(request: ScanRequest):
-    """批量扫描并处理目录中的视频"""
-    logger.info(f"扫描目录: {request.directory}")
+# 扫描解码线程数（0 = 按CPU核数自动选择）
+CLIP_DECODE_WORKERS = int(os.getenv("CLIP_DECODE_WORKERS", "0"))
+# 多进程扫描的默认进程数（0/1 = 单进程线程流水线）与每个进程的 torch 线程数（0 = CPU核数 ÷ 进程数）
+CLIP_SCAN_PROCESSES = int(os.getenv("CLIP_SCAN_PROCESSES", "0"))
+CLIP_SCAN_THREADS = int(os.getenv("CLIP_SCAN_THREADS", "0"))
+
+# 多进程扫描的常驻进程池（服务启动时创建，未启用或不可用时为 None）
+scan_pool = None
+
+def start_scan_pool():
+    """
+    服务启动时创建多进程扫描进程池
+
+    fork 只复制调用线程：必须在写线程、同步线程、扫描任务线程启动之前调用，
+    子进程中才不会残留被其他线程持有的锁。模型先在本进程加载，各工作进程按写时复制共享权重。
+    """
+    global scan_pool
+    if CLIP_SCAN_PROCESSES <= 1 or scan_pool is not None:
+        return
+    clip_manager.load_model()
+    if clip_manager.device != "cpu" or not fork_available():
+        logger.warning("多进程扫描需要CPU推理且平台支持fork，扫描任务使用线程流水线")
+        return
+    scan_pool = fork_pool(scan_chunk_task, CLIP_SCAN_PROCESSES, CLIP_SCAN_THREADS)
+
+def decode_middle_frame(path: str, keyframes_only: bool):
+    """提取关键帧，使用中间帧进行分析"""
+    frames, decode_stats = extract_keyframes_with_stats(path, num_frames=5, keyframes_only=keyframes_only)
+    if not frames:
+        return None, decode_stats
+    return frames[len(frames) // 2], decode_stats
+
+def scan_chunk_task(chunk: List[FileFingerprint], keyframes_only: bool, batch_size: int):
+    """在扫描工作进程中执行：逐文件解码，整块一次批量推理"""
+    outcomes, frames = [], []
+    for fingerprint in chunk:
+        try:
+            frame, decode_stats = decode_middle_frame(fingerprint.path, keyframes_only)
+        except Exception as e:
+            outcomes.append(("error", fingerprint, str(e)))
+            continue
+        if frame is None:
+            outcomes.append(("empty", fingerprint, decode_stats))
+        else:
+            outcomes.append(("ok", fingerprint, decode_stats))
+            frames.append(frame)
+    analyses, error = [], None
+    if frames:
+        try:
+            analyses = clip_manager.analyze_frames(frames, batch_size=batch_size)
+        except Exception as e:
+            # 批量推理失败时，整块已解码的文件标记为失败
+            error = str(e)
+    analyses = iter(analyses)
+    results = []
+    for kind, fingerprint, extra in outcomes:
+        if kind != "ok":
+            results.append((kind, fingerprint, extra))
+        elif error is not None:
+            results.append(("error", fingerprint, error))
+        else:
+            results.append(("ok", fingerprint, (extra, next(analyses))))
+    return results
+
+def scan_status_entry(entry: Dict) -> Dict:
+    """persist 模式下的轻量结果行（不含向量与描述）"""
+    return {
+        "filePath": entry["filePath"],
+        "shotId": entry["shotId"],
+        "status": entry["status"],
+        "persisted": True,
+        "tags": entry["clipMetadata"]["tags"],
+        "decodeTime": entry["decodeTime"],
+    }
+
+def run_scan_job(job: ScanJob):
+    """在扫描工作线程中执行目录扫描，逐文件上报结果（续扫时跳过已处理的文件）"""
+    request = ScanRequest(**job.request)
     
     # 确保模型已加载
     clip_manager.load_model()
     
     # 获取视频文件
     video_files = get_video_files(request.directory, request.file_patterns)
-    logger.info(f"发现 {len(video_files)} 个视频文件")
+    logger.info(f"[{job.id}] 发现 {len(video_files)} 个视频文件")
+    job.set_total(len(video_files))
     
-    processed_files = []
-    failed_count = 0
+    # 增量扫描：按清单只处理新增或变化的文件（续扫时已处理的文件不再参与判定）
+    if request.skip_processed:
+        fingerprints, skipped = plan_scan(
+            video_files, job.done_paths, scan_manifest, clip_manager.model_name, asset_store.file_paths()
+        )
+        job.add_skipped(skipped)
+        logger.info(f"[{job.id}] 跳过未变化的文件 {len(skipped)} 个，待处理 {len(fingerprints)} 个")
+    else:
+        fingerprints, _ = plan_scan(video_files, job.done_paths, None)
+    job.emit("progress", job.progress())
     
-    for video_path in video_files:
-        try:
-            # 提取关键帧
-            frames = extract_keyframes_from_video(video_path, num_frames=5)
-            
-            if not frames:
-                failed_count += 1
-                continue
-            
-            # 使用中间帧进行分析
-            main_frame = frames[len(frames) // 2]
-            
-            # 获取标签
-            tags_result = clip_manager.get_tags(main_frame, top_k=5)
-            tags = [t["tag"] for t in tags_result]
-            
-            # 获取描述
-            description = clip_manager.generate_description(main_frame)
-            
-            # 获取情绪
-            emotions = clip_manager.detect_emotions(main_frame)
-            
-            # 获取embeddings
-            embeddings = clip_manager.encode_image(main_frame).tolist()
-            
-            from datetime import datetime
-            
+    batch_size = max(1, request.batch_size)
+
+    def persist(records):
+        entries = []
+        for fingerprint, decode_stats, analysis in records:
             metadata = {
-                "embeddings": embeddings,
-                "tags": tags,
-                "description": description,
-                "emotions": emotions,
+                "embeddings": analysis["embeddings"],
+                "tags": analysis["tags"],
+                "description": analysis["description"],
+                "emotions": analysis["emotions"],
                 "keyframes": None,  # 可选保存关键帧
                 "processed_at": datetime.now().isoformat(),
                 "model_version": request.model_version,
             }
-            
-            processed_files.append({
-                "filePath": video_path,
-                "shotId": f"shot_{hash(video_path) % 100000}",
+            entries.append({
+                "filePath": fingerprint.path,
+                "shotId": f"shot_{hash(fingerprint.path) % 100000}",
                 "clipMetadata": metadata,
-                "status": "success"
-            })
-            
-        except Exception as e:
-            logger.error(f"处理失败 {video_path}: {e}")
-            failed_count += 1
-            processed_files.append({
-                "filePath": video_path,
-                "shotId": f"shot_{hash(video_path) % 100000}",
-                "clipMetadata": {},
-                "status": "error",
-                "error": str(e)
+                "status": "success",
+                "decodeTime": round(decode_stats.decode_time, 4)
             })
+
+        if request.persist:
+            # 服务端直接入库（经单写者与其他保存请求合并提交），任务中只保留不含向量的状态行
+            try:
+                asset_writer.submit(entries).result()
+            except Exception as e:
+                logger.error(f"扫描结果入库失败: {e}")
+                for entry in entries:
+                    job.add_result(scan_error_entry(entry["filePath"], f"入库失败: {e}"))
+                return
+            entries = [scan_status_entry(entry) for entry in entries]
+
+        for entry in entries:
+            job.add_result(entry)
+        try:
+            scan_manifest.record(
+                [fingerprint_for(fingerprint) for fingerprint, _, _ in records], clip_manager.model_name
+            )
+        except OSError as e:
+            logger.warning(f"扫描清单记录失败: {e}")
+
+    def on_error(fingerprint: FileFingerprint, error: Exception):
+        logger.error(f"处理失败 {fingerprint.path}: {error}")
+        job.add_result(scan_error_entry(fingerprint.path, str(error)))
+
+    use_processes = request.workers < 0 or request.workers > 1
+    if use_processes and scan_pool is None and request.workers > 1:
+        # 进程池只能在服务启动时（后台线程启动前）fork，请求中不能临时创建
+        logger.warning(f"[{job.id}] 服务未启用多进程扫描（CLIP_SCAN_PROCESSES），改用线程流水线")
+
+    if use_processes and scan_pool is not None:
+        def merge_chunk(chunk, outcomes):
+            records = []
+            for kind, fingerprint, extra in outcomes:
+                if kind == "ok":
+                    decode_stats, analysis = extra
+                    job.add_decode_time(decode_stats.decode_time)
+                    records.append((fingerprint, decode_stats, analysis))
+                elif kind == "empty":
+                    job.add_decode_time(extra.decode_time)
+                    job.add_failure(fingerprint.path)
+                else:
+                    on_error(fingerprint, Exception(extra))
+            if records:
+                persist(records)
+
+        pool = ProcessScanPool(scan_pool, CLIP_SCAN_PROCESSES, CLIP_SCAN_THREADS)
+        job.pipeline = pool
+        pool.run(
+            fingerprints, merge_chunk, chunk_size=batch_size, cancelled=lambda: job.cancelled,
+            args=(request.keyframes_only, batch_size),
+        )
+        logger.info(f"[{job.id}] 多进程扫描统计: {pool.stats()}")
+        return
+
+    def decode_and_count(fingerprint: FileFingerprint):
+        frame, decode_stats = decode_middle_frame(fingerprint.path, request.keyframes_only)
+        job.add_decode_time(decode_stats.decode_time)
+        return frame, decode_stats
+
+    # 解码线程池 → 有界帧队列 → 跨视频批量推理 → 持久化线程，三个阶段互相重叠
+    pipeline = IngestPipeline(
+        decode_fn=decode_and_count,
+        infer_fn=lambda frames: clip_manager.analyze_frames(frames, batch_size=batch_size),
+        persist_fn=persist,
+        on_error=on_error,
+        on_empty=lambda fingerprint: job.add_failure(fingerprint.path),
+        decode_workers=request.decode_workers or CLIP_DECODE_WORKERS,
+        batch_size=batch_size,
+        queue_size=request.queue_size,
+    )
+    job.pipeline = pipeline
+    # 取消时不再解码新文件，已解码的帧照常推理并写入，续扫不必重新解码
+    pipeline.run(fingerprints, cancelled=lambda: job.cancelled)
+    logger.info(f"[{job.id}] 流水线统计: {pipeline.stats()}")
+
+# 扫描任务线程池（默认单线程：视觉塔通常独占GPU/CPU，多任务排队执行）
+# 已结束任务的逐文件结果（含向量）总量超过 CLIP_SCAN_RESULT_BUDGET_MB 时从最早的任务开始释放
+scan_jobs = ScanJobManager(
+    run_scan_job,
+    max_workers=int(os.getenv("CLIP_SCAN_WORKERS", "1")),
+    max_result_bytes=int(float(os.getenv("CLIP_SCAN_RESULT_BUDGET_MB", "512")) * 1024 * 1024),
+)
+
+@app.post("/clip/scan")
+async def scan_directory(request: ScanRequest):
+    """
+    批量扫描并处理目录中的视频
+
+    以任务形式在工作线程中执行并等待完成，事件循环不被阻塞（扫描期间搜索照常响应）。
+    长时间扫描建议使用 POST /clip/jobs 提交后轮询或订阅进度。
+    """
+    logger.info(f"扫描目录: {request.directory}")
+    job = scan_jobs.submit(request.dict())
+    if request.stream:
+        return StreamingResponse(ndjson_job_stream(job), media_type="application/x-ndjson")
+    try:
+        await asyncio.wrap_future(job.future)
+    except asyncio.CancelledError:
+        # 排队中被 /clip/jobs/{id}/cancel 取消时返回空结果；其余情况（如客户端断开）照常传播
+        if job.status != CANCELLED:
+            raise
+    
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    
+    if request.persist:
+        # 结果已在服务端入库，只返回汇总（逐文件状态可通过 /clip/jobs/{id} 查询）
+        return {"status": "success", "job_id": job.id, "persisted": True, "summary": job.summary()}
     
+    # 结果已交给客户端，释放任务中保存的向量
+    processed_files = job.results_from(0)
+    job.release_results()
     return {
         "status": "success",
+        "job_id": job.id,
         "processedFiles": processed_files,
-        "summary": {
-            "totalFiles": len(video_files),
-            "processed": len(video_files) - failed_count,
-            "skipped": 0,
-            "failed": failed_count,
-            "processingTime": 0
-        }
+        "summary": job.summary()
     }
 
+async def ndjson_job_stream(job: ScanJob):
+    """NDJSON：每处理完一个文件输出一行结果，最后一行为 {"event": "done", ...}"""
+    cursor = 0
+    while True:
+        events = job.events_since(cursor)
+        cursor += len(events)
+        for event in events:
+            if event["event"] == "file":
+                # 事件中不含向量，从任务结果中取完整条目输出
+                result = job.result_at(event["data"]["index"]) or event["data"]
+                yield json.dumps({"event": "file", **result}, ensure_ascii=False) + "\n"
+        if job.status in FINISHED_STATES and not job.events_since(cursor):
+            break
+        await asyncio.sleep(0.5)
+    yield json.dumps(
+        {"event": "done", "job_id": job.id, "status": job.status, "error": job.error, "summary": job.summary()},
+        ensure_ascii=False,
+    ) + "\n"
+    job.release_results()
+
+@app.post("/clip/jobs")
+async def submit_scan_job(request: ScanRequest):
+    """提交扫描任务，立即返回任务id"""
+    logger.info(f"提交扫描任务: {request.directory}")
+    job = scan_jobs.submit(request.dict())
+    return {"status": "success", "job_id": job.id, "job": job.to_dict()}
+
+@app.get("/clip/jobs")
+async def list_scan_jobs():
+    """列出扫描任务（不含逐文件结果）"""
+    jobs = [job.to_dict() for job in scan_jobs.list()]
+    return {"jobs": jobs, "total": len(jobs)}
+
+def get_scan_job_or_404(job_id: str) -> ScanJob:
+    job = scan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@app.get("/clip/jobs/{job_id}")
+async def get_scan_job(job_id: str, include_results: bool = False, offset: int = 0):
+    """
+    查询扫描任务状态与进度
+
+    include_results=true 时返回 processedFiles（从 offset 开始，便于增量拉取；
+    已释放的结果不再返回，released_results 为已释放的条数）
+    """
+    job = get_scan_job_or_404(job_id)
+    data = job.to_dict()
+    if include_results:
+        data["processedFiles"] = job.results_from(offset)
+        data["offset"] = offset
+    return data
+
+@app.get("/clip/jobs/{job_id}/events")
+async def stream_scan_job(job_id: str, since: int = 0):
+    """
+    SSE 订阅任务事件：progress（进度）、file（单个文件结果，不含向量；index 为结果序号）、done（任务结束）
+
+    since 为起始事件id，断线重连时可从上次收到的id+1继续
+    """
+    job = get_scan_job_or_404(job_id)
+
+    async def event_stream():
+        cursor = since
+        while True:
+            events = job.events_since(cursor)
+            for event in events:
+                payload = json.dumps(event["data"], ensure_ascii=False)
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {payload}\n\n"
+            cursor += len(events)
+            if job.status in FINISHED_STATES and not job.events_since(cursor):
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/clip/jobs/{job_id}/cancel")
+async def cancel_scan_job(job_id: str):
+    """取消扫描任务（当前批次写完后停止，已得到的结果保留）"""
+    job = get_scan_job_or_404(job_id)
+    scan_jobs.cancel(job_id)
+    return {"status": "success", "job": job.to_dict()}
+
+@app.post("/clip/jobs/{job_id}/resume")
+async def resume_scan_job(job_id: str):
+    """续扫已取消或失败的任务，已处理的文件不再重复处理"""
+    job = get_scan_job_or_404(job_id)
+    if job.status not in (CANCELLED, FAILED):
+        raise HTTPException(status_code=409, detail=f"任务状态为 {job.status}，无法续扫")
+    scan_jobs.resume(job_id)
+    return {"status": "success", "job": job.to_dict()}
+
 @app.post("/clip/process")
 async def process_single_file(request: ProcessRequest):
     """处理单个视频文件"""
@@ -747,29 +1417,15 @@ async def process_single_file(request: ProcessRequest):
         if not frames:
             raise HTTPException(status_code=400, detail="无法从视频提取帧")
         
-        # 使用中间帧进行分析
+        # 使用中间帧进行分析（单次视觉前向）
         main_frame = frames[len(frames) // 2]
-        
-        # 获取标签
-        tags_result = clip_manager.get_tags(main_frame, top_k=5)
-        tags = [t["tag"] for t in tags_result]
-        
-        # 获取描述
-        description = clip_manager.generate_description(main_frame)
-        
-        # 获取情绪
-        emotions = clip_manager.detect_emotions(main_frame)
-        
-        # 获取embeddings
-        embeddings = clip_manager.encode_image(main_frame).tolist()
-        
-        from datetime import datetime
+        analysis = clip_manager.analyze_frame(main_frame, top_k=5)
         
         return {
-            "embeddings": embeddings,
-            "tags": tags,
-            "description": description,
-            "emotions": emotions,
+            "embeddings": analysis["embeddings"],
+            "tags": analysis["tags"],
+            "description": analysis["description"],
+            "emotions": analysis["emotions"],
             "keyframes": None,
             "processed_at": datetime.now().isoformat(),
             "model_version": request.model_version,
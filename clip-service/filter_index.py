@@ -0,0 +1,156 @@
+"""
+素材过滤倒排索引 - 在search_index.py中集成
+按检索索引的行表（某一快照，不可变）建立 标签 / 情绪 / 标签类别 → 行号 的倒排列表，
+目录前缀按排序后的路径二分查找（前缀对应一段连续区间），不为每级目录单独存列表。
+过滤表达式求值为按行的布尔位图，EmbeddingIndex 只在命中的行上打分（或在全量得分上屏蔽）。
+
+过滤表达式（JSON）:
+    {"tag": "夜晚"}                          叶子：字段 tag / emotion / category / path，值为字符串或列表（任一命中）
+    {"and": [表达式, ...]}                    全部满足
+    {"or": [表达式, ...]}                     任一满足
+    {"not": 表达式}                          取反
+    {"tag": "夜晚", "emotion": "紧张"}         同一对象中的多个键按 and 组合
+
+素材中保存的情绪不带"氛围"后缀（detect_emotions: "紧张氛围" → "紧张"），emotion 的值两种写法都可以。
+path 为目录前缀（按目录边界匹配，"D:/素材/动作" 不匹配 "D:/素材/动作片/..."），路径分隔符统一为 "/"。
+"""
+import bisect
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FILTER_FIELDS = ("tag", "emotion", "category", "path")
+
+
+def _normalize_path(path: str) -> str:
+    return (path or "").replace("\\", "/")
+
+
+def _emotion(value: str) -> str:
+    return value[:-2] if value.endswith("氛围") else value
+
+
+def _values(value) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+        return list(value)
+    raise ValueError(f"过滤值须为字符串或字符串列表: {value!r}")
+
+
+class FilterIndex:
+    """
+    某个行表快照的倒排索引
+
+    - tag_categories: 标签 → 类别（如 clip_server.PREDEFINED_TAGS 展开），category 叶子匹配含该类别任一标签的行
+    - evaluate(): 表达式 → (N,) 布尔位图；表达式不合法时抛出 ValueError
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], tag_categories: Optional[Dict[str, str]] = None):
+        start = time.perf_counter()
+        self.rows = rows
+        self.size = len(rows)
+        tag_categories = tag_categories or {}
+        postings: Dict[str, Dict[str, List[int]]] = {field: defaultdict(list) for field in ("tag", "emotion", "category")}
+        for i, row in enumerate(rows):
+            tags = set(row.get("tags") or [])
+            for tag in tags:
+                postings["tag"][tag].append(i)
+            for category in {tag_categories[tag] for tag in tags if tag in tag_categories}:
+                postings["category"][category].append(i)
+            for emotion in {_emotion(e) for e in row.get("emotions") or []}:
+                postings["emotion"][emotion].append(i)
+        self._postings = {
+            field: {value: np.asarray(ids, dtype=np.int32) for value, ids in lists.items()}
+            for field, lists in postings.items()
+        }
+        paths = [_normalize_path(row.get("filePath")) for row in rows]
+        self._path_order = np.argsort(np.asarray(paths, dtype=object), kind="stable").astype(np.int32)
+        self._sorted_paths = [paths[i] for i in self._path_order]
+        self.build_seconds = time.perf_counter() - start
+
+    def _path_rows(self, prefix: str) -> np.ndarray:
+        prefix = _normalize_path(prefix).rstrip("/") + "/"
+        # 以 prefix 开头的路径恰好落在 [prefix, prefix 末位 "/" 换成 "0") 区间内
+        lo = bisect.bisect_left(self._sorted_paths, prefix)
+        hi = bisect.bisect_left(self._sorted_paths, prefix[:-1] + "0", lo)
+        return self._path_order[lo:hi]
+
+    def _leaf(self, field: str, value) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        for v in _values(value):
+            if field == "emotion":
+                v = _emotion(v)
+            if field == "path":
+                mask[self._path_rows(v)] = True
+            else:
+                ids = self._postings[field].get(v)
+                if ids is not None:
+                    mask[ids] = True
+        return mask
+
+    def evaluate(self, expr: Dict[str, Any]) -> np.ndarray:
+        if not isinstance(expr, dict) or not expr:
+            raise ValueError(f"过滤表达式须为非空对象: {expr!r}")
+        mask = np.ones(self.size, dtype=bool)
+        for key, value in expr.items():
+            if key in ("and", "or"):
+                if not isinstance(value, list) or not value:
+                    raise ValueError(f"{key} 须为非空列表")
+                parts = [self.evaluate(part) for part in value]
+                combined = np.logical_and.reduce(parts) if key == "and" else np.logical_or.reduce(parts)
+                mask &= combined
+            elif key == "not":
+                mask &= ~self.evaluate(value)
+            elif key in FILTER_FIELDS:
+                mask &= self._leaf(key, value)
+            else:
+                raise ValueError(f"未知的过滤字段: {key}（可用 {', '.join(FILTER_FIELDS)} 与 and / or / not）")
+        return mask
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows": self.size,
+            "tags": len(self._postings["tag"]),
+            "emotions": len(self._postings["emotion"]),
+            "categories": len(self._postings["category"]),
+            "build_seconds": round(self.build_seconds, 3),
+        }
+
+
+def qdrant_filter(expr: Dict[str, Any], tag_categories: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    过滤表达式 → Qdrant filter（must / should / must_not，tags 与 emotions 为 keyword 索引字段）
+
+    category 展开为该类别的全部标签；path（目录前缀）在 Qdrant 中没有对应的索引匹配，抛出 ValueError
+    """
+    if not isinstance(expr, dict) or not expr:
+        raise ValueError(f"过滤表达式须为非空对象: {expr!r}")
+    must = []
+    for key, value in expr.items():
+        if key in ("and", "or") and (not isinstance(value, list) or not value):
+            raise ValueError(f"{key} 须为非空列表")
+        if key == "and":
+            must.extend(qdrant_filter(part, tag_categories) for part in value)
+        elif key == "or":
+            must.append({"should": [qdrant_filter(part, tag_categories) for part in value]})
+        elif key == "not":
+            must.append({"must_not": [qdrant_filter(value, tag_categories)]})
+        elif key == "tag":
+            must.append({"key": "tags", "match": {"any": _values(value)}})
+        elif key == "emotion":
+            must.append({"key": "emotions", "match": {"any": [_emotion(v) for v in _values(value)]}})
+        elif key == "category":
+            wanted = set(_values(value))
+            tags = [tag for tag, category in (tag_categories or {}).items() if category in wanted]
+            must.append({"key": "tags", "match": {"any": tags}})
+        elif key == "path":
+            raise ValueError("目录前缀过滤只支持本地检索（/clip/search）")
+        else:
+            raise ValueError(f"未知的过滤字段: {key}（可用 {', '.join(FILTER_FIELDS)} 与 and / or / not）")
+    return {"must": must}
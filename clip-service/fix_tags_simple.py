@@ -8,10 +8,10 @@
 3. 如果文件名包含自然/风景关键词 → 移除办公室标签，标记为"自然风景"
 4. 其他保持不变
 """
-import json
-import re
 from pathlib import Path
 
+from asset_store import open_default_store
+
 # 关键词映射
 KEYWORD_RULES = [
     # (关键词列表, 要移除的标签, 要添加的标签)
@@ -91,9 +91,9 @@ def fix_tags(item):
 
 
 def main(dry_run=True):
-    # 加载数据
-    with open('clip_results.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # 加载数据（不需要向量）
+    store = open_default_store()
+    data = store.load_items(include_embeddings=False)
     
     print(f'总素材数: {len(data)}')
     print(f'模式: {"预览(dry-run)" if dry_run else "实际修改"}')
@@ -105,10 +105,12 @@ def main(dry_run=True):
     # 修复标签
     modified_count = 0
     modified_samples = []
+    updates = []
     for item in data:
         old_tags = list(item.get('clipMetadata', {}).get('tags', []))
         if fix_tags(item):
             modified_count += 1
+            updates.append((item['filePath'], {'tags': item['clipMetadata']['tags']}))
             new_tags = item.get('clipMetadata', {}).get('tags', [])
             if len(modified_samples) < 5:
                 modified_samples.append({
@@ -144,14 +146,8 @@ def main(dry_run=True):
         print(f'  {tag}: {count}')
     
     if not dry_run:
-        # 备份并保存
-        import shutil
-        backup_path = 'clip_results_backup.json'
-        shutil.copy('clip_results.json', backup_path)
-        print(f'\n已备份到: {backup_path}')
-        
-        with open('clip_results.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 只更新修改过的素材的标签列（经发件箱同步到 Qdrant）
+        store.update_metadata(updates)
         print('已保存修复后的标签')
     else:
         print('\n[dry-run模式] 未保存更改。使用 --apply 参数实际执行修改')
@@ -8,10 +8,11 @@
 2. 保留有区分度的标签（街道、夜晚、动漫场景等）
 3. 基于文件路径关键词添加更精准的标签
 """
-import json
 import re
 from collections import Counter
 
+from asset_store import open_default_store
+
 # 文件路径关键词 -> 标签映射
 PATH_TAG_RULES = [
     # 场景类型
@@ -66,13 +67,14 @@ def extract_tags_from_path(file_path: str) -> list:
 
 
 def fix_tags(data: list) -> tuple:
-    """修复标签"""
+    """修复标签，返回 (data, stats, 修改过的 filePath 列表)"""
     stats = {
         'total': len(data),
         'modified': 0,
         'tags_removed': 0,
         'tags_added': 0,
     }
+    modified_paths = []
 
     for item in data:
         if not item.get('clipMetadata'):
@@ -100,20 +102,21 @@ def fix_tags(data: list) -> tuple:
         if new_tags != old_tags:
             item['clipMetadata']['tags'] = list(new_tags)
             stats['modified'] += 1
+            modified_paths.append(item.get('filePath'))
 
-    return data, stats
+    return data, stats, modified_paths
 
 
 def main():
-    print('加载 clip_results.json...')
-    with open('clip_results.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    print('加载素材存储...')
+    store = open_default_store()
+    data = store.load_items(include_embeddings=False)
 
     print(f'总素材数: {len(data)}')
 
     # 修复标签
     print('\n修复标签中...')
-    data, stats = fix_tags(data)
+    data, stats, modified_paths = fix_tags(data)
 
     print(f'\n修复统计:')
     print(f'  修改素材数: {stats["modified"]}')
@@ -133,9 +136,10 @@ def main():
         print(f'  {tag}: {count} ({pct:.1f}%)')
 
     # 保存
-    print('\n保存到 clip_results.json...')
-    with open('clip_results.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 保存（只更新修改过的素材的标签列）
+    print('\n保存到素材存储...')
+    tags_by_path = {item.get('filePath'): item['clipMetadata'].get('tags', []) for item in data if item.get('clipMetadata')}
+    store.update_metadata((path, {'tags': tags_by_path[path]}) for path in modified_paths)
 
     print('完成!')
 
@@ -0,0 +1,201 @@
+"""
+流水线入库引擎 - 在clip_server.py与batch_scan.py中集成
+三个阶段并行：解码线程池 → 有界帧队列 → 批量推理 → 有界结果队列 → 持久化。
+解码与推理互相重叠，队列满时解码线程阻塞（背压），队列深度与各阶段利用率可实时查询。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_DONE = object()
+
+
+def default_decode_workers() -> int:
+    """默认解码线程数：CPU核数的一半（其余留给推理），至少1，最多8"""
+    return max(1, min(8, (os.cpu_count() or 2) // 2))
+
+
+class StageMeter:
+    """单个阶段的忙碌时间与处理量统计"""
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self.busy = 0.0
+        self.items = 0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float, items: int = 1):
+        with self._lock:
+            self.busy += elapsed
+            self.items += items
+
+    def stats(self, wall: float) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "items": self.items,
+                "busy_seconds": round(self.busy, 3),
+                # 忙碌时间 / (墙钟时间 × 线程数)
+                "utilization": round(self.busy / (wall * self.workers), 3) if wall > 0 else 0.0,
+            }
+
+
+class IngestPipeline:
+    """
+    解码 → 推理 → 持久化 流水线
+
+    - decode_fn(item) -> (frame, extra)；frame 为 None 表示该文件无可用帧（调用 on_empty）
+    - infer_fn([frame, ...]) -> [output, ...]，顺序与输入一致
+    - persist_fn([(item, extra, output), ...])：在单独线程中按批调用
+    - on_error(item, exc)：解码/推理/持久化失败的条目
+    - on_empty(item)：解码成功但没有帧的条目
+
+    回调可能在不同线程中调用，需自行保证线程安全。
+    """
+
+    def __init__(
+        self,
+        decode_fn: Callable[[Any], Tuple[Any, Any]],
+        infer_fn: Callable[[List[Any]], List[Any]],
+        persist_fn: Callable[[List[Tuple[Any, Any, Any]]], None],
+        on_error: Callable[[Any, Exception], None],
+        on_empty: Optional[Callable[[Any], None]] = None,
+        decode_workers: int = 0,
+        batch_size: int = 16,
+        queue_size: int = 0,
+        batch_timeout: float = 0.5,
+    ):
+        self.decode_fn = decode_fn
+        self.infer_fn = infer_fn
+        self.persist_fn = persist_fn
+        self.on_error = on_error
+        self.on_empty = on_empty
+        self.decode_workers = decode_workers if decode_workers > 0 else default_decode_workers()
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout
+        # 帧队列默认容纳4批，既能吸收解码抖动又限制内存
+        self.frames: "queue.Queue" = queue.Queue(maxsize=queue_size if queue_size > 0 else self.batch_size * 4)
+        self.outputs: "queue.Queue" = queue.Queue(maxsize=4)
+        self.decode_meter = StageMeter(self.decode_workers)
+        self.infer_meter = StageMeter()
+        self.persist_meter = StageMeter()
+        self.max_frame_queue = 0
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    # --------------------------------------------
+    # 各阶段
+    # --------------------------------------------
+    def _decode(self, item, cancelled: Callable[[], bool]):
+        if cancelled():
+            return
+        start = time.perf_counter()
+        try:
+            frame, extra = self.decode_fn(item)
+        except Exception as e:
+            self.decode_meter.record(time.perf_counter() - start)
+            self.on_error(item, e)
+            return
+        self.decode_meter.record(time.perf_counter() - start)
+        if frame is None:
+            if self.on_empty is not None:
+                self.on_empty(item)
+            return
+        # 队列满时阻塞，等待推理阶段消费（背压）
+        self.frames.put((item, frame, extra))
+        self.max_frame_queue = max(self.max_frame_queue, self.frames.qsize())
+
+    def _infer(self, batch: List[Tuple[Any, Any, Any]]):
+        start = time.perf_counter()
+        try:
+            outputs = self.infer_fn([frame for _, frame, _ in batch])
+        except Exception as e:
+            logger.error(f"批量推理失败: {e}")
+            for item, _, _ in batch:
+                self.on_error(item, e)
+            return
+        finally:
+            self.infer_meter.record(time.perf_counter() - start, len(batch))
+        self.outputs.put([(item, extra, output) for (item, _, extra), output in zip(batch, outputs)])
+
+    def _persist_loop(self):
+        while True:
+            records = self.outputs.get()
+            if records is _DONE:
+                return
+            start = time.perf_counter()
+            try:
+                self.persist_fn(records)
+            except Exception as e:
+                logger.error(f"持久化失败: {e}")
+                for item, _, _ in records:
+                    self.on_error(item, e)
+            self.persist_meter.record(time.perf_counter() - start, len(records))
+
+    def run(self, items: Iterable[Any], cancelled: Callable[[], bool] = lambda: False):
+        """执行流水线直到全部条目处理完（或取消后已解码的帧处理完）"""
+        self._started_at = time.perf_counter()
+        persist_thread = threading.Thread(target=self._persist_loop, name="ingest-persist", daemon=True)
+        persist_thread.start()
+
+        executor = ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="ingest-decode")
+        futures = [executor.submit(self._decode, item, cancelled) for item in items]
+
+        def close_frames():
+            wait(futures)
+            self.frames.put(_DONE)
+
+        closer = threading.Thread(target=close_frames, name="ingest-decode-closer", daemon=True)
+        closer.start()
+
+        # 推理阶段在调用线程中执行：凑满一批立即推理，解码跟不上时超时推理不完整的批
+        batch: List[Tuple[Any, Any, Any]] = []
+        try:
+            while True:
+                try:
+                    entry = self.frames.get(timeout=self.batch_timeout if batch else None)
+                except queue.Empty:
+                    self._infer(batch)
+                    batch = []
+                    continue
+                if entry is _DONE:
+                    break
+                batch.append(entry)
+                if len(batch) >= self.batch_size:
+                    self._infer(batch)
+                    batch = []
+            if batch:
+                self._infer(batch)
+        finally:
+            executor.shutdown(wait=True)
+            self.outputs.put(_DONE)
+            persist_thread.join()
+            self._finished_at = time.perf_counter()
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度与各阶段利用率"""
+        if self._started_at is None:
+            wall = 0.0
+        else:
+            wall = (self._finished_at or time.perf_counter()) - self._started_at
+        return {
+            "wall_seconds": round(wall, 3),
+            "queues": {
+                "frames": self.frames.qsize(),
+                "frames_max": self.max_frame_queue,
+                "frames_capacity": self.frames.maxsize,
+                "outputs": self.outputs.qsize(),
+            },
+            "stages": {
+                "decode": self.decode_meter.stats(wall),
+                "infer": self.infer_meter.stats(wall),
+                "persist": self.persist_meter.stats(wall),
+            },
+        }
@@ -5,15 +5,17 @@
 """
 
 import requests
-import json
 import time
 
+from asset_store import open_default_store
+
 def process_single_directory(dir_name, base_dir):
-    """处理单个目录"""
+    """处理单个目录（服务端直接入库，只返回汇总）"""
     scan_payload = {
         'directory': rf'{base_dir}\\{dir_name}',
         'file_patterns': ['*.mp4', '*.mov', '*.avi', '*.mkv'],
-        'extract_keyframes': True
+        'extract_keyframes': True,
+        'persist': True
     }
     
     try:
@@ -21,24 +23,15 @@ def process_single_directory(dir_name, base_dir):
         response = requests.post('http://localhost:8000/clip/scan', json=scan_payload, timeout=300)
         
         if response.status_code == 200:
-            result = response.json()
-            processed_files = result.get('processedFiles', [])
-            print(f'处理了 {len(processed_files)} 个文件')
+            summary = response.json().get('summary', {})
+            processed = summary.get('processed', 0)
+            print(f'处理并保存了 {processed} 个文件')
             
-            if processed_files:
-                # 保存结果
-                save_payload = {'results': processed_files}
-                save_response = requests.post('http://localhost:8000/clip/save-results', json=save_payload, timeout=60)
-                
-                if save_response.status_code == 200:
-                    print('✅ 保存成功')
-                    return True, len(processed_files)
-                else:
-                    print(f'❌ 保存失败: {save_response.status_code}')
-                    return False, 0
+            if processed:
+                print('✅ 保存成功')
             else:
                 print('⚠️ 没有处理文件')
-                return True, 0
+            return True, processed
         else:
             print(f'❌ 扫描失败: {response.status_code}')
             return False, 0
@@ -65,6 +58,8 @@ def main():
     
     total_files = 0
     success_count = 0
+    # 扫描结果由服务端写入素材存储，这里只读取条数
+    store = open_default_store()
     
     for i, dir_name in enumerate(target_dirs, 1):
         print(f'\n[{i}/{len(target_dirs)}] 开始处理: {dir_name}')
@@ -82,12 +77,7 @@ def main():
         time.sleep(3)
         
         # 显示当前总文件数
-        try:
-            with open('clip_results.json', 'r', encoding='utf-8') as f:
-                current_data = json.load(f)
-            print(f'当前总文件数: {len(current_data)}')
-        except:
-            print('无法读取当前文件数')
+        print(f'当前总文件数: {len(store)}')
     
     print(f'\n=== 处理总结 ===')
     print(f'成功目录: {success_count}/{len(target_dirs)}')
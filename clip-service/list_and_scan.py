@@ -5,29 +5,18 @@ List subdirectories and batch-scan videos with Chinese-CLIP.
 This script is ASCII-only to avoid console encoding issues.
 """
 
-import json
 import os
 import time
 import requests
 
+from asset_store import open_default_store
+
 
 BASE_DIR = r"U:\\PreVis_Assets\\originals\\02类型-三渲二 二次元类"
 SCAN_TIMEOUT = 600
-SAVE_TIMEOUT = 120
 LIST_TIMEOUT = 60
-
-
-def load_existing_paths():
-    """Load existing file paths from clip_results.json if present."""
-    try:
-        with open("clip_results.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return {item.get("filePath") for item in data if "filePath" in item}
-    except FileNotFoundError:
-        return set()
-    except Exception as exc:  # pragma: no cover
-        print(f"Warning: could not read clip_results.json: {exc}")
-        return set()
+# Server-side multi-process scan: -1/>1 = use the server's process pool (if enabled), 0/1 = thread pipeline
+SCAN_WORKERS = int(os.getenv("CLIP_SCAN_PROCESSES", "-1"))
 
 
 def list_dirs():
@@ -49,47 +38,38 @@ def list_dirs():
     return counts, files
 
 
-def scan_dir(dir_name, existing):
-    """Scan a single subdir, save new results, return processed count."""
+def scan_dir(dir_name):
+    """Scan a single subdir (results are persisted server-side), return saved count."""
     payload = {
         "directory": f"{BASE_DIR}\\{dir_name}",
         "file_patterns": ["*.mp4", "*.mov", "*.avi", "*.mkv"],
         "extract_keyframes": True,
         "model_version": "Chinese-CLIP ViT-B/16",
+        "workers": SCAN_WORKERS,
+        "persist": True,
     }
 
     print(f"Scanning: {dir_name}")
+    # persist=True: the server writes results into the asset store directly,
+    # so embeddings never travel back to this script
     resp = requests.post("http://localhost:8000/clip/scan", json=payload, timeout=SCAN_TIMEOUT)
     if resp.status_code != 200:
         print(f"Scan failed ({resp.status_code}) {resp.text[:120]}")
         return 0
 
-    data = resp.json()
-    processed = data.get("processedFiles", [])
-    new_items = [item for item in processed if item.get("filePath") not in existing]
-
-    if not new_items:
-        print("No new files to save.")
-        return 0
-
-    save_payload = {"results": new_items}
-    save_resp = requests.post("http://localhost:8000/clip/save-results", json=save_payload, timeout=SAVE_TIMEOUT)
-    if save_resp.status_code != 200:
-        print(f"Save failed ({save_resp.status_code}) {save_resp.text[:120]}")
-        return 0
-
-    for item in new_items:
-        existing.add(item.get("filePath"))
-    print(f"Saved {len(new_items)} new files.")
-    return len(new_items)
+    summary = resp.json().get("summary", {})
+    saved = summary.get("processed", 0)
+    print(f"Saved {saved} files (skipped {summary.get('skipped', 0)}, failed {summary.get('failed', 0)}).")
+    return saved
 
 
 def main():
     print("=== Chinese-CLIP index rebuild ===")
     print(f"Base dir: {BASE_DIR}")
 
-    existing = load_existing_paths()
-    print(f"Existing entries: {len(existing)}")
+    # the server persists scan results into the asset store; read counts from it
+    store = open_default_store()
+    print(f"Existing entries: {len(store)}")
 
     print("Listing directories...")
     counts, _ = list_dirs()
@@ -105,14 +85,13 @@ def main():
     total_new = 0
     for idx, dir_name in enumerate(target_dirs, 1):
         print(f"\n[{idx}/{len(target_dirs)}] {dir_name}")
-        added = scan_dir(dir_name, existing)
-        total_new += added
-        print(f"Current total (including existing): {len(existing)}")
+        total_new += scan_dir(dir_name)
+        print(f"Current total (including existing): {len(store)}")
         time.sleep(2)
 
     print("\n=== Done ===")
     print(f"Newly added: {total_new}")
-    print(f"Total indexed: {len(existing)}")
+    print(f"Total indexed: {len(store)}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+"""
+PCA 降维（可选白化）- 离线拟合，在search_index.py中集成（mode: "pca"）
+素材库以动漫/CG镜头为主，512维向量的方差集中在少数主成分上。离线在库内向量上拟合 PCA，
+把投影保存到素材存储目录；检索服务启动时加载投影，为每个素材维护 128/256 维的降维向量，
+查询投影后在降维向量上取短名单，再用全精度向量精确重排。
+
+命令行:
+    python pca_projection.py fit [--dim 128] [--whiten] [--dims 64 128 192 256]
+                                 [--shortlist 200] [--top-k 10] [--queries 200]
+打印各维度的召回率曲线（降维直接检索 / 短名单重排后，相对全精度精确检索的 recall@k），
+并保存 --dim 指定维度的投影（--dry-run 只打印不保存）。
+"""
+import argparse
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROJECTION_FILE = "pca_projection.npz"
+
+# 拟合协方差最多使用的样本数
+FIT_SAMPLES = 200000
+CHUNK_ROWS = 65536
+
+
+class PCAProjection:
+    """x → normalize((x - mean) · components^T · scale)，降维后归一化，检索按内积（余弦）"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, scale: Optional[np.ndarray] = None,
+                 explained: float = 0.0):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+        self.explained = explained
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def whiten(self) -> bool:
+        return self.scale is not None
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        projected = (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+        if self.scale is not None:
+            projected *= self.scale
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.maximum(norms, 1e-8)
+
+    def save(self, path):
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                mean=self.mean,
+                components=self.components,
+                scale=self.scale if self.scale is not None else np.zeros(0, dtype=np.float32),
+                explained=np.float32(self.explained),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> "PCAProjection":
+        with np.load(path) as data:
+            scale = data["scale"]
+            return cls(data["mean"], data["components"], scale if scale.size else None, float(data["explained"]))
+
+
+def fit_pca(vectors: np.ndarray, samples: int = FIT_SAMPLES, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    在（抽样的）库内向量上拟合 PCA
+
+    返回:
+        (mean, 全部主成分（按方差降序，每行一个）, 对应特征值)
+    """
+    rng = np.random.default_rng(seed)
+    rows = vectors.shape[0]
+    picked = np.sort(rng.choice(rows, size=min(samples, rows), replace=False))
+    sample = np.asarray(vectors[picked], dtype=np.float64)
+    mean = sample.mean(axis=0)
+    centered = sample - mean
+    covariance = centered.T @ centered / max(1, centered.shape[0] - 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1]
+    return mean, eigenvectors[:, order].T, np.maximum(eigenvalues[order], 0.0)
+
+
+def projection_for(mean: np.ndarray, components: np.ndarray, eigenvalues: np.ndarray, dim: int,
+                   whiten: bool = False) -> PCAProjection:
+    scale = 1.0 / np.sqrt(eigenvalues[:dim] + 1e-8) if whiten else None
+    explained = float(eigenvalues[:dim].sum() / max(eigenvalues.sum(), 1e-12))
+    return PCAProjection(mean, components[:dim], scale, explained)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[-1])
+    return np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+
+
+def recall_curve(
+    matrix: np.ndarray,
+    dims: Sequence[int],
+    whiten: bool = False,
+    top_k: int = 10,
+    shortlist: int = 200,
+    queries: int = 200,
+    fitted: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    各降维维度相对全精度精确检索的 recall@k
+
+    以随机抽取的库内向量为查询；first_stage 为只用降维向量检索的召回率，
+    reranked 为降维向量取 shortlist 行后用全精度向量重排的召回率。
+    """
+    mean, components, eigenvalues = fitted or fit_pca(matrix)
+    rng = np.random.default_rng(1)
+    query_vectors = np.asarray(matrix[rng.choice(matrix.shape[0], size=min(queries, matrix.shape[0]), replace=False)],
+                               dtype=np.float32)
+    exact_scores = np.concatenate(
+        [query_vectors @ np.asarray(matrix[start:start + CHUNK_ROWS], dtype=np.float32).T
+         for start in range(0, matrix.shape[0], CHUNK_ROWS)],
+        axis=1,
+    )
+    truth = [set(row.tolist()) for row in _top_k(exact_scores, top_k)]
+
+    curve = []
+    for dim in dims:
+        projection = projection_for(mean, components, eigenvalues, dim, whiten)
+        reduced = np.concatenate([
+            projection.transform(matrix[start:start + CHUNK_ROWS])
+            for start in range(0, matrix.shape[0], CHUNK_ROWS)
+        ])
+        start = time.perf_counter()
+        reduced_scores = projection.transform(query_vectors) @ reduced.T
+        elapsed = time.perf_counter() - start
+        first = _top_k(reduced_scores, top_k)
+        short = _top_k(reduced_scores, shortlist)
+        first_hits = reranked_hits = 0
+        for i, expected in enumerate(truth):
+            first_hits += len(expected.intersection(first[i].tolist()))
+            candidates = short[i]
+            reranked = candidates[_top_k(exact_scores[i, candidates], top_k)]
+            reranked_hits += len(expected.intersection(reranked.tolist()))
+        total = sum(len(expected) for expected in truth)
+        curve.append({
+            "dim": dim,
+            "explained_variance": round(projection.explained, 4),
+            "bytes_per_row": dim * 4,
+            "first_stage_recall": round(first_hits / total, 4),
+            "reranked_recall": round(reranked_hits / total, 4),
+            "ms_per_query": round(elapsed * 1000 / len(query_vectors), 3),
+        })
+    return curve
+
+
+def main():
+    from asset_store import open_default_store
+
+    parser = argparse.ArgumentParser(description="拟合 PCA 降维投影并打印召回率曲线")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fit_parser = sub.add_parser("fit")
+    fit_parser.add_argument("--dim", type=int, default=128, help="保存的投影维度")
+    fit_parser.add_argument("--dims", type=int, nargs="+", default=[32, 64, 128, 192, 256, 384])
+    fit_parser.add_argument("--whiten", action="store_true", help="白化（各主成分缩放到单位方差）")
+    fit_parser.add_argument("--top-k", type=int, default=10)
+    fit_parser.add_argument("--shortlist", type=int, default=200, help="重排前的短名单大小")
+    fit_parser.add_argument("--queries", type=int, default=200, help="抽样查询数")
+    fit_parser.add_argument("--dry-run", action="store_true", help="只打印曲线，不保存投影")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = open_default_store()
+    snapshot = store.index_snapshot()
+    matrix = snapshot.vectors
+    if matrix.shape[0] == 0:
+        print("素材存储中没有向量")
+        return
+    print(f"素材向量: {matrix.shape[0]} × {matrix.shape[1]}，拟合 PCA{'（白化）' if args.whiten else ''}...")
+    fitted = fit_pca(matrix)
+
+    dims = sorted(set(d for d in args.dims + [args.dim] if d <= matrix.shape[1]))
+    curve = recall_curve(matrix, dims, args.whiten, args.top_k, args.shortlist, args.queries, fitted)
+    print(f"\n{'维度':>6} {'方差占比':>8} {'字节/行':>8} {'直接recall@' + str(args.top_k):>16} "
+          f"{'重排recall@' + str(args.top_k):>16} {'毫秒/查询':>10}")
+    for point in curve:
+        print(f"{point['dim']:>6} {point['explained_variance']:>8.2%} {point['bytes_per_row']:>8} "
+              f"{point['first_stage_recall']:>16.2%} {point['reranked_recall']:>16.2%} {point['ms_per_query']:>10}")
+    print(f"（全精度: {matrix.shape[1] * 4} 字节/行；重排短名单 {args.shortlist} 行）")
+
+    if not args.dry_run:
+        path = store.root / PROJECTION_FILE
+        projection_for(*fitted, args.dim, args.whiten).save(path)
+        print(f"\n已保存 {args.dim} 维投影: {path}（重启检索服务后 mode=pca 生效）")
+
+
+if __name__ == "__main__":
+    main()
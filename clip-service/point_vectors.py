@@ -0,0 +1,96 @@
+"""
+Qdrant point 向量本地缓存 - 在clip_server.py中集成
+MMR 需要候选向量，但让 Qdrant 返回 with_vector 意味着每个命中都以JSON传回512个浮点数。
+素材存储的 memmap 向量文件中已有同样的（预归一化）向量，这里按 point id 直接查本地：
+
+- point id 与 sync_qdrant.build_point 相同（hashId 或 sha1(canonicalPath#segment)）
+- 向量矩阵与行表取自内存检索索引（EmbeddingIndex），不额外占用内存
+- id 映射在素材存储有新写入时增量更新（已计算过的路径不再 resolve），
+  两次重建至少间隔 refresh_interval 秒；未命中的 id 由调用方改用 with_vector 检索
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from search_index import EmbeddingIndex
+from sync_qdrant import point_id
+
+logger = logging.getLogger(__name__)
+
+
+class PointVectorCache:
+    """point id → 预归一化向量"""
+
+    def __init__(self, index: EmbeddingIndex, refresh_interval: float = 30.0):
+        self.index = index
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._refreshed_at = 0.0
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._rows: Dict[str, int] = {}
+        # filePath → point id（canonicalPath 需要 resolve，按路径缓存）
+        self._point_ids: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _refresh(self):
+        store = self.index.store
+        if store is None:
+            return
+        now = time.monotonic()
+        if self._generation is not None and (
+            self._generation == store.generation or now - self._refreshed_at < self.refresh_interval
+        ):
+            return
+        # 检索索引在后台重建，这里只取当前已切换的快照（尚未建立时全部按未命中处理）
+        self.index.refresh_async()
+        matrix, rows, generation = self.index.snapshot()
+        if generation is None or generation == self._generation:
+            return
+
+        new_paths = [row["filePath"] for row in rows if row["filePath"] not in self._point_ids]
+        if new_paths:
+            # 只读取新路径的 hashId / canonicalPath / segment
+            for item in store.iter_items(include_embeddings=False, file_paths=new_paths):
+                self._point_ids[item["filePath"]] = point_id(item)
+
+        self._matrix = matrix
+        # 快照之后被删除的素材读不到 point id，不进入映射（查询时按未命中处理）
+        self._rows = {
+            self._point_ids[row["filePath"]]: i for i, row in enumerate(rows) if row["filePath"] in self._point_ids
+        }
+        self._generation = generation
+        self._refreshed_at = now
+        logger.info(f"point 向量缓存已更新: {len(self._rows)} 个点")
+
+    def lookup(self, point_ids: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按 point id 取向量
+
+        返回:
+            (vectors, found)：vectors 为 (n, dim) float32，found 为命中掩码（未命中行为零向量）
+        """
+        with self._lock:
+            self._refresh()
+            matrix, rows = self._matrix, self._rows
+        row_ids = np.fromiter((rows.get(str(pid), -1) for pid in point_ids), dtype=np.int64, count=len(point_ids))
+        found = row_ids >= 0
+        vectors = np.zeros((len(point_ids), matrix.shape[1] if matrix.ndim == 2 else 0), dtype=np.float32)
+        if found.any():
+            vectors[found] = matrix[row_ids[found]]
+        hits = int(found.sum())
+        self.hits += hits
+        self.misses += len(point_ids) - hits
+        return vectors, found
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "points": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "generation": self._generation,
+        }
@@ -1,36 +1,358 @@
 """
 Qdrant混合检索服务 - 在clip_server.py中集成
 提供基于Qdrant的高性能向量检索 + MMR多样性算法
+
+传输层:
+- REST：httpx 连接池（keep-alive），同步接口供脚本使用，异步接口供 FastAPI 处理函数使用，
+  不阻塞事件循环；未安装 httpx 时同步接口使用 requests.Session，异步接口在线程中执行
+- gRPC：prefer_grpc=True（或 QDRANT_PREFER_GRPC=1）且安装了 qdrant-client 时使用
+- 所有请求有超时；连接失败、429、5xx 按指数退避重试 retries 次
 """
-import requests
-from typing import List, Dict, Any, Optional
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
 import numpy as np
 
+try:
+    import httpx
+except ImportError:  # 可选依赖
+    httpx = None
+    import requests
+
+try:
+    from qdrant_client import AsyncQdrantClient, QdrantClient, models as qdrant_models
+except ImportError:  # 可选依赖
+    AsyncQdrantClient = None
+
+logger = logging.getLogger(__name__)
+
+# 可重试的HTTP状态码与传输层异常
+RETRY_STATUS = {429, 500, 502, 503, 504}
+TRANSPORT_ERRORS = httpx.TransportError if httpx is not None else requests.ConnectionError
+
+# 检索结果只取响应需要的 payload 字段（canonicalPath、mtime、emotions 等不返回）
+PAYLOAD_FIELDS = ["filePath", "shotId", "label", "tags", "description", "duration", "segment"]
+
+# 本地向量缓存未命中后，这段时间内的MMR检索改为让 Qdrant 直接返回向量（秒）
+LOOKUP_RETRY_SECONDS = 30.0
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按最后一维归一化，零向量保持为零（与任何向量的余弦相似度为0）"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def mmr_select(
+    vectors: np.ndarray,
+    relevance: np.ndarray,
+    top_k: int,
+    lambda_param: float = 0.7,
+) -> List[int]:
+    """
+    MMR 选择，返回选中候选的下标（按选中顺序）
+
+    vectors 为 (n, d) 候选向量，relevance 为 (n,) 与查询的相似度（0-1）。
+    候选间的余弦相似度矩阵一次算出；每选中一个候选，只用它那一行更新
+    "与已选结果的最大相似度"向量，整体 O(n²·d + k·n) 且全部在 numpy 中完成。
+    """
+    return mmr_select_batch(vectors[None], relevance[None], top_k, lambda_param)[0]
+
+
+def mmr_select_batch(
+    vectors: np.ndarray,
+    relevance: np.ndarray,
+    top_k: int,
+    lambda_param: float = 0.7,
+) -> List[List[int]]:
+    """
+    多个查询同时做 MMR 选择
+
+    vectors 为 (b, n, d)，relevance 为 (b, n)；候选不足 n 个的查询用 -inf 相关性补齐。
+    第一个结果取相关性最高者，之后每轮选 λ·相关性 − (1−λ)·max(已选相似度, 0) 最大的候选。
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    batch, n = relevance.shape
+    normalized = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    gram = normalized @ normalized.transpose(0, 2, 1)  # (b, n, n)
+
+    valid = np.isfinite(relevance)
+    counts = valid.sum(axis=1)
+    rows = np.arange(batch)
+    weighted = lambda_param * np.where(valid, relevance, 0.0)
+    max_similarity = np.zeros((batch, n), dtype=np.float32)
+    available = valid.copy()
+    picks: List[List[int]] = [[] for _ in range(batch)]
+
+    # 第一个结果：选择与query最相似的
+    choice = np.where(valid, relevance, -np.inf).argmax(axis=1)
+    for _ in range(min(top_k, n)):
+        active = counts > np.array([len(p) for p in picks])
+        if not active.any():
+            break
+        for row in np.flatnonzero(active):
+            picks[row].append(int(choice[row]))
+        available[rows[active], choice[active]] = False
+        # 只用新选中候选的那一行更新最大相似度
+        np.maximum(max_similarity, gram[rows, choice], out=max_similarity)
+        scores = weighted - (1 - lambda_param) * max_similarity
+        scores[~available] = -np.inf
+        choice = scores.argmax(axis=1)
+    return picks
+
 
 class QdrantSearchService:
     """Qdrant混合检索服务"""
 
-    def __init__(self, base_url: str = "http://127.0.0.1:6333", collection_name: str = "video_assets"):
-        self.base_url = base_url
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:6333",
+        collection_name: str = "video_assets",
+        timeout: float = 5.0,
+        retries: int = 2,
+        pool_size: int = 32,
+        prefer_grpc: bool = False,
+        grpc_port: int = 6334,
+        vector_lookup: Optional[Callable[[List[Any]], Tuple[np.ndarray, np.ndarray]]] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        # MMR 候选向量的本地来源（point id 列表 → (向量, 命中掩码)），设置后检索不再请求 with_vector
+        self.vector_lookup = vector_lookup
+        self._lookup_retry_at = 0.0
         self.collection_name = collection_name
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.grpc_port = grpc_port
+        self.prefer_grpc = prefer_grpc and AsyncQdrantClient is not None
+        if prefer_grpc and not self.prefer_grpc:
+            logger.warning("未安装 qdrant-client，gRPC 不可用，使用 REST")
+        # 客户端在首次使用时创建（异步客户端须在事件循环中创建）
+        self._client = None
+        self._async_client = None
+
+    # --------------------------------------------
+    # 传输层
+    # --------------------------------------------
+    def _sync_client(self):
+        if self._client is None:
+            if self.prefer_grpc:
+                self._client = QdrantClient(
+                    url=self.base_url, prefer_grpc=True, grpc_port=self.grpc_port, timeout=int(self.timeout)
+                )
+            elif httpx is not None:
+                self._client = httpx.Client(
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+            else:
+                self._client = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                self._client.mount("http://", adapter)
+                self._client.mount("https://", adapter)
+        return self._client
+
+    def _aclient(self):
+        if self._async_client is None:
+            if self.prefer_grpc:
+                self._async_client = AsyncQdrantClient(
+                    url=self.base_url, prefer_grpc=True, grpc_port=self.grpc_port, timeout=int(self.timeout)
+                )
+            else:
+                self._async_client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+        return self._async_client
+
+    def _backoff(self, attempt: int) -> float:
+        return 0.1 * (2 ** attempt)
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Any:
+        """同步 REST POST（带重试），返回 result 字段"""
+        client = self._sync_client()
+        url = path if httpx is not None else f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            try:
+                if httpx is not None:
+                    resp = client.post(url, json=body)
+                else:
+                    resp = client.post(url, json=body, timeout=self.timeout)
+                if resp.status_code in RETRY_STATUS and attempt < self.retries:
+                    time.sleep(self._backoff(attempt))
+                    continue
+                resp.raise_for_status()
+                return resp.json()["result"]
+            except TRANSPORT_ERRORS as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"Qdrant 请求失败，重试: {e}")
+                time.sleep(self._backoff(attempt))
+
+    async def _apost(self, path: str, body: Dict[str, Any]) -> Any:
+        """异步 REST POST（带重试）；未安装 httpx 时在线程中执行同步请求"""
+        if httpx is None:
+            return await asyncio.to_thread(self._post, path, body)
+        client = self._aclient()
+        for attempt in range(self.retries + 1):
+            try:
+                resp = await client.post(path, json=body)
+                if resp.status_code in RETRY_STATUS and attempt < self.retries:
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                resp.raise_for_status()
+                return resp.json()["result"]
+            except httpx.TransportError as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"Qdrant 请求失败，重试: {e}")
+                await asyncio.sleep(self._backoff(attempt))
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            if self.prefer_grpc:
+                await self._async_client.close()
+            else:
+                await self._async_client.aclose()
+            self._async_client = None
+        self.close()
+
+    # --------------------------------------------
+    # 点查询（返回 REST 格式的 dict：id / score / payload / vector）
+    # --------------------------------------------
+    def _path(self, action: str) -> str:
+        return f"/collections/{self.collection_name}/points/{action}"
 
-    def search_by_vector(
+    @staticmethod
+    def _grpc_filter(filter_body: Optional[Dict[str, Any]]):
+        return qdrant_models.Filter(**filter_body) if filter_body else None
+
+    def _grpc_search_request(self, body: Dict[str, Any]):
+        return qdrant_models.SearchRequest(
+            vector=body["vector"],
+            limit=body["limit"],
+            score_threshold=body.get("score_threshold"),
+            filter=self._grpc_filter(body.get("filter")),
+            with_payload=body.get("with_payload", True),
+            with_vector=body.get("with_vector", False),
+        )
+
+    @staticmethod
+    def _point_dict(point) -> Dict[str, Any]:
+        """qdrant-client 的 ScoredPoint/Record → REST 格式"""
+        return {
+            "id": point.id,
+            "score": getattr(point, "score", None),
+            "payload": point.payload or {},
+            "vector": point.vector,
+        }
+
+    def search_points(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.prefer_grpc:
+            results = self._sync_client().search_batch(self.collection_name, [self._grpc_search_request(body)])
+            return [self._point_dict(p) for p in results[0]]
+        return self._post(self._path("search"), body)
+
+    async def asearch_points(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.prefer_grpc:
+            return (await self.asearch_batch_points([body]))[0]
+        return await self._apost(self._path("search"), body)
+
+    def search_batch_points(self, bodies: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """多个查询一次请求（REST: points/search/batch）"""
+        if not bodies:
+            return []
+        if self.prefer_grpc:
+            results = self._sync_client().search_batch(
+                self.collection_name, [self._grpc_search_request(body) for body in bodies]
+            )
+            return [[self._point_dict(p) for p in hits] for hits in results]
+        return self._post(self._path("search/batch"), {"searches": bodies})
+
+    async def asearch_batch_points(self, bodies: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        if not bodies:
+            return []
+        if self.prefer_grpc:
+            results = await self._aclient().search_batch(
+                self.collection_name, [self._grpc_search_request(body) for body in bodies]
+            )
+            return [[self._point_dict(p) for p in hits] for hits in results]
+        return await self._apost(self._path("search/batch"), {"searches": bodies})
+
+    def _scroll_body(self, scroll_filter, limit, offset, with_payload, with_vector) -> Dict[str, Any]:
+        body = {"limit": limit, "with_payload": with_payload, "with_vector": with_vector}
+        if scroll_filter:
+            body["filter"] = scroll_filter
+        if offset is not None:
+            body["offset"] = offset
+        return body
+
+    def scroll(
+        self,
+        scroll_filter: Optional[Dict[str, Any]] = None,
+        limit: int = 256,
+        offset: Any = None,
+        with_payload: Any = True,
+        with_vector: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Any]:
+        """分页遍历点，返回 (点列表, 下一页offset；None 表示已到末尾)"""
+        if self.prefer_grpc:
+            records, next_offset = self._sync_client().scroll(
+                self.collection_name, scroll_filter=self._grpc_filter(scroll_filter), limit=limit,
+                offset=offset, with_payload=with_payload, with_vectors=with_vector,
+            )
+            return [self._point_dict(r) for r in records], next_offset
+        result = self._post(self._path("scroll"), self._scroll_body(scroll_filter, limit, offset, with_payload, with_vector))
+        return result["points"], result.get("next_page_offset")
+
+    async def ascroll(
+        self,
+        scroll_filter: Optional[Dict[str, Any]] = None,
+        limit: int = 256,
+        offset: Any = None,
+        with_payload: Any = True,
+        with_vector: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Any]:
+        if self.prefer_grpc:
+            records, next_offset = await self._aclient().scroll(
+                self.collection_name, scroll_filter=self._grpc_filter(scroll_filter), limit=limit,
+                offset=offset, with_payload=with_payload, with_vectors=with_vector,
+            )
+            return [self._point_dict(r) for r in records], next_offset
+        result = await self._apost(
+            self._path("scroll"), self._scroll_body(scroll_filter, limit, offset, with_payload, with_vector)
+        )
+        return result["points"], result.get("next_page_offset")
+
+    # --------------------------------------------
+    # 检索
+    # --------------------------------------------
+    def _search_body(
         self,
         query_vector: List[float],
-        top_k: int = 10,
-        threshold: float = 0.0,
-        filter_tags: Optional[List[str]] = None,
-        filter_scene: Optional[str] = None
-    ) -> List[Dict[str, Any]]:
+        top_k: int,
+        threshold: float,
+        filter_tags: Optional[List[str]],
+        filter_scene: Optional[str],
+        need_vectors: bool = False,
+        payload_filter: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
         """
-        向量检索（支持标签和场景过滤）
+        构建向量检索请求（支持标签和场景过滤）
 
-        Args:
-            query_vector: CLIP查询向量
-            top_k: 返回结果数量
-            threshold: 相似度阈值（百分制 0-100），会自动转换为Qdrant原始范围
-            filter_tags: 标签过滤列表
-            filter_scene: 场景过滤关键词
+        threshold 为百分制（0-100），转换为Qdrant的0-1范围；
+        need_vectors 时让 Qdrant 返回向量（MMR 且本地向量缓存不可用时）；
+        payload_filter 为 Qdrant filter（如 filter_index.qdrant_filter 的结果），必须满足
         """
         # 阈值转换：外部使用百分制(0-100)，Qdrant使用0-1，需要除以100
         qdrant_threshold = threshold / 100.0 if threshold > 0 else 0.0
@@ -40,42 +362,31 @@ class QdrantSearchService:
 
         if filter_tags:
             # 标签过滤：tags字段包含任一指定标签
-            tag_conditions = [
-                {"key": "tags", "match": {"any": filter_tags}}
-            ]
-            filter_conditions.extend(tag_conditions)
+            filter_conditions.append({"key": "tags", "match": {"any": filter_tags}})
 
         if filter_scene:
             # 场景过滤：description字段包含场景关键词
-            filter_conditions.append({
-                "key": "description",
-                "match": {"text": filter_scene}
-            })
+            filter_conditions.append({"key": "description", "match": {"text": filter_scene}})
 
-        # 构建请求
         payload = {
-            "vector": query_vector,
+            "vector": list(map(float, query_vector)),
             "limit": top_k * 3,  # 过采样以支持后续MMR过滤
             "score_threshold": qdrant_threshold,  # 使用转换后的阈值
-            "with_payload": True,
-            "with_vector": True  # 需要向量用于MMR计算
+            "with_payload": PAYLOAD_FIELDS,
+            "with_vector": need_vectors
         }
 
+        filter_body = {}
         if filter_conditions:
-            payload["filter"] = {
-                "should": filter_conditions  # OR条件
-            }
+            filter_body["should"] = filter_conditions  # OR条件
+        if payload_filter:
+            filter_body["must"] = [payload_filter]
+        if filter_body:
+            payload["filter"] = filter_body
+        return payload
 
-        # 调用Qdrant API
-        resp = requests.post(
-            f"{self.base_url}/collections/{self.collection_name}/points/search",
-            json=payload
-        )
-        resp.raise_for_status()
-
-        results = resp.json()["result"]
-
-        # 格式化返回结果
+    @staticmethod
+    def _format_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         formatted_results = []
         for item in results:
             payload = item["payload"]
@@ -88,15 +399,81 @@ class QdrantSearchService:
                 "tags": payload.get("tags", []),
                 "description": payload.get("description", ""),
                 "duration": payload.get("duration", 5.0),
-                "vector": item["vector"]  # 用于MMR计算
             }
             # 添加分片信息（如果存在）
             if "segment" in payload:
                 result["segment"] = payload["segment"]
             formatted_results.append(result)
-
         return formatted_results
 
+    def search_by_vector(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        threshold: float = 0.0,
+        filter_tags: Optional[List[str]] = None,
+        filter_scene: Optional[str] = None,
+        payload_filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        向量检索（支持标签和场景过滤）
+
+        Args:
+            query_vector: CLIP查询向量
+            top_k: 返回结果数量
+            threshold: 相似度阈值（百分制 0-100），会自动转换为Qdrant原始范围
+            filter_tags: 标签过滤列表
+            filter_scene: 场景过滤关键词
+            payload_filter: 额外的 Qdrant filter（必须满足）
+        """
+        body = self._search_body(query_vector, top_k, threshold, filter_tags, filter_scene, payload_filter=payload_filter)
+        return self._format_results(self.search_points(body))
+
+    async def asearch_by_vector(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        threshold: float = 0.0,
+        filter_tags: Optional[List[str]] = None,
+        filter_scene: Optional[str] = None,
+        payload_filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """search_by_vector 的异步版本"""
+        body = self._search_body(query_vector, top_k, threshold, filter_tags, filter_scene, payload_filter=payload_filter)
+        return self._format_results(await self.asearch_points(body))
+
+    # --------------------------------------------
+    # MMR 候选向量
+    # --------------------------------------------
+    def _local_vectors(self) -> bool:
+        """MMR 向量是否取自本地缓存（最近一次未命中后 LOOKUP_RETRY_SECONDS 内改为让 Qdrant 随检索返回）"""
+        return self.vector_lookup is not None and time.monotonic() >= self._lookup_retry_at
+
+    def _attach_vectors(self, hits: List[Dict[str, Any]], candidates: List[Dict[str, Any]]) -> bool:
+        """
+        把 Qdrant 返回的或本地缓存中的向量放入 candidate["vector"]
+
+        本地缓存有未命中（新写入尚未刷新、或点不来自素材存储）时不放入，返回 False，
+        由调用方带 with_vector 重新检索；之后一段时间的检索直接带 with_vector，不再先查缓存
+        """
+        if self.vector_lookup is None or all(hit.get("vector") is not None for hit in hits):
+            for candidate, hit in zip(candidates, hits):
+                candidate["vector"] = hit.get("vector")
+            return True
+        vectors, found = self.vector_lookup([hit["id"] for hit in hits])
+        if not found.all():
+            self._lookup_retry_at = time.monotonic() + LOOKUP_RETRY_SECONDS
+            logger.info(f"本地向量缓存未命中 {int((~found).sum())} 个点，{LOOKUP_RETRY_SECONDS:.0f}秒内改由 Qdrant 返回向量")
+            return False
+        for candidate, vector in zip(candidates, vectors):
+            candidate["vector"] = vector
+        return True
+
+    @staticmethod
+    def _with_vectors(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # 没有向量的点不参与MMR
+        return [c for c in candidates if c.get("vector") is not None]
+
     def apply_mmr(
         self,
         candidates: List[Dict[str, Any]],
@@ -108,7 +485,7 @@ class QdrantSearchService:
         应用MMR（Maximal Marginal Relevance）算法增强多样性
 
         Args:
-            candidates: 候选结果列表
+            candidates: 候选结果列表（按相似度降序）
             query_vector: 查询向量
             top_k: 最终返回数量
             lambda_param: 相关性权重（0-1）
@@ -122,51 +499,10 @@ class QdrantSearchService:
         if len(candidates) <= top_k:
             return candidates
 
-        # 转换为numpy数组便于计算
-        query_vec = np.array(query_vector)
-        candidate_vecs = np.array([c["vector"] for c in candidates])
-
-        # 已选择的结果
-        selected = []
-        selected_indices = []
-
-        # 第一个结果：选择与query最相似的
-        first_idx = 0  # candidates已按相似度排序
-        selected.append(candidates[first_idx])
-        selected_indices.append(first_idx)
-
-        # 迭代选择剩余结果
-        while len(selected) < top_k and len(selected) < len(candidates):
-            best_score = -float('inf')
-            best_idx = -1
-
-            for i, candidate in enumerate(candidates):
-                if i in selected_indices:
-                    continue
-
-                # 相似度已转为百分制，这里还原到0-1用于MMR计算
-                relevance = candidate["similarity"] / 100.0
-
-                # 计算与已选结果的最大相似度（多样性惩罚）
-                max_similarity = 0.0
-                for selected_idx in selected_indices:
-                    sim = self._cosine_similarity(
-                        candidate_vecs[i],
-                        candidate_vecs[selected_idx]
-                    )
-                    max_similarity = max(max_similarity, sim)
-
-                # MMR分数：相关性 - 多样性惩罚
-                mmr_score = lambda_param * relevance - \
-                    (1 - lambda_param) * max_similarity
-
-                if mmr_score > best_score:
-                    best_score = mmr_score
-                    best_idx = i
-
-            if best_idx != -1:
-                selected.append(candidates[best_idx])
-                selected_indices.append(best_idx)
+        # 相似度已转为百分制，这里还原到0-1用于MMR计算
+        relevance = np.array([c["similarity"] / 100.0 for c in candidates], dtype=np.float32)
+        vectors = np.array([c["vector"] for c in candidates], dtype=np.float32)
+        selected = [candidates[i] for i in mmr_select(vectors, relevance, top_k, lambda_param)]
 
         # 移除vector字段（前端不需要）
         for item in selected:
@@ -174,17 +510,59 @@ class QdrantSearchService:
 
         return selected
 
-    @staticmethod
-    def _cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """计算余弦相似度"""
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
+    def apply_mmr_batch(
+        self,
+        candidate_lists: List[List[Dict[str, Any]]],
+        top_k: int = 10,
+        lambda_param: float = 0.7
+    ) -> List[List[Dict[str, Any]]]:
+        """apply_mmr 的批量版本：多个查询的候选一起计算（每个查询的结果与单独调用相同）"""
+        results: List[List[Dict[str, Any]]] = [list(c) for c in candidate_lists]
+        pending = [i for i, c in enumerate(candidate_lists) if len(c) > top_k]
+        if pending:
+            # 候选数量不同的查询补齐到相同长度，补齐位置的相关性为 -inf，不会被选中
+            n = max(len(candidate_lists[i]) for i in pending)
+            dim = len(candidate_lists[pending[0]][0]["vector"])
+            vectors = np.zeros((len(pending), n, dim), dtype=np.float32)
+            relevance = np.full((len(pending), n), -np.inf, dtype=np.float32)
+            for row, i in enumerate(pending):
+                candidates = candidate_lists[i]
+                vectors[row, :len(candidates)] = [c["vector"] for c in candidates]
+                relevance[row, :len(candidates)] = [c["similarity"] / 100.0 for c in candidates]
+            picks = mmr_select_batch(vectors, relevance, top_k, lambda_param)
+            for row, i in enumerate(pending):
+                results[i] = [candidate_lists[i][j] for j in picks[row]]
+
+        for selected in results:
+            for item in selected:
+                item.pop("vector", None)
+        return results
 
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
+    def _rerank(
+        self,
+        candidates: List[Dict[str, Any]],
+        query_vector: List[float],
+        top_k: int,
+        enable_mmr: bool,
+        mmr_lambda: float,
+    ) -> List[Dict[str, Any]]:
+        if not candidates:
+            return []
+
+        # 应用MMR多样性算法
+        if enable_mmr and len(candidates) > top_k:
+            return self.apply_mmr(
+                candidates=candidates,
+                query_vector=query_vector,
+                top_k=top_k,
+                lambda_param=mmr_lambda
+            )
 
-        return dot_product / (norm1 * norm2)
+        # 不启用MMR，直接取top_k
+        results = candidates[:top_k]
+        for item in results:
+            item.pop("vector", None)
+        return results
 
     def hybrid_search(
         self,
@@ -194,41 +572,103 @@ class QdrantSearchService:
         filter_tags: Optional[List[str]] = None,
         filter_scene: Optional[str] = None,
         enable_mmr: bool = True,
-        mmr_lambda: float = 0.7
+        mmr_lambda: float = 0.7,
+        payload_filter: Optional[Dict[str, Any]] = None,
     ) -> List[Dict[str, Any]]:
         """
         混合检索：向量搜索 + 标签过滤 + MMR多样性
 
         这是主要的搜索接口，整合了所有优化策略
         """
-        # 1. 向量检索（带过滤）
-        candidates = self.search_by_vector(
-            query_vector=query_vector,
-            top_k=top_k,
-            threshold=threshold,
-            filter_tags=filter_tags,
-            filter_scene=filter_scene
+        body = self._search_body(
+            query_vector, top_k, threshold, filter_tags, filter_scene,
+            need_vectors=enable_mmr and not self._local_vectors(), payload_filter=payload_filter,
         )
+        hits = self.search_points(body)
+        candidates = self._format_results(hits)
+        if enable_mmr and len(candidates) > top_k:
+            if not self._attach_vectors(hits, candidates):
+                body["with_vector"] = True
+                hits = self.search_points(body)
+                candidates = self._format_results(hits)
+                self._attach_vectors(hits, candidates)
+            candidates = self._with_vectors(candidates)
+        return self._rerank(candidates, query_vector, top_k, enable_mmr, mmr_lambda)
+
+    async def ahybrid_search(
+        self,
+        query_vector: List[float],
+        top_k: int = 10,
+        threshold: float = 25.0,
+        filter_tags: Optional[List[str]] = None,
+        filter_scene: Optional[str] = None,
+        enable_mmr: bool = True,
+        mmr_lambda: float = 0.7,
+        payload_filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """hybrid_search 的异步版本（FastAPI 处理函数中使用）"""
+        return (await self.ahybrid_search_batch(
+            [query_vector], top_k, threshold, filter_tags, filter_scene, enable_mmr, mmr_lambda, payload_filter
+        ))[0]
 
-        if not candidates:
+    async def ahybrid_search_batch(
+        self,
+        query_vectors: List[List[float]],
+        top_k: int = 10,
+        threshold: float = 25.0,
+        filter_tags: Optional[List[str]] = None,
+        filter_scene: Optional[str] = None,
+        enable_mmr: bool = True,
+        mmr_lambda: float = 0.7,
+        payload_filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """多个查询一次 search/batch 请求（如整部分镜的所有段落），每个查询独立做MMR"""
+        if not query_vectors:
             return []
-
-        # 2. 应用MMR多样性算法
-        if enable_mmr and len(candidates) > top_k:
-            results = self.apply_mmr(
-                candidates=candidates,
-                query_vector=query_vector,
-                top_k=top_k,
-                lambda_param=mmr_lambda
+        need_vectors = enable_mmr and not self._local_vectors()
+        bodies = [
+            self._search_body(
+                vector, top_k, threshold, filter_tags, filter_scene,
+                need_vectors=need_vectors, payload_filter=payload_filter,
             )
-        else:
-            # 不启用MMR，直接取top_k
-            results = candidates[:top_k]
-            for item in results:
-                item.pop("vector", None)
-
-        return results
-
+            for vector in query_vectors
+        ]
+        batch = await self._asearch_bodies(bodies)
+        candidate_lists = [self._format_results(hits) for hits in batch]
+        if not enable_mmr:
+            return [
+                self._rerank(candidates, vector, top_k, enable_mmr, mmr_lambda)
+                for vector, candidates in zip(query_vectors, candidate_lists)
+            ]
 
-# 全局实例
-qdrant_service = QdrantSearchService()
+        # 所有需要MMR的查询的候选一起查本地缓存；有未命中时这些查询带 with_vector 再检索一次
+        pending = [i for i, candidates in enumerate(candidate_lists) if len(candidates) > top_k]
+        if pending:
+            attached = await asyncio.to_thread(
+                self._attach_vectors,
+                [hit for i in pending for hit in batch[i]],
+                [candidate for i in pending for candidate in candidate_lists[i]],
+            )
+            if not attached:
+                for i in pending:
+                    bodies[i]["with_vector"] = True
+                retried = await self._asearch_bodies([bodies[i] for i in pending])
+                for i, hits in zip(pending, retried):
+                    candidate_lists[i] = self._format_results(hits)
+                    self._attach_vectors(hits, candidate_lists[i])
+            for i in pending:
+                candidate_lists[i] = self._with_vectors(candidate_lists[i])
+        return self.apply_mmr_batch(candidate_lists, top_k=top_k, lambda_param=mmr_lambda)
+
+    async def _asearch_bodies(self, bodies: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        return await self.asearch_batch_points(bodies) if len(bodies) > 1 else [await self.asearch_points(bodies[0])]
+
+
+# 全局实例：与发件箱同步（qdrant_sync.QdrantSyncWorker）写入同一个 collection（QDRANT_COLLECTION）
+qdrant_service = QdrantSearchService(
+    base_url=os.getenv("QDRANT_URL", "http://127.0.0.1:6333"),
+    collection_name=os.getenv("QDRANT_COLLECTION", "video_assets"),
+    timeout=float(os.getenv("QDRANT_TIMEOUT", "5")),
+    retries=int(os.getenv("QDRANT_RETRIES", "2")),
+    prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "0") == "1",
+)
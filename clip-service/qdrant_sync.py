@@ -0,0 +1,239 @@
+"""
+Qdrant 增量同步 - 在clip_server.py中集成
+后台线程消费素材存储的变更发件箱（sync_outbox），把新增/修改的素材批量 upsert 到 Qdrant、
+把已删除素材对应的点删除；Qdrant 不可用时发件箱中的记录保留，按指数退避重试。
+
+- point id 与 sync_qdrant.build_point 相同（hashId = sha1(canonicalPath#segment)），与手动同步的数据兼容
+- 删除按 payload 中的 filePath 过滤，同一文件的多个分片点一起删除
+- 发件箱在素材存储的写事务中写入，其他进程（batch_scan.py、retag_all.py 等）的写入同样会被同步
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from asset_store import OUTBOX_DELETE, AssetStore
+from sync_qdrant import build_point, ensure_payload_indexes
+
+logger = logging.getLogger(__name__)
+
+
+class QdrantSyncWorker:
+    """
+    发件箱 → Qdrant 同步线程
+
+    - 每轮取最早的 batch_size 条变更：upsert 合并为一次 PUT points，delete 合并为一次按 filePath 过滤的删除
+    - 成功后按 (filePath, enqueued_at) 确认，发送期间又被修改的文件留到下一轮
+    - 连接失败与 5xx 按指数退避重试（最长 max_backoff 秒）
+    - 4xx（数据本身被拒绝）时二分批次找出被拒绝的记录，只为这些 filePath 累加重试次数，其余照常确认；
+      超过 max_attempts 次的记录跳过，等待人工处理（stats() 中列出）
+    """
+
+    def __init__(
+        self,
+        store: AssetStore,
+        qdrant_url: str,
+        collection: str,
+        batch_size: int = 64,
+        poll_interval: float = 2.0,
+        max_backoff: float = 60.0,
+        max_attempts: int = 20,
+        timeout: float = 10.0,
+        vector_size: int = 512,
+        start: bool = True,
+    ):
+        self.store = store
+        self.qdrant_url = qdrant_url.rstrip("/")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.vector_size = vector_size
+        self._session = requests.Session()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._collection_ready = False
+        self._failures = 0
+        self.upserted = 0
+        self.deleted = 0
+        # 被 Qdrant 拒绝（4xx）的次数与最近被拒绝的 filePath → 错误信息
+        self.rejected = 0
+        self._recent_rejections: "OrderedDict[str, str]" = OrderedDict()
+        self.last_error: Optional[str] = None
+        self.last_sync_at: Optional[float] = None
+        self._thread = threading.Thread(target=self._run, name="qdrant-sync", daemon=True)
+        # start=False 时不启动后台线程，由调用方循环调用 sync_once()（命令行一次性同步）
+        if start:
+            self._thread.start()
+
+    def start(self):
+        """启动后台同步线程（构造时 start=False，如服务启动时再调用）"""
+        if not self._thread.is_alive():
+            self._thread.start()
+
+    def notify(self):
+        """本进程写入后立即唤醒（其他进程的写入按 poll_interval 轮询发现）"""
+        self._wake.set()
+
+    def close(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self._session.close()
+
+    # --------------------------------------------
+    # Qdrant 请求
+    # --------------------------------------------
+    def _url(self, path: str) -> str:
+        return f"{self.qdrant_url}/collections/{self.collection}{path}"
+
+    def _ensure_collection(self):
+        if self._collection_ready:
+            return
+        resp = self._session.get(self._url(""), timeout=self.timeout)
+        if resp.status_code == 404:
+            resp = self._session.put(
+                self._url(""),
+                json={
+                    "vectors": {"size": self.vector_size, "distance": "Cosine"},
+                    "hnsw_config": {"m": 64, "ef_construct": 256},
+                },
+                timeout=self.timeout,
+            )
+        resp.raise_for_status()
+        ensure_payload_indexes(self._session, self.qdrant_url, self.collection, self.timeout)
+        self._collection_ready = True
+
+    def _upsert(self, file_paths: List[str]) -> int:
+        points = []
+        for item in self.store.iter_items(include_embeddings=True, file_paths=file_paths):
+            point_id, payload, vector = build_point(item)
+            if vector:
+                points.append({"id": point_id, "vector": vector, "payload": payload})
+        if points:
+            resp = self._session.put(
+                self._url("/points"), params={"wait": "true"}, json={"points": points}, timeout=self.timeout
+            )
+            resp.raise_for_status()
+        return len(points)
+
+    def _delete(self, file_paths: List[str]):
+        resp = self._session.post(
+            self._url("/points/delete"),
+            params={"wait": "true"},
+            json={"filter": {"must": [{"key": "filePath", "match": {"any": file_paths}}]}},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+
+    # --------------------------------------------
+    # 同步循环
+    # --------------------------------------------
+    @staticmethod
+    def _rejected(error: requests.HTTPError) -> bool:
+        """4xx 说明数据本身被拒绝（如向量维度不符）；连接失败与 5xx 属于 Qdrant 不可用"""
+        return error.response is not None and 400 <= error.response.status_code < 500
+
+    def _send(self, send: Callable[[List[str]], Any], file_paths: List[str]) -> Tuple[List[str], Dict[str, str]]:
+        """
+        发送一组变更；整组被 4xx 拒绝时二分重发，定位被拒绝的单条记录
+
+        返回 (已发送的 filePath, {被拒绝的 filePath: 错误信息})；Qdrant 不可用时抛出异常
+        """
+        try:
+            send(file_paths)
+            return file_paths, {}
+        except requests.HTTPError as e:
+            if not self._rejected(e):
+                raise
+            if len(file_paths) == 1:
+                return [], {file_paths[0]: f"{e.response.status_code}: {e.response.text[:200]}"}
+        middle = len(file_paths) // 2
+        sent, rejected = self._send(send, file_paths[:middle])
+        more_sent, more_rejected = self._send(send, file_paths[middle:])
+        return sent + more_sent, {**rejected, **more_rejected}
+
+    def sync_once(self) -> int:
+        """同步一批变更，返回处理的记录数（0 表示发件箱已空）"""
+        entries = self.store.outbox_peek(self.batch_size, max_attempts=self.max_attempts)
+        if not entries:
+            return 0
+        upserts = [file_path for file_path, op, _, _ in entries if op != OUTBOX_DELETE]
+        deletes = [file_path for file_path, op, _, _ in entries if op == OUTBOX_DELETE]
+        upserted = 0
+
+        def upsert(file_paths: List[str]):
+            nonlocal upserted
+            upserted += self._upsert(file_paths)
+
+        # Qdrant 不可用时抛出异常，记录保留原样重试，不计次数
+        self._ensure_collection()
+        sent_deletes, rejected = self._send(self._delete, deletes) if deletes else ([], {})
+        sent_upserts, rejected_upserts = self._send(upsert, upserts) if upserts else ([], {})
+        rejected.update(rejected_upserts)
+
+        sent = set(sent_deletes) | set(sent_upserts)
+        self.store.outbox_ack(
+            (file_path, enqueued_at) for file_path, _, enqueued_at, _ in entries if file_path in sent
+        )
+        if rejected:
+            # 只为被拒绝的记录累加重试次数，超过上限后跳过
+            self.store.outbox_retry(rejected)
+            self.rejected += len(rejected)
+            self.last_error = next(iter(rejected.values()))
+            logger.warning(f"Qdrant 拒绝了 {len(rejected)} 条记录: {list(rejected)[:5]}")
+        if rejected or self._recent_rejections:
+            # 整体替换（stats() 在其他线程读取）：去掉已同步成功的，保留最近100个
+            recent = OrderedDict(
+                (file_path, error) for file_path, error in self._recent_rejections.items()
+                if file_path not in sent and file_path not in rejected
+            )
+            recent.update(rejected)
+            while len(recent) > 100:
+                recent.popitem(last=False)
+            self._recent_rejections = recent
+        self.upserted += upserted
+        self.deleted += len(sent_deletes)
+        self.last_sync_at = time.time()
+        return len(entries)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.sync_once():
+                    self._failures = 0
+                    continue
+            except Exception as e:
+                self._failures += 1
+                self._collection_ready = False
+                self.last_error = str(e)
+                backoff = min(self.max_backoff, 2 ** self._failures)
+                logger.warning(f"Qdrant 同步失败（{backoff:.0f}秒后重试）: {e}")
+                self._stop.wait(backoff)
+                continue
+            # 发件箱已空：等待本进程写入的通知，或定时检查其他进程的写入
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        exhausted, exhausted_paths = self.store.outbox_exhausted(self.max_attempts)
+        return {
+            "collection": self.collection,
+            "pending": self.store.outbox_size(),
+            "upserted": self.upserted,
+            "deleted": self.deleted,
+            # 被 Qdrant 拒绝、等待重试的记录（最近100个）与已达重试上限被跳过的记录
+            "rejected": self.rejected,
+            "rejected_paths": dict(self._recent_rejections),
+            "exhausted": exhausted,
+            "exhausted_paths": exhausted_paths,
+            "consecutive_failures": self._failures,
+            "last_error": self.last_error,
+            "last_sync_at": self.last_sync_at,
+        }
@@ -0,0 +1,217 @@
+"""
+压缩向量（标量量化）- 在search_index.py中集成
+检索索引常驻内存的部分改为压缩表示，先在压缩向量上取候选短名单，再用素材存储 memmap
+中的全精度向量精确重排，得分与精确检索一致，只有短名单之外的召回损失：
+
+- float16: 每维2字节（全精度的1/2）
+- int8:    每维1字节（1/4），逐维 scale/offset 线性量化：x ≈ code · scale + offset
+- binary:  每维1位（512维 = 64字节，1/32），只保留符号位，按汉明距离（异或 + popcount）取候选；
+           粗筛精度较低，短名单通常取几千行
+- pca:     离线拟合的 PCA 投影（pca_projection.PCAProjection）降到 128/256 维的 float32 向量，查询同样投影后按内积取候选
+
+压缩向量按向量文件行号（vec_row）追加保存（与 ann_index 相同），新写入只编码新行；
+被替换的旧行保留为空洞，打分时屏蔽。全精度向量只在重排时按行读取，不需要常驻内存。
+"""
+import logging
+from typing import Any, Dict, NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "float16", "int8", "binary")
+
+# 分块编码/打分的行数（限制临时 float32 块的大小）
+CHUNK_ROWS = 65536
+
+# 字节 popcount 查表（numpy < 2.0 没有 bitwise_count）
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(codes: np.ndarray, query_bits: np.ndarray) -> np.ndarray:
+    """packbits 编码的各行与查询的汉明距离"""
+    distances = np.empty(codes.shape[0], dtype=np.int32)
+    wide = codes.shape[1] % 8 == 0 and hasattr(np, "bitwise_count")
+    for start in range(0, codes.shape[0], CHUNK_ROWS):
+        block = np.bitwise_xor(codes[start:start + CHUNK_ROWS], query_bits)
+        if wide:
+            # 按 uint64 计数：每行 8 次 popcount
+            counts = np.bitwise_count(np.ascontiguousarray(block).view(np.uint64))
+        else:
+            counts = _POPCOUNT[block]
+        distances[start:start + CHUNK_ROWS] = counts.sum(axis=1, dtype=np.int32)
+    return distances
+
+
+class QuantizedSnapshot(NamedTuple):
+    """某个快照的压缩向量（整体替换，查询无需加锁）"""
+    mode: str
+    codes: np.ndarray               # (文件行数, dim) float16 / int8，binary 为 (文件行数, dim/8) uint8；行号为 vec_row
+    row_of: np.ndarray              # vec_row → 索引行号（-1 为已被替换的旧行）
+    vec_rows: np.ndarray            # 索引行号 → vec_row
+    scale: Optional[np.ndarray]     # int8: 逐维缩放
+    offset: Optional[np.ndarray]    # int8: 逐维偏移
+    projection: Any = None          # pca: PCAProjection
+
+    def _query(self, query: np.ndarray):
+        if self.projection is not None:
+            return self.projection.transform(query), 0.0
+        if self.scale is None:
+            return query, 0.0
+        return query * self.scale, float(query @ self.offset)
+
+    def _score(self, codes: np.ndarray, query: np.ndarray, bias: float) -> np.ndarray:
+        if self.mode == "binary":
+            # 汉明距离越小越相似
+            return -hamming_distances(codes, np.packbits(query > 0)).astype(np.float32)
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], CHUNK_ROWS):
+            scores[start:start + CHUNK_ROWS] = codes[start:start + CHUNK_ROWS].astype(np.float32) @ query
+        return scores + bias
+
+    def shortlist(self, query: np.ndarray, size: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """按压缩向量的近似得分取前 size 个索引行号（rows 不为空时只在这些行中选）"""
+        q, bias = self._query(query)
+        if rows is None:
+            scores = self._score(self.codes, q, bias)
+            scores[self.row_of < 0] = -np.inf
+            live = int((self.row_of >= 0).sum())
+            top = _top_indices(scores, min(size, live))
+            return self.row_of[top]
+        scores = self._score(self.codes[self.vec_rows[rows]], q, bias)
+        return rows[_top_indices(scores, size)]
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    if k >= scores.shape[0]:
+        return np.arange(scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+class QuantizedVectors:
+    """
+    增量维护的压缩向量
+
+    - update(): 与 EmbeddingIndex 快照同步，只编码新追加的行，生成新的 snapshot
+    - int8 的逐维范围在首次编码时由现有向量确定（预归一化的CLIP向量各维分布稳定），之后超出范围的值截断；
+      向量文件压缩（行号改变）时重新编码并重新确定范围
+    """
+
+    def __init__(self, mode: str = "int8", projection=None):
+        if mode == "pca":
+            if projection is None:
+                raise ValueError("pca 模式需要降维投影")
+        elif mode not in QUANTIZATION_MODES or mode == "none":
+            raise ValueError(f"不支持的量化模式: {mode}")
+        self.mode = mode
+        self.projection = projection
+        self.dtype = np.dtype({"float16": np.float16, "int8": np.int8, "binary": np.uint8, "pca": np.float32}[mode])
+        self.vectors_file: Optional[str] = None
+        self.scale: Optional[np.ndarray] = None
+        self.offset: Optional[np.ndarray] = None
+        # 容量翻倍的缓冲区，_rows 之后为未使用的容量；旧快照的视图不受追加影响
+        self._buffer = np.zeros((0, 0), dtype=self.dtype)
+        self._rows = 0
+        self.snapshot: Optional[QuantizedSnapshot] = None
+
+    def _width(self, dim: int) -> int:
+        """每行编码的列数"""
+        if self.mode == "pca":
+            return self.projection.dim
+        return (dim + 7) // 8 if self.mode == "binary" else dim
+
+    def _reset(self, vectors_file: str, dim: int):
+        self.vectors_file = vectors_file
+        self.scale = None
+        self.offset = None
+        self._buffer = np.zeros((0, self._width(dim)), dtype=self.dtype)
+        self._rows = 0
+
+    def _fit(self, vectors: np.ndarray):
+        lo = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+        hi = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, vectors.shape[0], CHUNK_ROWS):
+            block = np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32)
+            np.minimum(lo, block.min(axis=0), out=lo)
+            np.maximum(hi, block.max(axis=0), out=hi)
+        self.scale = np.maximum(hi - lo, 1e-6) / 255.0
+        self.offset = lo + 128.0 * self.scale
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.mode == "float16":
+            return vectors.astype(np.float16)
+        if self.mode == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        if self.mode == "pca":
+            return self.projection.transform(vectors)
+        return np.clip(np.rint((vectors - self.offset) / self.scale), -128, 127).astype(np.int8)
+
+    def _reserve(self, rows: int):
+        if rows <= self._buffer.shape[0]:
+            return
+        capacity = max(rows, 2 * self._buffer.shape[0], 1024)
+        buffer = np.zeros((capacity, self._buffer.shape[1]), dtype=self.dtype)
+        buffer[:self._rows] = self._buffer[:self._rows]
+        self._buffer = buffer
+
+    def update(self, matrix: np.ndarray, vec_rows: np.ndarray, vectors_file: str):
+        """matrix 的第 i 行是向量文件第 vec_rows[i] 行（vec_rows 升序）"""
+        if matrix.shape[0] == 0:
+            self.snapshot = None
+            return
+        if self.mode == "pca" and self.projection.mean.shape[0] != matrix.shape[1]:
+            # 投影与当前模型维度不符（换模型后未重新拟合）：不启用
+            logger.warning(f"PCA投影维度 {self.projection.mean.shape[0]} 与向量维度 {matrix.shape[1]} 不符，已忽略")
+            self.snapshot = None
+            return
+        if vectors_file != self.vectors_file or self._buffer.shape[1] != self._width(matrix.shape[1]):
+            self._reset(vectors_file, matrix.shape[1])
+
+        new = np.flatnonzero(vec_rows >= self._rows)
+        if new.size:
+            if self.mode == "int8" and self.scale is None:
+                self._fit(matrix)
+            last = int(vec_rows[-1]) + 1
+            self._reserve(last)
+            # 被替换的旧行保持为零（打分时按 row_of 屏蔽）
+            self._buffer[self._rows:last] = 0
+            for start in range(0, new.size, CHUNK_ROWS):
+                chunk = new[start:start + CHUNK_ROWS]
+                self._buffer[vec_rows[chunk]] = self._encode(matrix[chunk])
+            logger.info(f"压缩向量已更新（{self.mode}）: 新编码 {new.size} 行")
+            self._rows = last
+
+        row_of = np.full(self._rows, -1, dtype=np.int32)
+        row_of[vec_rows] = np.arange(vec_rows.shape[0])
+        self.snapshot = QuantizedSnapshot(
+            self.mode, self._buffer[:self._rows], row_of, vec_rows, self.scale, self.offset, self.projection
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {"mode": self.mode, "rows": 0, "resident_bytes": 0}
+        live = int(snapshot.vec_rows.shape[0])
+        if self.mode == "pca":
+            dim = self.projection.mean.shape[0]
+        else:
+            dim = snapshot.codes.shape[1] * 8 if self.mode == "binary" else snapshot.codes.shape[1]
+        resident = snapshot.codes.nbytes + snapshot.row_of.nbytes + snapshot.vec_rows.nbytes
+        stats = {
+            "mode": self.mode,
+            "rows": live,
+            "coded_rows": int(snapshot.codes.shape[0]),
+            "resident_bytes": int(resident),
+            "float32_bytes": live * dim * 4,
+            "compression": round(live * dim * 4 / resident, 2) if resident else 0.0,
+        }
+        if self.mode == "pca":
+            stats.update(
+                dim=self.projection.dim,
+                whiten=self.projection.whiten,
+                explained_variance=round(self.projection.explained, 4),
+            )
+        return stats
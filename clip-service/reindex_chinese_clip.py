@@ -7,11 +7,12 @@ import sys
 import time
 import requests
 import torch
-import cv2
 import numpy as np
 from PIL import Image
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Union
+
+from video_decode import get_decoder
 
 # 设置离线模式，使用本地缓存
 os.environ["HF_HUB_OFFLINE"] = "1"
@@ -43,37 +44,25 @@ print(f"   设备: {device}")
 
 QDRANT_URL = "http://localhost:6333"
 COLLECTION_NAME = "video_assets"
+BATCH_SIZE = 16  # 每批送入视觉塔的帧数
 
-def get_image_features(image: Image.Image) -> np.ndarray:
-    """获取图像的Chinese-CLIP向量"""
+def get_image_features(images: List[Union[Image.Image, np.ndarray]]) -> np.ndarray:
+    """批量获取图像的Chinese-CLIP向量，返回 (N, dim) 归一化矩阵"""
     with torch.no_grad():
-        inputs = processor(images=image, return_tensors="pt")
+        inputs = processor(images=images, return_tensors="pt")
         pixel_values = inputs["pixel_values"].to(device)
         vision_outputs = model.vision_model(pixel_values=pixel_values)
         pooled_output = vision_outputs.last_hidden_state[:, 0, :]
         image_features = model.visual_projection(pooled_output)
         image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        return image_features.cpu().numpy()[0]
+        return image_features.cpu().numpy()
 
-def extract_frame(video_path: str, time_sec: float = 1.0) -> Image.Image:
-    """从视频中提取关键帧"""
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise Exception(f"Cannot open video: {video_path}")
-    
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_num = int(time_sec * fps)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-    
-    ret, frame = cap.read()
-    cap.release()
-    
-    if not ret:
-        raise Exception(f"Cannot read frame at {time_sec}s")
-    
-    # BGR to RGB
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(frame_rgb)
+def extract_frame(video_path: str, time_sec: float = 1.0) -> np.ndarray:
+    """从视频中提取指定时间点的帧（RGB数组，短边已缩放到 CLIP_DECODE_SIZE）"""
+    frame = get_decoder().frame_at(video_path, time_sec)
+    if frame is None:
+        raise Exception(f"Cannot read frame at {time_sec}s: {video_path}")
+    return frame
 
 def get_all_points():
     """获取Qdrant中所有素材点"""
@@ -106,15 +95,13 @@ def get_all_points():
     
     return all_points
 
-def update_vector(point_id: int, new_vector: List[float]):
-    """更新Qdrant中的向量"""
+def update_vectors(updates: List[Dict]):
+    """批量更新Qdrant中的向量，updates: [{"id": ..., "vector": [...]}]"""
+    if not updates:
+        return
     resp = requests.put(
         f"{QDRANT_URL}/collections/{COLLECTION_NAME}/points/vectors",
-        json={
-            "points": [
-                {"id": point_id, "vector": new_vector}
-            ]
-        }
+        json={"points": updates}
     )
     resp.raise_for_status()
 
@@ -129,6 +116,25 @@ def main():
     fail_count = 0
     start_time = time.time()
     
+    # 待编码队列：(point_id, image)，凑满 BATCH_SIZE 后一次性推理并批量写回
+    pending = []
+
+    def flush_pending():
+        nonlocal success_count, fail_count
+        if not pending:
+            return
+        try:
+            vectors = get_image_features([image for _, image in pending])
+            update_vectors([
+                {"id": point_id, "vector": vector.tolist()}
+                for (point_id, _), vector in zip(pending, vectors)
+            ])
+            success_count += len(pending)
+        except Exception as e:
+            fail_count += len(pending)
+            print(f"   Batch error ({len(pending)} points): {str(e)[:50]}")
+        pending.clear()
+
     for i, point in enumerate(points):
         point_id = point["id"]
         payload = point["payload"]
@@ -137,15 +143,7 @@ def main():
         try:
             # 提取关键帧
             if os.path.exists(file_path):
-                image = extract_frame(file_path, time_sec=1.0)
-                
-                # 获取新向量
-                new_vector = get_image_features(image)
-                
-                # 更新Qdrant
-                update_vector(point_id, new_vector.tolist())
-                
-                success_count += 1
+                pending.append((point_id, extract_frame(file_path, time_sec=1.0)))
             else:
                 fail_count += 1
                 
@@ -153,6 +151,9 @@ def main():
             fail_count += 1
             if i < 5:  # 只打印前5个错误
                 print(f"   Error [{point_id}]: {str(e)[:50]}")
+
+        if len(pending) >= BATCH_SIZE or (i + 1) == total:
+            flush_pending()
         
         # 进度显示
         if (i + 1) % 50 == 0 or (i + 1) == total:
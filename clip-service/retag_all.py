@@ -4,7 +4,7 @@
 结合 CLIP 向量匹配 + 文件名关键词提取
 """
 from clip_server import PREDEFINED_TAGS, CLIPModelManager
-import json
+from asset_store import open_default_store
 import re
 import torch
 import numpy as np
@@ -91,14 +91,11 @@ def main():
 
     # 加载现有数据
     print("\n1. 加载现有素材数据...")
-    with open('clip_results.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    print(f"   素材总数: {len(data)}")
-
-    # 统计有向量的素材
-    with_embeddings = [d for d in data if d.get(
-        'clipMetadata', {}).get('embeddings')]
-    print(f"   有向量的素材: {len(with_embeddings)}")
+    store = open_default_store()
+    # 只读取元数据行，向量按行号从 memmap 读取
+    rows, vectors, total = store.index_snapshot()[:3]
+    print(f"   素材总数: {total}")
+    print(f"   有向量的素材: {len(rows)}")
 
     # 初始化CLIP模型
     print("\n2. 加载CLIP模型...")
@@ -119,15 +116,11 @@ def main():
 
     # 重新打标
     print("\n4. 重新打标...")
-    updated = 0
-    for i, item in enumerate(data):
-        if not item.get('clipMetadata', {}).get('embeddings'):
-            continue
-
-        # 获取素材向量
-        embeddings = torch.tensor(
-            item['clipMetadata']['embeddings']).to(clip_manager.device)
-        embeddings = embeddings / embeddings.norm()
+    updates = []
+    for i, row in enumerate(rows):
+        # 获取素材向量（存储中已归一化）
+        embeddings = torch.from_numpy(
+            np.asarray(vectors[i], dtype=np.float32)).to(clip_manager.device)
 
         # 计算与所有标签的相似度
         similarities = (embeddings @ tag_embeddings.T).cpu().numpy()
@@ -155,7 +148,7 @@ def main():
             idx += len(tags)
 
         # 从文件名提取额外标签
-        filepath = item.get('filePath', '')
+        filepath = row['filePath']
         filename_tags = extract_tags_from_filename(filepath)
         new_tags.extend(filename_tags)
 
@@ -163,32 +156,31 @@ def main():
         new_tags = list(dict.fromkeys(new_tags))
 
         # 更新
-        item['clipMetadata']['tags'] = new_tags
-        updated += 1
+        row['tags'] = new_tags
+        updates.append((filepath, {'tags': new_tags}))
 
         if (i + 1) % 500 == 0:
-            print(f"   进度: {i + 1}/{len(data)}")
+            print(f"   进度: {i + 1}/{len(rows)}")
 
-    print(f"   更新完成: {updated} 条")
+    print(f"   更新完成: {len(updates)} 条")
 
     # 统计新标签分布
     print("\n5. 新标签统计...")
     tag_counter = Counter()
-    for item in data:
-        if item.get('clipMetadata') and 'tags' in item['clipMetadata']:
-            for tag in item['clipMetadata']['tags']:
-                tag_counter[tag] += 1
+    for row in rows:
+        for tag in row['tags']:
+            tag_counter[tag] += 1
 
     print(f"   新标签种类: {len(tag_counter)}")
     print("\n   Top 30 标签:")
     for tag, count in tag_counter.most_common(30):
-        pct = count / len(data) * 100
+        pct = count / total * 100
         print(f"     {tag}: {count} ({pct:.1f}%)")
 
     # 保存
     print("\n6. 保存结果...")
-    with open('clip_results.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 只更新标签列，不重写向量
+    store.update_metadata(updates)
     print("   保存完成!")
 
     print("\n" + "=" * 60)
@@ -0,0 +1,325 @@
+"""
+扫描任务子系统 - 在clip_server.py中集成
+/clip/scan 的解码与推理放到工作线程池中执行，不再阻塞事件循环；
+每个任务有独立id，可查询进度、通过SSE订阅逐文件结果、取消和断点续扫。
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# 结果内存估算：向量按 Python float 列表计（对象 24 字节 + 列表指针 8 字节），其余字段按固定开销计
+FLOAT_BYTES = 32
+ENTRY_OVERHEAD_BYTES = 1024
+
+
+def result_bytes(result: Dict[str, Any]) -> int:
+    embeddings = (result.get("clipMetadata") or {}).get("embeddings") or ()
+    return ENTRY_OVERHEAD_BYTES + FLOAT_BYTES * len(embeddings)
+
+
+def event_entry(result: Dict[str, Any]) -> Dict[str, Any]:
+    """file 事件的载荷：结果去掉向量（向量只在 results 中保存一份）"""
+    metadata = result.get("clipMetadata")
+    if not metadata or "embeddings" not in metadata:
+        return result
+    return {**result, "clipMetadata": {k: v for k, v in metadata.items() if k != "embeddings"}}
+
+
+class ScanCancelled(Exception):
+    """任务被取消时由执行函数抛出"""
+
+
+class ScanJob:
+    """
+    单个扫描任务
+
+    - request: 提交时的 ScanRequest 参数
+    - results: 逐文件结果（与旧版 /clip/scan 的 processedFiles 格式一致），客户端取走或超出内存预算后释放
+    - events: 追加写的事件列表，SSE 订阅者按下标增量读取；file 事件不含向量，index 指向 results 中的完整结果
+    - done_paths: 已处理（成功、失败或增量跳过）的文件，续扫时跳过
+    """
+
+    def __init__(self, request: Dict[str, Any]):
+        self.id = uuid.uuid4().hex[:12]
+        self.request = request
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.error: Optional[str] = None
+        self.results: List[Dict[str, Any]] = []
+        self.result_bytes = 0
+        # 已释放的结果数：results[i] 对应第 released_results + i 个结果（事件 index 与 offset 均按全局序号）
+        self.released_results = 0
+        self.events: List[Dict[str, Any]] = []
+        self.done_paths: set = set()
+        self.future: Optional[Future] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        # 累计运行时长（续扫时累加）
+        self._elapsed = 0.0
+        # 累计解码耗时（秒）
+        self.decode_time = 0.0
+        # 当前（或最近一次）运行的入库流水线，提供队列深度与各阶段利用率
+        self.pipeline: Optional[Any] = None
+
+    # --------------------------------------------
+    # 执行函数调用的接口
+    # --------------------------------------------
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise ScanCancelled()
+
+    def emit(self, event: str, data: Dict[str, Any]):
+        with self._lock:
+            self.events.append({"id": len(self.events), "event": event, "data": data})
+
+    def set_total(self, total: int):
+        with self._lock:
+            self.total = total
+        self.emit("progress", self.progress())
+
+    def add_decode_time(self, seconds: float):
+        with self._lock:
+            self.decode_time += seconds
+
+    def add_skipped(self, file_paths: List[str]):
+        """记录增量判定跳过的文件（计入 done_paths，续扫时不再重复判定和计数）"""
+        with self._lock:
+            new_paths = [path for path in file_paths if path not in self.done_paths]
+            self.done_paths.update(new_paths)
+            self.skipped += len(new_paths)
+
+    def add_result(self, result: Dict[str, Any]):
+        """记录一个文件的处理结果（status 为 error 时计入失败）"""
+        with self._lock:
+            index = self.released_results + len(self.results)
+            self.results.append(result)
+            self.result_bytes += result_bytes(result)
+            self.done_paths.add(result.get("filePath"))
+            if result.get("status") == "error":
+                self.failed += 1
+            else:
+                self.processed += 1
+        self.emit("file", {**event_entry(result), "index": index})
+        self.emit("progress", self.progress())
+
+    def add_failure(self, file_path: str):
+        """记录一个无结果条目的失败文件（如无法提取帧）"""
+        with self._lock:
+            self.failed += 1
+            self.done_paths.add(file_path)
+        self.emit("progress", self.progress())
+
+    # --------------------------------------------
+    # 查询
+    # --------------------------------------------
+    def elapsed(self) -> float:
+        if self.status == RUNNING and self.started_at is not None:
+            return self._elapsed + time.time() - self.started_at
+        return self._elapsed
+
+    def progress(self) -> Dict[str, Any]:
+        done = self.processed + self.failed + self.skipped
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "done": done,
+            "processed": self.processed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "percent": round(done / self.total * 100, 1) if self.total else 0.0,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """与旧版 /clip/scan 响应的 summary 字段一致"""
+        return {
+            "totalFiles": self.total,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "processingTime": round(self.elapsed(), 2),
+            "decodeTime": round(self.decode_time, 2),
+        }
+
+    def to_dict(self, include_results: bool = False) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "request": self.request,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress(),
+            "summary": self.summary(),
+            "error": self.error,
+            "released_results": self.released_results,
+            "pipeline": self.pipeline.stats() if self.pipeline is not None else None,
+        }
+        if include_results:
+            data["processedFiles"] = list(self.results)
+        return data
+
+    def events_since(self, cursor: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self.events[cursor:]
+
+    def result_at(self, index: int) -> Optional[Dict[str, Any]]:
+        """file 事件对应的完整结果（结果已释放时返回 None）"""
+        with self._lock:
+            index -= self.released_results
+            return self.results[index] if 0 <= index < len(self.results) else None
+
+    def results_from(self, offset: int) -> List[Dict[str, Any]]:
+        """从全局序号 offset 开始的结果（已释放的部分不再返回）"""
+        with self._lock:
+            return self.results[max(0, offset - self.released_results):]
+
+    def release_results(self):
+        """释放逐文件结果（客户端已取走，或超出内存预算），进度与汇总保留"""
+        with self._lock:
+            self.released_results += len(self.results)
+            self.results = []
+            self.result_bytes = 0
+
+
+class ScanJobManager:
+    """
+    扫描任务调度
+
+    runner(job) 在工作线程中执行实际扫描：调用 job.set_total / add_result 上报进度，
+    定期调用 job.check_cancelled()，并跳过 job.done_paths 中的文件以支持续扫。
+    已结束任务的结果总量超过 max_result_bytes 时，从最早结束的任务开始释放结果（任务记录保留）。
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[ScanJob], None],
+        max_workers: int = 1,
+        max_history: int = 100,
+        max_result_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.runner = runner
+        self.max_history = max_history
+        self.max_result_bytes = max_result_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="clip-scan")
+        self._jobs: Dict[str, ScanJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, request: Dict[str, Any]) -> ScanJob:
+        job = ScanJob(request)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._schedule(job)
+        logger.info(f"扫描任务已提交: {job.id} {request.get('directory')}")
+        return job
+
+    def get(self, job_id: str) -> Optional[ScanJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[ScanJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[ScanJob]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            # 尚未开始执行，直接标记为取消
+            self._finish(job, CANCELLED)
+        return job
+
+    def resume(self, job_id: str) -> Optional[ScanJob]:
+        """续扫已取消/失败的任务，已处理的文件不再重复处理"""
+        job = self.get(job_id)
+        if job is None or job.status not in (CANCELLED, FAILED):
+            return job
+        job._cancel.clear()
+        job.status = QUEUED
+        job.error = None
+        job.finished_at = None
+        job.emit("progress", job.progress())
+        self._schedule(job)
+        logger.info(f"扫描任务续扫: {job.id}（已完成 {len(job.done_paths)} 个文件）")
+        return job
+
+    def shutdown(self):
+        for job in self.list():
+            if job.status not in FINISHED_STATES:
+                job._cancel.set()
+        self._executor.shutdown(wait=False)
+
+    def _schedule(self, job: ScanJob):
+        job.future = self._executor.submit(self._execute, job)
+
+    def _execute(self, job: ScanJob):
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.emit("progress", job.progress())
+        try:
+            self.runner(job)
+            self._finish(job, CANCELLED if job.cancelled else COMPLETED)
+        except ScanCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logger.error(f"扫描任务失败 {job.id}: {e}")
+            job.error = str(e)
+            self._finish(job, FAILED)
+
+    def _finish(self, job: ScanJob, status: str):
+        if job.started_at is not None and job.status == RUNNING:
+            job._elapsed += time.time() - job.started_at
+        job.status = status
+        job.finished_at = time.time()
+        job.emit("done", job.to_dict())
+        logger.info(f"扫描任务结束: {job.id} {status} {job.summary()}")
+        with self._lock:
+            self._release_over_budget(keep=job)
+
+    def _prune(self):
+        """只保留最近 max_history 个已结束任务"""
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATES]
+        finished.sort(key=lambda job: job.created_at)
+        for job in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job.id]
+        self._release_over_budget()
+
+    def _release_over_budget(self, keep: Optional[ScanJob] = None):
+        """已结束任务的结果超过内存预算时，按结束时间从早到晚释放（keep 为刚结束、等待客户端取走的任务）"""
+        finished = [
+            job for job in self._jobs.values()
+            if job.status in FINISHED_STATES and job.results and job is not keep
+        ]
+        total = sum(job.result_bytes for job in finished) + (keep.result_bytes if keep is not None else 0)
+        for job in sorted(finished, key=lambda job: job.finished_at or 0.0):
+            if total <= self.max_result_bytes:
+                break
+            total -= job.result_bytes
+            job.release_results()
+            logger.info(f"扫描任务结果超出内存预算，已释放: {job.id}")
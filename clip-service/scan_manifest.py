@@ -0,0 +1,204 @@
+"""
+增量扫描清单 - 在clip_server.py中集成
+按规范化路径记录 (size, mtime, 局部内容哈希, 模型)，扫描时只处理新增或变化的文件。
+
+判定顺序（skip_processed=True 时）:
+1. size 与 mtime 均未变且模型一致 → 跳过（只需一次 stat，不读文件内容）
+2. size 未变但 mtime 变化 → 计算局部哈希，一致则只更新 mtime 并跳过（文件被复制/touch）
+3. 其余情况（新文件、内容变化、模型变化）→ 重新处理
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 局部哈希：文件头、中、尾各读取的字节数
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def canonical_path(path: str) -> str:
+    """规范化路径（解析符号链接、统一分隔符与大小写），作为清单主键"""
+    return os.path.normcase(os.path.realpath(path))
+
+
+def partial_hash(path: str, size: Optional[int] = None) -> str:
+    """
+    快速局部内容哈希：文件大小 + 头/中/尾各 HASH_CHUNK_SIZE 字节
+
+    视频文件只读取约 192KB，NAS 上也能快速完成
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode("ascii"))
+    with open(path, "rb") as f:
+        if size <= HASH_CHUNK_SIZE * 3:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - HASH_CHUNK_SIZE) // 2, size - HASH_CHUNK_SIZE):
+                f.seek(offset)
+                digest.update(f.read(HASH_CHUNK_SIZE))
+    return digest.hexdigest()
+
+
+class FileFingerprint(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: Optional[str] = None
+
+
+class ScanManifest:
+    """扫描清单（SQLite），键为规范化路径"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scan_manifest (
+                path TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                model TEXT NOT NULL,
+                scanned_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def lookup(self, paths: Iterable[str]) -> Dict[str, tuple]:
+        """批量读取清单，返回 {规范化路径: (size, mtime_ns, content_hash, model)}"""
+        keys = list(dict.fromkeys(paths))
+        found = {}
+        with self._lock:
+            # 分块查询，避免超过SQLite参数上限
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for path, size, mtime_ns, content_hash, model in self._conn.execute(
+                    f"SELECT path, size, mtime_ns, content_hash, model FROM scan_manifest "
+                    f"WHERE path IN ({placeholders})",
+                    chunk,
+                ):
+                    found[path] = (size, mtime_ns, content_hash, model)
+        return found
+
+    def record(self, fingerprints: Iterable[FileFingerprint], model: str):
+        """记录已处理文件（缺少哈希时在此计算）"""
+        now = time.time()
+        records = []
+        for fp in fingerprints:
+            content_hash = fp.content_hash
+            if content_hash is None:
+                try:
+                    content_hash = partial_hash(fp.path, fp.size)
+                except OSError as e:
+                    logger.warning(f"计算文件哈希失败 {fp.path}: {e}")
+            records.append((canonical_path(fp.path), fp.path, fp.size, fp.mtime_ns, content_hash, model, now))
+        if not records:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scan_manifest "
+                "(path, file_path, size, mtime_ns, content_hash, model, scanned_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            self._conn.commit()
+
+    def partition(self, file_paths: List[str], model: str, stored_paths: set) -> tuple:
+        """
+        将文件分为 (待处理, 可跳过)
+
+        stored_paths 为素材存储中已有的 filePath：清单命中但素材未保存（扫描结果未提交）时仍需处理；
+        素材已保存但清单中没有记录（清单启用前的旧数据）时，记录当前指纹作为基线并跳过。
+
+        返回:
+            (待处理的 FileFingerprint 列表, 跳过的文件路径列表)
+        """
+        stats = {}
+        for path in file_paths:
+            try:
+                st = os.stat(path)
+                stats[path] = FileFingerprint(path, st.st_size, st.st_mtime_ns)
+            except OSError:
+                # 无法stat的文件交给扫描流程报告错误
+                stats[path] = FileFingerprint(path, -1, -1)
+
+        keys = {path: canonical_path(path) for path in file_paths}
+        known = self.lookup(keys.values())
+
+        to_process: List[FileFingerprint] = []
+        baseline: List[FileFingerprint] = []
+        refreshed: List[FileFingerprint] = []
+        skipped: List[str] = []
+        for path in file_paths:
+            fp = stats[path]
+            entry = known.get(keys[path])
+            if fp.size < 0 or path not in stored_paths:
+                to_process.append(fp)
+                continue
+            if entry is None:
+                baseline.append(fp)
+                skipped.append(path)
+                continue
+
+            size, mtime_ns, content_hash, entry_model = entry
+            if entry_model != model or size != fp.size:
+                to_process.append(fp)
+            elif mtime_ns == fp.mtime_ns:
+                skipped.append(path)
+            else:
+                try:
+                    current_hash = partial_hash(path, fp.size)
+                except OSError:
+                    to_process.append(fp)
+                    continue
+                if current_hash == content_hash:
+                    refreshed.append(fp._replace(content_hash=current_hash))
+                    skipped.append(path)
+                else:
+                    to_process.append(fp._replace(content_hash=current_hash))
+
+        if baseline or refreshed:
+            self.record(baseline + refreshed, model)
+        return to_process, skipped
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM scan_manifest").fetchone()[0]
+        return {"entries": count}
+
+
+def plan_scan(
+    file_paths: List[str],
+    done_paths: Set[str],
+    manifest: Optional[ScanManifest],
+    model: str = "",
+    stored_paths: Optional[set] = None,
+) -> tuple:
+    """
+    一次（续）扫描的文件划分
+
+    done_paths 为任务中已有结果或已跳过的文件（续扫时），不再参与判定，也不会再计入跳过数；
+    manifest 为 None（skip_processed=False）时其余文件全部处理，不做 stat。
+
+    返回:
+        (待处理的 FileFingerprint 列表, 本次新跳过的文件路径列表)
+    """
+    candidates = [path for path in file_paths if path not in done_paths]
+    if manifest is None:
+        return [FileFingerprint(path, -1, -1) for path in candidates], []
+    return manifest.partition(candidates, model, stored_paths or set())
@@ -0,0 +1,153 @@
+"""
+多进程扫描 - 在clip_server.py与batch_scan.py中集成
+模型在父进程加载后 fork N 个工作进程（权重按写时复制共享），每个进程设置较少的
+torch 线程数；文件列表按小块分发给空闲进程，结果回到父进程统一写入。
+
+CPU 推理 ViT-B/16 时，多个少线程进程通常比单进程多线程吞吐更高。
+仅在支持 fork 的平台（Linux/macOS）且模型在CPU上时可用：CUDA 初始化后不能 fork，
+Windows 只有 spawn（每个进程需要重新加载模型），这两种情况调用方应回退到线程流水线。
+
+fork 只复制调用线程，其他线程持有的锁（SQLite、logging、HTTP连接池等）在子进程中永远不会释放。
+因此进程池由 fork_pool() 在进程启动阶段、任何后台线程启动之前创建一次并常驻复用，
+任务函数须为模块级函数（只依赖 fork 前已就绪的全局状态，如已加载的模型），按块传入可序列化的参数。
+"""
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 工作进程中执行的任务函数（fork 时随进程内存继承，不需要序列化）
+_worker_task: Optional[Callable[[List[Any]], Any]] = None
+
+
+def fork_available() -> bool:
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def default_threads_per_worker(workers: int) -> int:
+    """每个工作进程的 torch 线程数：CPU核数平均分配，至少1"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _init_worker(task: Callable[[List[Any]], Any], threads: int):
+    global _worker_task
+    _worker_task = task
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _run_chunk(chunk: List[Any], args: Sequence[Any] = ()):
+    start = time.perf_counter()
+    result = _worker_task(chunk, *args)
+    return chunk, time.perf_counter() - start, result
+
+
+def fork_pool(task: Callable[..., Any], workers: int, threads_per_worker: int = 0) -> multiprocessing.pool.Pool:
+    """
+    创建常驻的 fork 进程池
+
+    须在模型加载之后、任何后台线程（写线程、同步线程、扫描线程池等）启动之前调用；
+    task(chunk, *args) 为模块级函数，在工作进程中执行。
+    """
+    if not fork_available():
+        raise RuntimeError("当前平台不支持 fork，无法使用多进程扫描")
+    workers = max(1, workers)
+    threads = threads_per_worker if threads_per_worker > 0 else default_threads_per_worker(workers)
+    logger.info(f"多进程扫描进程池: {workers} 个进程 × {threads} 线程")
+    return multiprocessing.get_context("fork").Pool(
+        processes=workers, initializer=_init_worker, initargs=(task, threads)
+    )
+
+
+class ProcessScanPool:
+    """
+    在 fork_pool() 创建的常驻进程池上分块执行一次扫描
+
+    - 进程池的任务函数 task(chunk, *args) 在工作进程中执行，返回值须可序列化（numpy数组/dict/list）
+    - run() 在父进程中按完成顺序对每块结果调用 on_result(chunk, result)
+    - 同时提交的块不超过进程数的两倍；取消时不再提交新块，已提交的块在工作进程中跑完后丢弃
+      （不回调，续扫时重新处理），进程池保持可用
+    """
+
+    def __init__(self, pool: multiprocessing.pool.Pool, workers: int, threads_per_worker: int = 0):
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker if threads_per_worker > 0 else default_threads_per_worker(self.workers)
+        self.chunks_total = 0
+        self.chunks_done = 0
+        self.items_done = 0
+        self.busy = 0.0
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+
+    def run(
+        self,
+        items: Iterable[Any],
+        on_result: Callable[[List[Any], Any], None],
+        chunk_size: int = 16,
+        cancelled: Callable[[], bool] = lambda: False,
+        args: Sequence[Any] = (),
+    ):
+        """args 为本次扫描的参数（可序列化），随每块传给 task(chunk, *args)"""
+        items = list(items)
+        chunks = iter([items[i:i + chunk_size] for i in range(0, len(items), max(1, chunk_size))])
+        self.chunks_total = -(-len(items) // max(1, chunk_size))
+        self._started_at = time.perf_counter()
+        logger.info(f"多进程扫描: {self.workers} 个进程，{self.chunks_total} 块")
+        # 回调在进程池的结果线程中执行，只把结果放入本次扫描的队列
+        done: "queue.Queue[Any]" = queue.Queue()
+
+        def submit() -> bool:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            self.pool.apply_async(_run_chunk, (chunk, tuple(args)), callback=done.put, error_callback=done.put)
+            return True
+
+        try:
+            # 按完成顺序取结果：块很小，先完成的进程立即领取下一块，负载自动均衡
+            in_flight = sum(submit() for _ in range(2 * self.workers))
+            while in_flight:
+                outcome = done.get()
+                in_flight -= 1
+                if isinstance(outcome, BaseException):
+                    raise outcome
+                chunk, elapsed, result = outcome
+                self.busy += elapsed
+                self.chunks_done += 1
+                self.items_done += len(chunk)
+                on_result(chunk, result)
+                if cancelled():
+                    break
+                in_flight += submit()
+        finally:
+            self._finished_at = time.perf_counter()
+
+    def stats(self) -> Dict[str, Any]:
+        if self._started_at is None:
+            wall = 0.0
+        else:
+            wall = (self._finished_at or time.perf_counter()) - self._started_at
+        return {
+            "mode": "process",
+            "wall_seconds": round(wall, 3),
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "chunks": {"done": self.chunks_done, "total": self.chunks_total},
+            "stages": {
+                "worker": {
+                    "workers": self.workers,
+                    "items": self.items_done,
+                    "busy_seconds": round(self.busy, 3),
+                    "utilization": round(self.busy / (wall * self.workers), 3) if wall > 0 else 0.0,
+                },
+            },
+        }
@@ -0,0 +1,552 @@
+"""
+内存向量检索索引 - 在clip_server.py中集成
+将素材存储中的embeddings映射为预归一化的float32矩阵 + 行号→元数据表，
+每次查询只需一次矩阵-向量乘和 argpartition 取 top-k，不再逐条解析/计算；
+大库可挂接 IVF 近似索引（ann_index.IVFIndex），只对候选簇内的行打分，
+以及压缩向量（quantization.QuantizedVectors），先在压缩向量上取短名单再用全精度向量重排；
+binary 模式用符号位汉明距离粗筛全部行，pca 模式在 PCA 降维向量上取候选，均再精确重排短名单；
+过滤条件（filter_index.FilterIndex）按选择度在命中行上打分（预过滤）或在全量得分上屏蔽（后过滤）
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from ann_index import IVFIndex
+from asset_store import AssetStore
+from filter_index import FilterIndex
+from quantization import QuantizedVectors
+
+logger = logging.getLogger(__name__)
+
+# 检索模式：auto = 使用已就绪的 IVF 索引与压缩向量；exact = 全精度全量打分；ivf = 同 auto（兼容）；
+# binary = 符号位汉明距离粗筛 + 精确重排；pca = PCA 降维向量粗筛 + 精确重排（未启用时均回退精确）
+SEARCH_MODES = ("auto", "exact", "ivf", "binary", "pca")
+
+# 行元数据中保留的字段（embeddings 单独存入矩阵）
+ROW_FIELDS = ("filePath", "shotId", "label", "duration")
+METADATA_FIELDS = ("tags", "description", "emotions")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行L2归一化（与 compute_similarity 的 1e-8 平滑一致）"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return (matrix / (norms + 1e-8)).astype(np.float32, copy=False)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回分数最高的k个下标（降序），使用 argpartition 避免全量排序"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class EmbeddingIndex:
+    """
+    素材向量内存索引
+
+    - matrix: (N, dim) 预归一化float32矩阵（来自素材存储时为 memmap 零拷贝视图）
+    - rows: 行号 → 元数据（不含embeddings）
+    - 通过素材存储的 generation 失效重建，其他进程写入后同样会被感知；
+      refresh_async() 在后台线程重建（同一时刻只有一个重建，间隔至少 refresh_interval 秒，期间的写入合并），
+      矩阵、行表与 IVF / 压缩向量快照在重建完成后一次性切换，查询始终读到一致的一组
+    - ann: 可选的 IVF 索引，随重建增量更新（只在由素材存储构建时可用）
+    - quantizer: 可选的压缩向量；启用后全精度矩阵保持 memmap 原始精度，只在重排时读取，
+      短名单大小为 rerank（0 = max(4·top_k, 100)）
+    - binary: 可选的符号位编码（binary 模式使用），默认短名单 binary_shortlist 行
+    - pca: 可选的 PCA 降维向量（QuantizedVectors("pca")，pca 模式使用），默认短名单 pca_shortlist 行
+    - 过滤条件（where）命中的行占比不超过 prefilter_fraction 时只对命中行打分（行收集有拷贝开销），
+      否则全量打分后屏蔽未命中的行；倒排索引在行表变化后的首次过滤查询时重建，tag_categories 见 FilterIndex
+    """
+
+    def __init__(
+        self,
+        store: Optional[AssetStore] = None,
+        ann: Optional[IVFIndex] = None,
+        quantizer: Optional[QuantizedVectors] = None,
+        rerank: int = 0,
+        binary: Optional[QuantizedVectors] = None,
+        binary_shortlist: int = 2000,
+        pca: Optional[QuantizedVectors] = None,
+        pca_shortlist: int = 200,
+        prefilter_fraction: float = 0.15,
+        tag_categories: Optional[Dict[str, str]] = None,
+        refresh_interval: float = 1.0,
+    ):
+        self.store = store
+        self.ann = ann
+        self.quantizer = quantizer
+        self.rerank = rerank
+        self.binary = binary
+        self.binary_shortlist = binary_shortlist
+        self.pca = pca
+        self.pca_shortlist = pca_shortlist
+        self.prefilter_fraction = prefilter_fraction
+        self.tag_categories = tag_categories
+        self.refresh_interval = refresh_interval
+        self._filters: Optional[FilterIndex] = None
+        self._lock = threading.RLock()
+        # 重建互斥（重建期间不持有 _lock，查询照常使用旧快照）
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-refresh")
+        self._pending: Optional[Future] = None
+        self._refreshed_at = 0.0
+        self._generation: Optional[int] = None
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.rows: List[Dict[str, Any]] = []
+        # 与 matrix 同时切换的 IVF 列表与压缩向量快照（"ann" / "quantizer" / "binary" / "pca"）
+        self._components: Dict[str, Any] = {}
+        # 存储中的素材总数（含无embeddings的条目）
+        self.total_items = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def ready(self) -> bool:
+        """是否已由素材存储建立过索引"""
+        return self._generation is not None
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def snapshot(self) -> Tuple[np.ndarray, List[Dict[str, Any]], Optional[int]]:
+        """
+        当前已切换的一组 (matrix, rows, generation)
+
+        三者在同一次切换中安装，取出后不受之后的重建影响；generation 为 None 表示尚未由素材存储建立索引
+        """
+        with self._lock:
+            return self.matrix, self.rows, self._generation
+
+    @staticmethod
+    def _row_from_item(item: Dict[str, Any]) -> Dict[str, Any]:
+        clip_metadata = item.get("clipMetadata") or {}
+        row = {field: item.get(field) for field in ROW_FIELDS}
+        if not row["label"]:
+            row["label"] = Path(item.get("filePath") or "").stem
+        if row["duration"] is None:
+            row["duration"] = 5.0
+        for field in METADATA_FIELDS:
+            row[field] = clip_metadata.get(field, "" if field == "description" else [])
+        return row
+
+    def _install(self, matrix: np.ndarray, rows: List[Dict[str, Any]], total_items: int,
+                 generation: Optional[int] = None, components: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            self.matrix = matrix
+            self.rows = rows
+            self.total_items = total_items
+            self._generation = generation
+            self._components = components or {}
+            self._filters = None
+        logger.info(f"向量索引已重建: {len(rows)} 行, 维度 {self.dim}")
+
+    def build(self, items: List[Dict[str, Any]]):
+        """由旧版JSON素材列表重建索引（不经过素材存储）"""
+        vectors = []
+        rows = []
+        dim = None
+        for item in items:
+            embeddings = (item.get("clipMetadata") or {}).get("embeddings")
+            if not embeddings:
+                continue
+            if dim is None:
+                dim = len(embeddings)
+            elif len(embeddings) != dim:
+                # 维度不一致（旧模型残留），跳过
+                continue
+            vectors.append(embeddings)
+            rows.append(self._row_from_item(item))
+
+        matrix = (
+            normalize_rows(np.asarray(vectors, dtype=np.float32))
+            if vectors else np.zeros((0, 0), dtype=np.float32)
+        )
+        self._install(matrix, rows, len(items))
+
+    def refresh(self) -> bool:
+        """素材存储有新的写入时重建索引（在调用线程中执行），返回是否发生了重建"""
+        if self.store is None:
+            return False
+        with self._refresh_lock:
+            if self._generation == self.store.generation:
+                return False
+
+            snapshot = self.store.index_snapshot()
+            rows, matrix = snapshot.rows, snapshot.vectors
+            # 存储中的向量已归一化；float32 且行号连续时为 memmap 视图，不复制
+            # （使用压缩向量时全精度矩阵只用于重排，保持存储精度，不复制为 float32）
+            if matrix.dtype != np.float32 and self.quantizer is None:
+                matrix = matrix.astype(np.float32)
+            if not rows:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            # IVF 与压缩向量只为新写入的行分配簇/编码；新快照连同矩阵一起切换，查询不会拿到不匹配的行号
+            components = {}
+            if self.ann is not None:
+                try:
+                    self.ann.update(matrix, snapshot.vec_rows, snapshot.vectors_file)
+                except Exception as e:
+                    # 索引文件不可写等情况：回退精确检索，不影响服务
+                    logger.warning(f"IVF索引更新失败，使用精确检索: {e}")
+                    self.ann.lists = None
+                components["ann"] = self.ann.lists
+            for name in ("quantizer", "binary", "pca"):
+                codes = getattr(self, name)
+                if codes is not None:
+                    codes.update(matrix, snapshot.vec_rows, snapshot.vectors_file)
+                    components[name] = codes.snapshot
+            self._install(matrix, rows, snapshot.total, generation=snapshot.generation, components=components)
+            self._refreshed_at = time.monotonic()
+        return True
+
+    def refresh_async(self) -> Optional[Future]:
+        """
+        有新写入时在后台线程重建索引，立即返回（查询继续使用当前快照）
+
+        返回进行中的重建（无需重建时为 None）；重建期间的新写入合并到下一次重建
+        """
+        if self.store is None:
+            return None
+        with self._lock:
+            if self._pending is not None:
+                return self._pending
+            if self._generation == self.store.generation:
+                return None
+            self._pending = self._executor.submit(self._background_refresh)
+            return self._pending
+
+    def _background_refresh(self):
+        try:
+            while True:
+                wait = self._refreshed_at + self.refresh_interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.refresh()
+                with self._lock:
+                    if self._generation == self.store.generation:
+                        self._pending = None
+                        return
+        except Exception:
+            with self._lock:
+                self._pending = None
+            logger.exception("向量索引后台重建失败")
+            raise
+
+    def _candidate_rows(
+        self,
+        lists,
+        query: np.ndarray,
+        rows: Optional[np.ndarray],
+        nprobe: int,
+    ) -> Optional[np.ndarray]:
+        """IVF 候选行（与标签过滤的行取交集）；lists 为 None 时返回 rows（None 表示全部行）"""
+        if lists is None:
+            return rows
+        nprobe = nprobe or self.ann.nprobe
+        # 过滤后的行数不多于 IVF 预计打分的行数时直接精确打分（避免候选簇与过滤结果交集过小）
+        if rows is not None and rows.size * lists.centroids.shape[0] <= lists.order.size * nprobe:
+            return rows
+        candidates = lists.candidates(query, nprobe)
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        return candidates
+
+    def _lists_for(self, mode: str):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"未知的检索模式: {mode}")
+        if mode in ("exact", "binary", "pca"):
+            return None
+        return self._components.get("ann")
+
+    def _quantized_for(self, mode: str):
+        if mode == "exact":
+            return None
+        return self._components.get(mode if mode in ("binary", "pca") else "quantizer")
+
+    def _shortlist_rows(
+        self,
+        quantized,
+        query: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int,
+        shortlist: int = 0,
+    ) -> Optional[np.ndarray]:
+        """在压缩向量上取待重排的短名单（候选本身不多于短名单时直接返回）"""
+        if quantized is None:
+            return rows
+        if quantized.mode == "binary":
+            default = max(self.binary_shortlist, top_k)
+        elif quantized.mode == "pca":
+            default = max(self.pca_shortlist, top_k)
+        else:
+            default = self.rerank or max(4 * top_k, 100)
+        size = max(shortlist, top_k) if shortlist > 0 else default
+        if rows is not None and rows.size <= size:
+            return rows
+        return quantized.shortlist(query, size, rows)
+
+    def stats(self) -> Dict[str, Any]:
+        """行数与内存占用（压缩时为常驻的压缩向量，全精度向量只在重排时从 memmap 读取）"""
+        with self._lock:
+            matrix = self.matrix
+            filters = self._filters
+        return {
+            "rows": len(self.rows),
+            "dim": self.dim,
+            "matrix_dtype": str(matrix.dtype),
+            "matrix_bytes": int(matrix.nbytes),
+            "quantization": self.quantizer.stats() if self.quantizer is not None else None,
+            "binary": self.binary.stats() if self.binary is not None else None,
+            "pca": self.pca.stats() if self.pca is not None else None,
+            "ann": self.ann.stats() if self.ann is not None else None,
+            "filters": filters.stats() if filters is not None else None,
+            "prefilter_fraction": self.prefilter_fraction,
+        }
+
+    def _sample_queries(self, samples: int) -> np.ndarray:
+        """未指定查询时以随机抽取的库内向量为查询"""
+        with self._lock:
+            matrix = self.matrix
+        rng = np.random.default_rng(0)
+        picked = np.sort(rng.choice(matrix.shape[0], size=min(samples, matrix.shape[0]), replace=False))
+        return np.asarray(matrix[picked], dtype=np.float32)
+
+    def ann_recall(
+        self,
+        nprobes=None,
+        top_k: int = 10,
+        samples: int = 200,
+        query_vectors: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        """IVF 各 nprobe 相对精确检索的 recall@k（索引未就绪时为空）"""
+        if self.ann is None:
+            return []
+        with self._lock:
+            matrix = self.matrix
+        if query_vectors is not None:
+            query_vectors = normalize_rows(np.asarray(query_vectors, dtype=np.float32))
+        kwargs = {"nprobes": nprobes} if nprobes else {}
+        return self.ann.calibrate(matrix, top_k=top_k, samples=samples, queries=query_vectors, **kwargs)
+
+    def recall_report(
+        self,
+        variants: List[Dict[str, Any]],
+        top_k: int = 10,
+        samples: int = 200,
+        query_vectors: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        各组检索参数（search() 的 mode / nprobe / shortlist）相对精确检索的 recall@k 与平均耗时
+
+        query_vectors 为空时以库内向量为查询（与文字查询的分布不同，召回率偏乐观）
+        """
+        if len(self) == 0:
+            return []
+        queries = query_vectors if query_vectors is not None else self._sample_queries(samples)
+
+        def timed(params):
+            start = time.perf_counter()
+            results = [
+                {row["filePath"] for row, _ in self.search(query, top_k=top_k, **params)}
+                for query in queries
+            ]
+            return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+        truth, exact_ms = timed({"mode": "exact"})
+        report = []
+        for params in variants:
+            found, ms = timed(params)
+            hits = sum(len(expected & got) for expected, got in zip(truth, found))
+            total = sum(len(expected) for expected in truth)
+            report.append({
+                **params,
+                "recall": round(hits / total, 4) if total else 1.0,
+                "ms": round(ms, 3),
+                "exact_ms": round(exact_ms, 3),
+            })
+        return report
+
+    def _filter_index(self, row_table: List[Dict[str, Any]]) -> FilterIndex:
+        """row_table 对应的倒排索引（行表变化后首次使用时重建，构建不持锁）"""
+        filters = self._filters
+        if filters is None or filters.rows is not row_table:
+            filters = FilterIndex(row_table, self.tag_categories)
+            with self._lock:
+                if self.rows is row_table:
+                    self._filters = filters
+            logger.info(f"过滤索引已重建: {filters.size} 行, 耗时 {filters.build_seconds:.2f}s")
+        return filters
+
+    def _restrict(
+        self,
+        row_table: List[Dict[str, Any]],
+        rows: Optional[np.ndarray],
+        where: Optional[Dict[str, Any]],
+        allow_post: bool,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        过滤条件 → (参与打分的行号, 后过滤位图)
+
+        全量打分（allow_post）且命中占比超过 prefilter_fraction 时返回位图，在全量得分上屏蔽；
+        否则返回命中的行号，只对这些行打分
+        """
+        if where is None:
+            return rows, None
+        mask = self._filter_index(row_table).evaluate(where)
+        if rows is not None:
+            return rows[mask[rows]], None
+        if allow_post and mask.sum() > self.prefilter_fraction * mask.size:
+            return None, mask
+        return np.flatnonzero(mask), None
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        top_k: int = 10,
+        threshold: Optional[float] = None,
+        rows: Optional[np.ndarray] = None,
+        mode: str = "auto",
+        nprobe: int = 0,
+        shortlist: int = 0,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        向量检索
+
+        Args:
+            query_vector: 查询向量（内部会归一化）
+            top_k: 返回数量
+            threshold: 相似度阈值，低于此值不返回
+            rows: 可选，仅在这些行号中检索
+            mode: 检索模式（见 SEARCH_MODES）
+            nprobe: IVF 探测的簇数（0 = 索引默认值）
+            shortlist: 压缩向量/符号位/降维向量粗筛后精确重排的行数（0 = 默认值）
+            where: 可选，过滤表达式（见 filter_index），与 rows 同时给出时取交集
+
+        返回:
+            [(行元数据, 相似度)]，按相似度降序
+        """
+        with self._lock:
+            matrix = self.matrix
+            row_table = self.rows
+            lists = self._lists_for(mode)
+            quantized = self._quantized_for(mode)
+        if matrix.shape[0] == 0:
+            return []
+
+        query = normalize_rows(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        rows, post = self._restrict(row_table, rows, where, lists is None and quantized is None)
+        rows = self._candidate_rows(lists, query, rows, nprobe)
+        rows = self._shortlist_rows(quantized, query, rows, top_k, shortlist)
+        if rows is not None:
+            if rows.size == 0:
+                return []
+            scores = matrix[rows] @ query
+        else:
+            scores = matrix @ query
+            if post is not None:
+                scores[~post] = -np.inf
+                top_k = min(top_k, int(post.sum()))
+
+        results = []
+        for i in top_k_indices(scores, top_k):
+            score = float(scores[i])
+            if threshold is not None and score < threshold:
+                break
+            row_id = int(rows[i]) if rows is not None else int(i)
+            results.append((row_table[row_id], score))
+        return results
+
+    def search_batch(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 10,
+        threshold: Optional[float] = None,
+        rows: Optional[np.ndarray] = None,
+        mode: str = "auto",
+        nprobe: int = 0,
+        shortlist: int = 0,
+        where: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """
+        批量向量检索：所有查询与素材矩阵做一次矩阵乘，每个查询独立取 top-k
+
+        使用 IVF / 压缩向量时各查询的候选行不同，逐个查询打分。
+
+        返回:
+            与 query_vectors 行顺序一致的结果列表，每项同 search()
+        """
+        queries = normalize_rows(np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1))
+        with self._lock:
+            matrix = self.matrix
+            row_table = self.rows
+            lists = self._lists_for(mode)
+            quantized = self._quantized_for(mode)
+        if matrix.shape[0] == 0:
+            return [[] for _ in range(len(queries))]
+        rows, post = self._restrict(row_table, rows, where, lists is None and quantized is None)
+        if rows is not None and rows.size == 0:
+            return [[] for _ in range(len(queries))]
+        if lists is not None or quantized is not None:
+            return [
+                self.search(query, top_k=top_k, threshold=threshold, rows=rows,
+                            mode=mode, nprobe=nprobe, shortlist=shortlist)
+                for query in queries
+            ]
+
+        candidates = matrix[rows] if rows is not None else matrix
+        # (num_queries, N)
+        scores = queries @ candidates.T
+        k = top_k
+        if post is not None:
+            scores[:, ~post] = -np.inf
+            k = min(top_k, int(post.sum()))
+
+        batch_results = []
+        for query_scores in scores:
+            results = []
+            for i in top_k_indices(query_scores, k):
+                score = float(query_scores[i])
+                if threshold is not None and score < threshold:
+                    break
+                row_id = int(rows[i]) if rows is not None else int(i)
+                results.append((row_table[row_id], score))
+            batch_results.append(results)
+        return batch_results
+
+    def search_combined(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int = 10,
+    ) -> List[Tuple[Dict[str, Any], float, List[float]]]:
+        """
+        多条件组合检索：各查询相似度取平均后排序
+
+        返回:
+            [(行元数据, 平均相似度, 各查询相似度)]，按平均相似度降序
+        """
+        queries = normalize_rows(np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1))
+        with self._lock:
+            matrix = self.matrix
+            row_table = self.rows
+        if matrix.shape[0] == 0 or len(queries) == 0:
+            return []
+
+        # (N, num_queries)
+        scores = matrix @ queries.T
+        avg_scores = scores.mean(axis=1)
+
+        return [
+            (row_table[i], float(avg_scores[i]), scores[i].tolist())
+            for i in top_k_indices(avg_scores, top_k)
+        ]
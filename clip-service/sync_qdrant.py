@@ -1,12 +1,14 @@
 """
-Qdrant 同步脚本（针对 video_assets_v2）
+Qdrant 同步脚本（collection 默认 video_assets，与检索服务的 QDRANT_COLLECTION 一致）
 
 特性：
-- 读取 clip_results.json
+- 默认读取素材存储（asset_store.open_default_store）中的全部素材；--input 指定导出的 JSON 文件
 - point_id = sha1(canonical_path#segment_index)
 - payload 含 canonicalPath、mtime、segment、duration、tags/description/emotions、shotId/label、filePath、hashId
 - 支持 --dry-run 仅统计/预览
 - 默认 upsert 到 collection（可选 --recreate 重建）
+- --outbox：只同步素材存储发件箱中的增量变更（服务关闭了 CLIP_QDRANT_SYNC 时使用，
+  服务运行时由 qdrant_sync.QdrantSyncWorker 自动同步，不需要再全量执行本脚本）
 """
 
 import argparse
@@ -14,14 +16,20 @@ import hashlib
 import json
 import os
 from pathlib import Path
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Optional, Tuple
 
 import requests
 
 
 DEFAULT_QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
-DEFAULT_COLLECTION = os.getenv("QDRANT_COLLECTION", "video_assets_v2")
-RESULTS_FILE = Path(__file__).parent / "clip_results.json"
+DEFAULT_COLLECTION = os.getenv("QDRANT_COLLECTION", "video_assets")
+REQUEST_TIMEOUT = float(os.getenv("QDRANT_TIMEOUT", "30"))
+
+# 复用连接（keep-alive），批量 upsert 不再每批新建TCP连接
+_session = requests.Session()
+
+# 过滤条件用到的 payload 字段建 keyword 索引（未建索引时 Qdrant 逐点检查 payload）
+PAYLOAD_INDEXES = {"tags": "keyword", "emotions": "keyword", "filePath": "keyword"}
 
 
 def sha1_hex(text: str) -> str:
@@ -35,11 +43,12 @@ def load_results(path: Path) -> List[Dict[str, Any]]:
 
 def ensure_collection(qdrant_url: str, collection: str, recreate: bool = False):
     if recreate:
-        requests.delete(f"{qdrant_url}/collections/{collection}")
+        _session.delete(f"{qdrant_url}/collections/{collection}", timeout=REQUEST_TIMEOUT)
 
     # create if not exists
-    resp = requests.get(f"{qdrant_url}/collections/{collection}")
+    resp = _session.get(f"{qdrant_url}/collections/{collection}", timeout=REQUEST_TIMEOUT)
     if resp.ok and not recreate:
+        ensure_payload_indexes(_session, qdrant_url, collection)
         return
 
     payload = {
@@ -52,18 +61,44 @@ def ensure_collection(qdrant_url: str, collection: str, recreate: bool = False):
             "ef_construct": 256,
         },
     }
-    create_resp = requests.put(
-        f"{qdrant_url}/collections/{collection}", json=payload
+    create_resp = _session.put(
+        f"{qdrant_url}/collections/{collection}", json=payload, timeout=REQUEST_TIMEOUT
     )
     create_resp.raise_for_status()
+    ensure_payload_indexes(_session, qdrant_url, collection)
+
+
+def ensure_payload_indexes(session, qdrant_url: str, collection: str, timeout: float = REQUEST_TIMEOUT):
+    """创建过滤字段的 payload 索引（已存在时 Qdrant 直接返回成功）"""
+    for field, schema in PAYLOAD_INDEXES.items():
+        resp = session.put(
+            f"{qdrant_url}/collections/{collection}/index",
+            params={"wait": "true"},
+            json={"field_name": field, "field_schema": schema},
+            timeout=timeout,
+        )
+        resp.raise_for_status()
+
+
+def canonical_path_of(item: Dict[str, Any]) -> str:
+    return item.get("canonicalPath") or str(Path(item.get("filePath") or "").resolve())
+
+
+def point_id(item: Dict[str, Any], canonical_path: Optional[str] = None) -> str:
+    """point id：hashId，或 sha1(canonicalPath#segment_index)"""
+    if item.get("hashId"):
+        return item["hashId"]
+    canonical_path = canonical_path or canonical_path_of(item)
+    seg_index = (item.get("segment") or {}).get("index", 0)
+    return sha1_hex(f"{canonical_path}#{seg_index}")
 
 
 def build_point(item: Dict[str, Any]) -> Tuple[str, Dict[str, Any], List[float]]:
     file_path = item.get("filePath") or ""
-    canonical_path = item.get("canonicalPath") or str(Path(file_path).resolve())
+    canonical_path = canonical_path_of(item)
     segment = item.get("segment") or {}
     seg_index = segment.get("index", 0)
-    hash_id = item.get("hashId") or sha1_hex(f"{canonical_path}#{seg_index}")
+    hash_id = point_id(item, canonical_path)
 
     mtime = item.get("mtime")
     if mtime is None and file_path:
@@ -97,9 +132,10 @@ def build_point(item: Dict[str, Any]) -> Tuple[str, Dict[str, Any], List[float]]
 def upsert_points(qdrant_url: str, collection: str, points: List[Dict[str, Any]]):
     if not points:
         return
-    resp = requests.put(
+    resp = _session.put(
         f"{qdrant_url}/collections/{collection}/points",
         json={"points": points},
+        timeout=REQUEST_TIMEOUT,
     )
     resp.raise_for_status()
 
@@ -107,15 +143,19 @@ def upsert_points(qdrant_url: str, collection: str, points: List[Dict[str, Any]]
 def sync(
     qdrant_url: str,
     collection: str,
-    input_file: Path,
+    input_file: Optional[Path] = None,
     batch_size: int = 64,
     dry_run: bool = False,
     recreate: bool = False,
 ):
-    if not input_file.exists():
-        raise FileNotFoundError(f"结果文件不存在: {input_file}")
+    if input_file is None:
+        from asset_store import open_default_store
 
-    data = load_results(input_file)
+        data = open_default_store().iter_items(include_embeddings=True)
+    elif not input_file.exists():
+        raise FileNotFoundError(f"结果文件不存在: {input_file}")
+    else:
+        data = load_results(input_file)
     ensure_collection(qdrant_url, collection, recreate=recreate)
 
     total = 0
@@ -123,11 +163,11 @@ def sync(
     batch: List[Dict[str, Any]] = []
 
     for item in data:
-        point_id, payload, vector = build_point(item)
+        pid, payload, vector = build_point(item)
         if not vector:
             skipped += 1
             continue
-        batch.append({"id": point_id, "vector": vector, "payload": payload})
+        batch.append({"id": pid, "vector": vector, "payload": payload})
         total += 1
 
         if len(batch) >= batch_size and not dry_run:
@@ -142,20 +182,44 @@ def sync(
     )
 
 
+def sync_outbox(qdrant_url: str, collection: str, batch_size: int = 64):
+    from asset_store import open_default_store
+    from qdrant_sync import QdrantSyncWorker
+
+    store = open_default_store()
+    worker = QdrantSyncWorker(store, qdrant_url, collection, batch_size=batch_size, start=False)
+    synced = 0
+    while True:
+        count = worker.sync_once()
+        if not count:
+            break
+        synced += count
+    worker.close()
+    print(
+        f"增量同步完成 -> collection={collection}, 变更: {synced}, "
+        f"upsert: {worker.upserted}, 删除: {worker.deleted}, 剩余: {store.outbox_size()}"
+    )
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Sync clip_results.json to Qdrant")
+    parser = argparse.ArgumentParser(description="Sync the asset store (or an exported JSON file) to Qdrant")
     parser.add_argument("--qdrant-url", default=DEFAULT_QDRANT_URL)
     parser.add_argument("--collection", default=DEFAULT_COLLECTION)
-    parser.add_argument("--input", default=str(RESULTS_FILE))
+    parser.add_argument("--input", help="导出的 JSON 文件（默认读取素材存储）")
     parser.add_argument("--batch-size", type=int, default=64)
     parser.add_argument("--dry-run", action="store_true")
     parser.add_argument("--recreate", action="store_true")
+    parser.add_argument("--outbox", action="store_true", help="只同步素材存储中未同步的增量变更")
     args = parser.parse_args()
 
+    if args.outbox:
+        sync_outbox(args.qdrant_url, args.collection, args.batch_size)
+        return
+
     sync(
         qdrant_url=args.qdrant_url,
         collection=args.collection,
-        input_file=Path(args.input),
+        input_file=Path(args.input) if args.input else None,
         batch_size=args.batch_size,
         dry_run=args.dry_run,
         recreate=args.recreate,
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""测试素材存储：upsert、单行元数据更新、向量文件压缩与变更发件箱"""
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from asset_store import OUTBOX_DELETE, OUTBOX_UPSERT, AssetStore
+
+DIM = 8
+
+
+def make_item(path: str, seed: int, tags=None):
+    vector = np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+    return {
+        "filePath": path,
+        "shotId": f"shot_{seed}",
+        "clipMetadata": {
+            "embeddings": vector.tolist(),
+            "tags": tags or [],
+            "description": f"素材 {seed}",
+            "emotions": [],
+        },
+    }
+
+
+def embedding(store: AssetStore, path: str) -> np.ndarray:
+    item = next(store.iter_items(file_paths=[path]))
+    return np.asarray(item["clipMetadata"]["embeddings"], dtype=np.float32)
+
+
+def test_upsert_replaces_by_path():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            assert store.upsert([make_item("/a/1.mp4", 1), make_item("/a/2.mp4", 2)]) == 2
+            generation = store.generation
+            store.upsert([make_item("/a/1.mp4", 3, tags=["夜晚"])])
+
+            assert len(store) == 2
+            assert store.file_paths() == {"/a/1.mp4", "/a/2.mp4"}
+            assert store.generation > generation
+            item = next(store.iter_items(file_paths=["/a/1.mp4"]))
+            assert item["shotId"] == "shot_3"
+            assert item["clipMetadata"]["tags"] == ["夜晚"]
+            # 向量按原始范数还原
+            expected = np.asarray(make_item("/a/1.mp4", 3)["clipMetadata"]["embeddings"], dtype=np.float32)
+            np.testing.assert_allclose(embedding(store, "/a/1.mp4"), expected, rtol=1e-5, atol=1e-6)
+            # 替换向量留下一行死行
+            assert store.dead_rows() == 1
+        finally:
+            store.close()
+
+
+def test_update_metadata_keeps_vectors():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            store.upsert([make_item("/a/1.mp4", 1)])
+            before = embedding(store, "/a/1.mp4")
+            vectors_size = store.vectors_path.stat().st_size
+
+            updated = store.update_metadata([
+                ("/a/1.mp4", {"tags": ["白天", "城市"], "description": "新描述"}),
+                ("/a/missing.mp4", {"tags": ["白天"]}),
+            ])
+            assert updated == 1
+            item = next(store.iter_items(file_paths=["/a/1.mp4"]))
+            assert item["clipMetadata"]["tags"] == ["白天", "城市"]
+            assert item["clipMetadata"]["description"] == "新描述"
+            np.testing.assert_array_equal(embedding(store, "/a/1.mp4"), before)
+            assert store.vectors_path.stat().st_size == vectors_size
+
+            try:
+                store.update_metadata([("/a/1.mp4", {"embeddings": [0.0] * DIM})])
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("不支持单行更新的字段应抛出 ValueError")
+        finally:
+            store.close()
+
+
+def test_compact_drops_dead_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            store.upsert([make_item(f"/a/{i}.mp4", i) for i in range(5)])
+            store.upsert([make_item("/a/1.mp4", 11), make_item("/a/3.mp4", 13)])
+            store.delete(["/a/4.mp4"])
+            expected = {path: embedding(store, path) for path in store.file_paths()}
+            assert store.dead_rows() == 3
+
+            old_path = store.vectors_path
+            store.compact()
+            assert store.vectors_path != old_path
+            assert store.dead_rows() == 0
+            assert store.vectors_path.stat().st_size == 4 * DIM * 4
+            for path, vector in expected.items():
+                np.testing.assert_array_equal(embedding(store, path), vector)
+
+            snapshot = store.index_snapshot()
+            assert list(snapshot.vec_rows) == list(range(4))
+            assert snapshot.vectors_file == store.vectors_path.name
+        finally:
+            store.close()
+
+
+def test_outbox_coalesces_and_retries():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            store.upsert([make_item("/a/1.mp4", 1), make_item("/a/2.mp4", 2)])
+            store.update_metadata([("/a/1.mp4", {"tags": ["夜晚"]})])
+            store.delete(["/a/2.mp4"])
+
+            # 同一文件的多次变更只保留最后一次
+            entries = {path: (op, enqueued_at) for path, op, enqueued_at, _ in store.outbox_peek()}
+            assert store.outbox_size() == 2
+            assert entries["/a/1.mp4"][0] == OUTBOX_UPSERT
+            assert entries["/a/2.mp4"][0] == OUTBOX_DELETE
+
+            # 发送期间又有新变更时，旧的 enqueued_at 不能删除新记录
+            stale = ("/a/1.mp4", entries["/a/1.mp4"][1])
+            store.update_metadata([("/a/1.mp4", {"tags": ["白天"]})])
+            store.outbox_ack([stale, ("/a/2.mp4", entries["/a/2.mp4"][1])])
+            assert [path for path, *_ in store.outbox_peek()] == ["/a/1.mp4"]
+
+            store.outbox_retry(["/a/1.mp4"])
+            store.outbox_retry(["/a/1.mp4"])
+            assert store.outbox_peek(max_attempts=2) == []
+            assert store.outbox_exhausted(2) == (1, ["/a/1.mp4"])
+            assert store.outbox_exhausted(3) == (0, [])
+        finally:
+            store.close()
+
+
+if __name__ == "__main__":
+    test_upsert_replaces_by_path()
+    test_update_metadata_keeps_vectors()
+    test_compact_drops_dead_rows()
+    test_outbox_coalesces_and_retries()
+    print("通过")
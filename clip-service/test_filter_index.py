@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""测试过滤倒排索引：and / or / not 组合、情绪后缀、标签类别与目录前缀"""
+import numpy as np
+
+from filter_index import FilterIndex
+
+ROWS = [
+    {"filePath": "D:/素材/动作/a.mp4", "tags": ["夜晚", "城市"], "emotions": ["紧张"]},
+    {"filePath": "D:\\素材\\动作\\b.mp4", "tags": ["白天"], "emotions": ["欢快"]},
+    {"filePath": "D:/素材/动作片/c.mp4", "tags": ["夜晚"], "emotions": []},
+    {"filePath": "D:/素材/风景/d.mp4", "tags": ["城市"], "emotions": ["紧张"]},
+    {"filePath": "D:/素材/动作/子目录/e.mp4", "tags": [], "emotions": ["平静"]},
+]
+TAG_CATEGORIES = {"夜晚": "time", "白天": "time", "城市": "scene"}
+
+
+def rows_of(index: FilterIndex, expr) -> list:
+    return np.flatnonzero(index.evaluate(expr)).tolist()
+
+
+def test_leaves():
+    index = FilterIndex(ROWS, TAG_CATEGORIES)
+    assert rows_of(index, {"tag": "夜晚"}) == [0, 2]
+    assert rows_of(index, {"tag": ["白天", "城市"]}) == [0, 1, 3]
+    assert rows_of(index, {"tag": "不存在"}) == []
+    # 情绪两种写法都可以
+    assert rows_of(index, {"emotion": "紧张氛围"}) == rows_of(index, {"emotion": "紧张"}) == [0, 3]
+    assert rows_of(index, {"category": "time"}) == [0, 1, 2]
+
+
+def test_boolean_combinations():
+    index = FilterIndex(ROWS, TAG_CATEGORIES)
+    assert rows_of(index, {"and": [{"tag": "夜晚"}, {"emotion": "紧张"}]}) == [0]
+    # 同一对象中的多个键按 and 组合
+    assert rows_of(index, {"tag": "夜晚", "emotion": "紧张"}) == [0]
+    assert rows_of(index, {"or": [{"tag": "白天"}, {"emotion": "平静"}]}) == [1, 4]
+    assert rows_of(index, {"not": {"tag": "夜晚"}}) == [1, 3, 4]
+    assert rows_of(index, {"and": [{"category": "scene"}, {"not": {"path": "D:/素材/风景"}}]}) == [0]
+    assert rows_of(index, {"or": [{"not": {"tag": "城市"}}, {"tag": "夜晚"}]}) == [0, 1, 2, 4]
+
+
+def test_path_rows_match_directory_boundaries():
+    index = FilterIndex(ROWS, TAG_CATEGORIES)
+    # 反斜杠路径统一为 "/"；"动作" 不匹配 "动作片"，包含子目录
+    assert sorted(index._path_rows("D:/素材/动作").tolist()) == [0, 1, 4]
+    assert sorted(index._path_rows("D:\\素材\\动作\\").tolist()) == [0, 1, 4]
+    assert index._path_rows("D:/素材/动作片").tolist() == [2]
+    assert sorted(index._path_rows("D:/素材").tolist()) == [0, 1, 2, 3, 4]
+    assert index._path_rows("D:/其他").tolist() == []
+
+
+def test_invalid_expressions():
+    index = FilterIndex(ROWS, TAG_CATEGORIES)
+    for expr in ({}, {"and": []}, {"or": {"tag": "夜晚"}}, {"unknown": "x"}, {"tag": 1}, "夜晚"):
+        try:
+            index.evaluate(expr)
+        except ValueError:
+            continue
+        raise AssertionError(f"应拒绝不合法的表达式: {expr!r}")
+
+
+if __name__ == "__main__":
+    test_leaves()
+    test_boolean_combinations()
+    test_path_rows_match_directory_boundaries()
+    test_invalid_expressions()
+    print("通过")
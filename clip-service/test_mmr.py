@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""测试向量化的 MMR 选择与原逐候选循环的结果一致"""
+import numpy as np
+
+from qdrant_search import mmr_select, mmr_select_batch
+
+
+def mmr_reference(vectors: np.ndarray, relevance: np.ndarray, top_k: int, lambda_param: float = 0.7):
+    """原 QdrantSearchService.apply_mmr 中的逐候选循环（候选按相关性降序）"""
+    def cosine(a, b):
+        norm_a, norm_b = np.linalg.norm(a), np.linalg.norm(b)
+        if norm_a == 0 or norm_b == 0:
+            return 0.0
+        return np.dot(a, b) / (norm_a * norm_b)
+
+    selected = [0]
+    while len(selected) < top_k and len(selected) < len(vectors):
+        best_score, best_idx = -float("inf"), -1
+        for i in range(len(vectors)):
+            if i in selected:
+                continue
+            max_similarity = 0.0
+            for j in selected:
+                max_similarity = max(max_similarity, cosine(vectors[i], vectors[j]))
+            score = lambda_param * relevance[i] - (1 - lambda_param) * max_similarity
+            if score > best_score:
+                best_score, best_idx = score, i
+        if best_idx != -1:
+            selected.append(best_idx)
+    return selected
+
+
+def make_candidates(rng, n: int, dim: int = 16):
+    # 若干近重复的候选，MMR 应把它们分散开
+    base = rng.normal(size=(max(1, n // 4), dim))
+    vectors = base[rng.integers(0, base.shape[0], size=n)] + 0.1 * rng.normal(size=(n, dim))
+    relevance = np.sort(rng.uniform(0.2, 0.9, size=n))[::-1]
+    return vectors.astype(np.float32), relevance.astype(np.float32)
+
+
+def test_matches_reference_loop():
+    rng = np.random.default_rng(0)
+    for trial in range(30):
+        n = int(rng.integers(1, 40))
+        vectors, relevance = make_candidates(rng, n)
+        for lambda_param in (0.0, 0.3, 0.7, 1.0):
+            top_k = int(rng.integers(1, n + 3))
+            expected = mmr_reference(vectors, relevance, top_k, lambda_param)
+            assert mmr_select(vectors, relevance, top_k, lambda_param) == expected, (trial, lambda_param)
+
+
+def test_zero_vectors_have_no_similarity():
+    vectors = np.array([[1.0, 0.0], [0.0, 0.0], [1.0, 0.01]], dtype=np.float32)
+    relevance = np.array([0.9, 0.8, 0.85], dtype=np.float32)
+    assert mmr_select(vectors, relevance, 3, 0.5) == mmr_reference(vectors, relevance, 3, 0.5) == [0, 1, 2]
+
+
+def test_batch_pads_short_queries():
+    rng = np.random.default_rng(1)
+    first, first_rel = make_candidates(rng, 12)
+    second, second_rel = make_candidates(rng, 7)
+    vectors = np.zeros((2, 12, first.shape[1]), dtype=np.float32)
+    relevance = np.full((2, 12), -np.inf, dtype=np.float32)
+    vectors[0], relevance[0] = first, first_rel
+    vectors[1, :7], relevance[1, :7] = second, second_rel
+
+    picks = mmr_select_batch(vectors, relevance, 10)
+    assert picks[0] == mmr_reference(first, first_rel, 10)
+    # 补齐的候选不会被选中
+    assert picks[1] == mmr_reference(second, second_rel, 10)
+    assert len(picks[1]) == 7
+
+
+if __name__ == "__main__":
+    test_matches_reference_loop()
+    test_zero_vectors_have_no_similarity()
+    test_batch_pads_short_queries()
+    print("通过")
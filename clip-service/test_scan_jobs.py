@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""测试扫描任务续扫计数（增量跳过的文件续扫时不重复计数）"""
+import tempfile
+from pathlib import Path
+
+from scan_jobs import CANCELLED, COMPLETED, ScanJobManager
+from scan_manifest import FileFingerprint, ScanManifest, plan_scan
+
+MODEL = "test-model"
+
+
+def make_files(root: Path, count: int):
+    files = []
+    for i in range(count):
+        path = root / f"clip_{i:02d}.mp4"
+        path.write_bytes(bytes([i]) * 1024)
+        files.append(str(path))
+    return files
+
+
+def record_unchanged(manifest: ScanManifest, paths):
+    manifest.record([FileFingerprint(p, Path(p).stat().st_size, Path(p).stat().st_mtime_ns) for p in paths], MODEL)
+
+
+def make_runner(manager: ScanJobManager, manifest: ScanManifest, files, stored: set, cancel_after: int):
+    """按 plan_scan 划分文件后逐个上报结果（run_scan_job 去掉解码与推理），首次运行处理 cancel_after 个文件后取消"""
+    runs = []
+
+    def runner(job):
+        runs.append(job.id)
+        job.set_total(len(files))
+        fingerprints, skipped = plan_scan(files, job.done_paths, manifest, MODEL, stored)
+        job.add_skipped(skipped)
+        for i, fingerprint in enumerate(fingerprints):
+            if len(runs) == 1 and i == cancel_after:
+                manager.cancel(job.id)
+            job.check_cancelled()
+            job.add_result({"filePath": fingerprint.path, "status": "success"})
+
+    return runner
+
+
+def test_plan_scan_excludes_done_paths():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        files = make_files(root, 6)
+        manifest = ScanManifest(root / "manifest.sqlite3")
+        record_unchanged(manifest, files[:2])
+
+        # 首次扫描：已入库且未变化的文件跳过
+        to_process, skipped = plan_scan(files, set(), manifest, MODEL, set(files[:2]))
+        assert skipped == files[:2]
+        assert [fp.path for fp in to_process] == files[2:]
+
+        # 续扫：已跳过/已处理的文件不再参与判定，跳过数不重复
+        to_process, skipped = plan_scan(files, set(files[:4]), manifest, MODEL, set(files[:2]))
+        assert skipped == []
+        assert [fp.path for fp in to_process] == files[4:]
+
+        # 换模型后清单失效，全部重新处理
+        to_process, skipped = plan_scan(files, set(), manifest, "other-model", set(files[:2]))
+        assert skipped == []
+        assert len(to_process) == len(files)
+
+
+def test_plan_scan_without_manifest():
+    files = ["/a/1.mp4", "/a/2.mp4", "/a/3.mp4"]
+    to_process, skipped = plan_scan(files, {"/a/2.mp4"}, None)
+    assert skipped == []
+    assert to_process == [FileFingerprint("/a/1.mp4", -1, -1), FileFingerprint("/a/3.mp4", -1, -1)]
+
+
+def test_resume_does_not_recount_skipped():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        files = make_files(root, 10)
+
+        # 前 4 个文件已入库且清单未变化 → 增量跳过
+        manifest = ScanManifest(root / "manifest.sqlite3")
+        unchanged = files[:4]
+        record_unchanged(manifest, unchanged)
+        stored = set(unchanged)
+
+        manager = ScanJobManager(lambda job: None)
+        manager.runner = make_runner(manager, manifest, files, stored, cancel_after=3)
+        try:
+            job = manager.submit({"directory": tmp})
+            job.future.result()
+            assert job.status == CANCELLED
+            assert (job.skipped, job.processed) == (4, 3)
+
+            manager.resume(job.id)
+            job.future.result()
+            assert job.status == COMPLETED
+
+            progress = job.progress()
+            summary = job.summary()
+            assert summary["skipped"] == 4
+            assert summary["processed"] == 6
+            assert summary["failed"] == 0
+            assert progress["done"] == progress["total"] == len(files)
+            assert progress["percent"] == 100.0
+            assert job.done_paths == set(files)
+        finally:
+            manager.shutdown()
+
+
+if __name__ == "__main__":
+    test_plan_scan_excludes_done_paths()
+    test_plan_scan_without_manifest()
+    test_resume_does_not_recount_skipped()
+    print("通过")
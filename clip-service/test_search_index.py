@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""测试向量检索索引：压缩向量 / 符号位 / PCA 粗筛的召回率，IVF 索引的增量更新"""
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from ann_index import IVFIndex
+from asset_store import AssetStore
+from pca_projection import fit_pca, projection_for
+from point_vectors import PointVectorCache
+from quantization import QuantizedVectors
+from search_index import EmbeddingIndex
+from sync_qdrant import point_id
+
+DIM = 64
+CLUSTERS = 20
+
+
+def clustered_vectors(rows: int, seed: int = 0) -> np.ndarray:
+    """围绕若干中心的向量（接近CLIP向量在库内成簇的分布）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(CLUSTERS, DIM))
+    labels = rng.integers(0, CLUSTERS, size=rows)
+    return (centers[labels] + 0.6 * rng.normal(size=(rows, DIM))).astype(np.float32)
+
+
+def fill_store(store: AssetStore, vectors: np.ndarray, offset: int = 0):
+    store.upsert([
+        {"filePath": f"/assets/{offset + i:05d}.mp4", "clipMetadata": {"embeddings": vector.tolist()}}
+        for i, vector in enumerate(vectors)
+    ])
+
+
+def recall_of(index: EmbeddingIndex, params, queries) -> float:
+    return index.recall_report([params], top_k=10, query_vectors=queries)[0]["recall"]
+
+
+def test_compressed_modes_recall():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            vectors = clustered_vectors(3000)
+            fill_store(store, vectors)
+            mean, components, eigenvalues = fit_pca(vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+            index = EmbeddingIndex(
+                store,
+                quantizer=QuantizedVectors("int8"),
+                binary=QuantizedVectors("binary"),
+                binary_shortlist=500,
+                pca=QuantizedVectors("pca", projection=projection_for(mean, components, eigenvalues, 32)),
+                pca_shortlist=200,
+            )
+            assert index.refresh()
+            # 查询为库内向量加噪声（与库同分布，但不与任何一行重合）
+            rng = np.random.default_rng(1)
+            queries = vectors[rng.choice(len(vectors), 50, replace=False)] + 0.3 * rng.normal(size=(50, DIM))
+
+            assert recall_of(index, {"mode": "exact"}, queries) == 1.0
+            assert recall_of(index, {"mode": "auto"}, queries) >= 0.99
+            assert recall_of(index, {"mode": "binary"}, queries) >= 0.9
+            assert recall_of(index, {"mode": "pca"}, queries) >= 0.9
+            # 短名单越长召回越高
+            assert recall_of(index, {"mode": "binary", "shortlist": 50}, queries) <= recall_of(index, {"mode": "binary"}, queries)
+        finally:
+            store.close()
+
+
+def test_refresh_encodes_only_new_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            fill_store(store, clustered_vectors(500))
+            index = EmbeddingIndex(store, binary=QuantizedVectors("binary"), binary_shortlist=50)
+            index.refresh()
+            first = index._components["binary"]
+
+            fill_store(store, clustered_vectors(100, seed=2), offset=500)
+            assert index.refresh()
+            second = index._components["binary"]
+            assert len(index) == 600
+            # 旧快照不受追加影响，已编码的行保持不变
+            assert first.codes.shape[0] == 500
+            np.testing.assert_array_equal(second.codes[:500], first.codes)
+            # 库内向量检索到自身
+            query = np.asarray(index.matrix[550])
+            row, score = index.search(query, top_k=1, mode="binary")[0]
+            assert row["filePath"] == "/assets/00550.mp4" and score > 0.999
+        finally:
+            store.close()
+
+
+def test_ivf_update_is_incremental():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        store = AssetStore(root / "store")
+        try:
+            fill_store(store, clustered_vectors(1000))
+            ivf = IVFIndex(root / "ivf", nlist=16, nprobe=16, min_rows=500)
+
+            snapshot = store.index_snapshot()
+            ivf.update(snapshot.vectors, snapshot.vec_rows, snapshot.vectors_file)
+            assert ivf.ready
+            centroids = np.array(ivf.centroids)
+            assert ivf._assign_rows == 1000
+
+            # 追加与替换：只为新行分配簇，不重新训练
+            fill_store(store, clustered_vectors(200, seed=3), offset=1000)
+            fill_store(store, clustered_vectors(10, seed=4))
+            snapshot = store.index_snapshot()
+            ivf.update(snapshot.vectors, snapshot.vec_rows, snapshot.vectors_file)
+            np.testing.assert_array_equal(ivf.centroids, centroids)
+            assert ivf._assign_rows == 1210
+            rows = snapshot.vectors.shape[0]
+            assert rows == 1200
+            # 探测全部簇时候选即全部行
+            query = snapshot.vectors[0]
+            assert np.array_equal(np.sort(ivf.lists.candidates(query, 16)), np.arange(rows))
+            # 每行所在的簇与重新分配的结果一致
+            assigned = np.empty(rows, dtype=np.int64)
+            for cluster in range(16):
+                assigned[ivf.lists.order[ivf.lists.offsets[cluster]:ivf.lists.offsets[cluster + 1]]] = cluster
+            expected = np.argmax(np.asarray(snapshot.vectors) @ ivf.lists.centroids.T, axis=1)
+            np.testing.assert_array_equal(assigned, expected)
+
+            # 向量文件压缩后行号改变：质心不变，全部重新分配
+            store.compact()
+            snapshot = store.index_snapshot()
+            ivf.update(snapshot.vectors, snapshot.vec_rows, snapshot.vectors_file)
+            np.testing.assert_array_equal(ivf.centroids, centroids)
+            assert ivf.vectors_file == snapshot.vectors_file
+            assert ivf._assign_rows == rows
+
+            # 重新加载后沿用已保存的质心与分配
+            reloaded = IVFIndex(root / "ivf", nlist=16, nprobe=16, min_rows=500)
+            assert reloaded._assign_rows == rows
+            np.testing.assert_array_equal(reloaded.centroids, centroids)
+        finally:
+            store.close()
+
+
+def test_point_vectors_follow_index_snapshot():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AssetStore(Path(tmp))
+        try:
+            vectors = clustered_vectors(20)
+            fill_store(store, vectors)
+            index = EmbeddingIndex(store)
+            assert index.snapshot()[2] is None
+            index.refresh()
+            matrix, rows, generation = index.snapshot()
+            assert generation == store.generation and len(rows) == matrix.shape[0] == 20
+
+            cache = PointVectorCache(index, refresh_interval=0)
+            ids = [point_id(item) for item in store.iter_items(include_embeddings=False)]
+            found_vectors, found = cache.lookup(ids[:3] + ["unknown"])
+            assert found.tolist() == [True, True, True, False]
+            expected = vectors[:3] / np.linalg.norm(vectors[:3], axis=1, keepdims=True)
+            np.testing.assert_allclose(found_vectors[:3], expected, rtol=1e-5, atol=1e-6)
+            assert cache.stats()["generation"] == generation
+        finally:
+            store.close()
+
+
+if __name__ == "__main__":
+    test_compressed_modes_recall()
+    test_refresh_encodes_only_new_rows()
+    test_ivf_update_is_incremental()
+    test_point_vectors_follow_index_snapshot()
+    print("通过")
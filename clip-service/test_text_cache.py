@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""测试查询向量缓存的磁盘层上限：按最近使用时间淘汰"""
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from text_cache import QueryEmbeddingCache
+
+MODEL = "test-model"
+
+
+def vectors(texts):
+    return {text: np.full(4, i, dtype=np.float32) for i, text in enumerate(texts)}
+
+
+def disk_texts(db_path: Path) -> set:
+    with sqlite3.connect(str(db_path)) as conn:
+        return {row[0] for row in conn.execute("SELECT text FROM query_embeddings")}
+
+
+def test_disk_tier_is_capped_by_last_used():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "query_embeddings.sqlite3"
+        cache = QueryEmbeddingCache(db_path, max_entries=2, max_disk_entries=4, prune_every=1)
+        for text in "abcd":
+            cache.put_many(MODEL, vectors([text]))
+        # "a" 已被挤出内存层，从磁盘命中后成为最近使用
+        assert set(cache.get_many(MODEL, ["a"])) == {"a"}
+        assert cache.disk_hits == 1
+
+        cache.put_many(MODEL, vectors(["e", "f"]))
+        assert disk_texts(db_path) == {"a", "d", "e", "f"}
+        assert cache.stats()["evicted"] == 2
+
+        # 重启后仍可命中保留的查询
+        reopened = QueryEmbeddingCache(db_path, max_entries=2, max_disk_entries=4)
+        assert set(reopened.get_many(MODEL, ["a", "b", "f"])) == {"a", "f"}
+
+
+def test_legacy_cache_file_is_migrated():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "query_embeddings.sqlite3"
+        with sqlite3.connect(str(db_path)) as conn:
+            conn.execute(
+                "CREATE TABLE query_embeddings (model TEXT NOT NULL, text TEXT NOT NULL, dim INTEGER NOT NULL, "
+                "vector BLOB NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (model, text))"
+            )
+            conn.executemany(
+                "INSERT INTO query_embeddings VALUES (?, ?, 4, ?, ?)",
+                [(MODEL, text, np.zeros(4, dtype=np.float32).tobytes(), i) for i, text in enumerate("xyz")],
+            )
+        cache = QueryEmbeddingCache(db_path, max_disk_entries=2, prune_every=1)
+        assert cache.stats()["persistent"]
+        cache.put_many(MODEL, vectors(["new"]))
+        # 旧行以写入时间作为最近使用时间，最早的先淘汰
+        assert disk_texts(db_path) == {"z", "new"}
+
+
+if __name__ == "__main__":
+    test_disk_tier_is_capped_by_last_used()
+    test_legacy_cache_file_is_migrated()
+    print("通过")
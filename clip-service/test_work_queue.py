@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""测试分布式扫描工作队列：租约过期回收、提交与写入期间的租约校验"""
+import tempfile
+import time
+from pathlib import Path
+
+from work_queue import DONE, FAILED, LEASED, PENDING, LeaseLost, ScanWorkQueue
+
+PATHS = [f"/assets/{i}.mp4" for i in range(4)]
+
+
+def open_pair(root: Path, lease_seconds: float, max_attempts: int = 3):
+    """同一个队列文件上的两个工作者（模拟两台机器）"""
+    path = root / "queue.sqlite3"
+    return (
+        ScanWorkQueue(path, lease_seconds=lease_seconds, max_attempts=max_attempts),
+        ScanWorkQueue(path, lease_seconds=lease_seconds, max_attempts=max_attempts),
+    )
+
+
+def test_expired_lease_is_reclaimed():
+    with tempfile.TemporaryDirectory() as tmp:
+        first, second = open_pair(Path(tmp), lease_seconds=0.2)
+        try:
+            assert first.enqueue(PATHS) == 4
+            assert first.enqueue(PATHS[:2]) == 0
+            lease = first.lease(4, owner="a")
+            assert lease.paths == PATHS
+            # 租约有效期内其他工作者领不到
+            assert second.lease(4, owner="b") is None
+            assert first.heartbeat(lease)
+
+            time.sleep(0.3)
+            assert not first.heartbeat(lease)
+            taken = second.lease(4, owner="b")
+            assert taken is not None and taken.paths == PATHS
+            assert second.stats()[LEASED] == 4
+            # 原持有者提交时租约已被他人领取
+            try:
+                first.commit(lease, lambda paths: None)
+            except LeaseLost:
+                pass
+            else:
+                raise AssertionError("过期租约提交应抛出 LeaseLost")
+        finally:
+            first.close()
+            second.close()
+
+
+def test_lease_expiring_too_often_fails():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue, _ = open_pair(Path(tmp), lease_seconds=0.05, max_attempts=2)
+        try:
+            queue.enqueue(PATHS[:1])
+            for _ in range(2):
+                assert queue.lease(1) is not None
+                time.sleep(0.1)
+            assert queue.lease(1) is None
+            assert queue.stats()[FAILED] == 1
+        finally:
+            queue.close()
+
+
+def test_commit_marks_done_and_failed():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue, _ = open_pair(Path(tmp), lease_seconds=30, max_attempts=2)
+        try:
+            queue.enqueue(PATHS)
+            lease = queue.lease(4)
+            written = []
+            succeeded = queue.commit(lease, written.extend, failed={PATHS[3]: "无法提取帧"})
+            assert succeeded == written == PATHS[:3]
+            # 失败的文件未达重试上限，退回待处理
+            assert queue.stats() == {PENDING: 1, LEASED: 0, DONE: 3, FAILED: 0}
+
+            retry = queue.lease(4)
+            assert retry.paths == PATHS[3:]
+            assert queue.commit(retry, written.extend, failed={PATHS[3]: "无法提取帧"}) == []
+            assert queue.stats()[FAILED] == 1
+            assert queue.retry_failed() == 1
+            assert queue.stats()[PENDING] == 1
+        finally:
+            queue.close()
+
+
+def test_commit_write_runs_outside_lock():
+    with tempfile.TemporaryDirectory() as tmp:
+        first, second = open_pair(Path(tmp), lease_seconds=0.2)
+        try:
+            first.enqueue(PATHS)
+            lease = first.lease(2, owner="a")
+            events = []
+
+            def slow_write(paths):
+                # 写入期间其他工作者照常领取；本租约在写入期间过期并被领走
+                events.append(second.lease(2, owner="b").paths)
+                time.sleep(0.3)
+                events.append(second.lease(2, owner="b").paths)
+
+            try:
+                first.commit(lease, slow_write)
+            except LeaseLost:
+                pass
+            else:
+                raise AssertionError("写入期间租约失效应抛出 LeaseLost")
+            assert events == [PATHS[2:], PATHS[:2]]
+            # 写入后的校验失败时不标记完成
+            assert first.stats()[DONE] == 0
+        finally:
+            first.close()
+            second.close()
+
+
+def test_failed_write_keeps_lease():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue, _ = open_pair(Path(tmp), lease_seconds=30)
+        try:
+            queue.enqueue(PATHS[:2])
+            lease = queue.lease(2)
+
+            def failing_write(paths):
+                raise OSError("服务不可用")
+
+            try:
+                queue.commit(lease, failing_write)
+            except OSError:
+                pass
+            else:
+                raise AssertionError("写入异常应向调用方抛出")
+            # 不做任何标记，租约仍然有效，可以重试提交
+            assert queue.stats()[LEASED] == 2
+            assert queue.heartbeat(lease)
+            assert queue.commit(lease, lambda paths: None) == PATHS[:2]
+        finally:
+            queue.close()
+
+
+if __name__ == "__main__":
+    test_expired_lease_is_reclaimed()
+    test_lease_expiring_too_often_fails()
+    test_commit_marks_done_and_failed()
+    test_commit_write_runs_outside_lock()
+    test_failed_write_keeps_lease()
+    print("通过")
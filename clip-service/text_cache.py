@@ -0,0 +1,186 @@
+"""
+查询文本向量缓存 - 在clip_server.py中集成
+两级缓存：进程内LRU + SQLite持久化存储（重启后仍可命中）
+键为 (model_name, text)，值为归一化后的float32向量
+
+SQLite 层最多保留 max_disk_entries 行，按 last_used 淘汰最久未用的行：
+put_many 每写入 prune_every 条检查一次；内存层命中不访问磁盘，只记下键，在检查时一并刷新 last_used
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingCache:
+    """查询向量两级缓存"""
+
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        max_entries: int = 4096,
+        max_disk_entries: int = 100000,
+        prune_every: int = 256,
+    ):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.prune_every = prune_every
+        self.db_path = Path(db_path) if db_path else None
+        self._memory: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 上次淘汰检查以来内存层命中的键（检查时刷新磁盘上的 last_used）与写入条数
+        self._touched: set = set()
+        self._puts_since_prune = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        if self.db_path is not None:
+            try:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS query_embeddings (
+                        model TEXT NOT NULL,
+                        text TEXT NOT NULL,
+                        dim INTEGER NOT NULL,
+                        vector BLOB NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (model, text)
+                    )
+                    """
+                )
+                columns = {row[1] for row in self._conn.execute("PRAGMA table_info(query_embeddings)")}
+                if "last_used" not in columns:
+                    # 旧版缓存文件：以写入时间作为最近使用时间
+                    self._conn.execute("ALTER TABLE query_embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+                    self._conn.execute("UPDATE query_embeddings SET last_used = created_at")
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (last_used)"
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"查询向量持久化缓存不可用，仅使用内存缓存: {e}")
+                self._conn = None
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """批量查询缓存，返回命中的 {text: vector}，未命中的不在结果中"""
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            disk_lookup = []
+            for text in dict.fromkeys(texts):
+                key = (model_name, text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[text] = vector
+                    self.memory_hits += 1
+                    if self._conn is not None:
+                        self._touched.add(key)
+                else:
+                    disk_lookup.append(text)
+
+            rows = []
+            if disk_lookup and self._conn is not None:
+                try:
+                    # 分块查询，避免超过SQLite参数上限
+                    for start in range(0, len(disk_lookup), 500):
+                        chunk = disk_lookup[start:start + 500]
+                        placeholders = ",".join("?" * len(chunk))
+                        rows.extend(self._conn.execute(
+                            f"SELECT text, dim, vector FROM query_embeddings "
+                            f"WHERE model = ? AND text IN ({placeholders})",
+                            [model_name, *chunk],
+                        ).fetchall())
+                except sqlite3.Error as e:
+                    logger.warning(f"查询向量缓存读取失败: {e}")
+                for text, dim, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32, count=dim).copy()
+                    found[text] = vector
+                    self._remember((model_name, text), vector)
+                    self._touched.add((model_name, text))
+                    self.disk_hits += 1
+
+            self.misses += sum(1 for text in disk_lookup if text not in found)
+        return found
+
+    def put_many(self, model_name: str, entries: Dict[str, np.ndarray]):
+        """写入缓存（内存 + 磁盘）"""
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            records = []
+            for text, vector in entries.items():
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                self._remember((model_name, text), vector)
+                records.append((model_name, text, vector.shape[0], vector.tobytes(), now))
+
+            if self._conn is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO query_embeddings "
+                        "(model, text, dim, vector, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(*record, now) for record in records],
+                    )
+                    self._puts_since_prune += len(records)
+                    if self._puts_since_prune >= self.prune_every:
+                        self._prune(now)
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"查询向量缓存写入失败: {e}")
+
+    def _prune(self, now: float):
+        """刷新命中过的键的 last_used，并把磁盘层裁剪到 max_disk_entries 行（调用方持锁，由调用方提交）"""
+        self._puts_since_prune = 0
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE query_embeddings SET last_used = ? WHERE model = ? AND text = ?",
+                [(now, model, text) for model, text in self._touched],
+            )
+            self._touched.clear()
+        count = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM query_embeddings WHERE rowid IN "
+                "(SELECT rowid FROM query_embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.evicted += excess
+            logger.info(f"查询向量缓存淘汰最久未用的 {excess} 条（上限 {self.max_disk_entries}）")
+
+    def stats(self) -> Dict:
+        """命中统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "max_disk_entries": self.max_disk_entries,
+                "evicted": self.evicted,
+                "persistent": self._conn is not None,
+            }
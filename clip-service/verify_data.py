@@ -1,9 +1,8 @@
 # -*- coding: utf-8 -*-
 """验证新素材的向量和标签数据"""
-import json
+from asset_store import open_default_store
 
-with open('clip_results.json', 'r', encoding='utf-8') as f:
-    data = json.load(f)
+data = open_default_store().load_items()
 
 # 检查新素材
 new_assets = [d for d in data if '02类型-三渲二' in d.get('filePath', '')]
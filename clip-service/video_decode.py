@@ -0,0 +1,394 @@
+"""
+视频关键帧解码 - 在clip_server.py中集成
+顺序读取代替逐帧随机 seek：长GOP的H.264文件每次 seek 都要从上一个关键帧解码，
+5个采样点可能解码好几个完整GOP。这里顺序 grab() 前进、只对采样帧 retrieve()，
+只有当两个采样点的间隔超过实测阈值（seek耗时 / 单帧grab耗时）时才改用 seek。
+
+解码后端可插拔（CLIP_DECODE_BACKEND=auto|pyav|cv2）：
+- pyav: 编解码器多线程、可只解码I帧（skip_frame=NONKEY），在 swscale 中直接缩放到小尺寸并输出RGB
+- cv2: 兜底实现，解码全分辨率后缩放
+两者都输出短边为 CLIP_DECODE_SIZE（默认224）的RGB NumPy数组，不经过PIL。
+"""
+import logging
+import os
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+try:
+    import av
+except ImportError:  # 可选依赖：未安装时使用 cv2 后端
+    av = None
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SeekCostModel:
+    """
+    解码代价估计（进程内共享，指数滑动平均）
+
+    - grab_cost: 顺序前进一帧（grab，不转换像素）的平均耗时
+    - seek_cost: 一次 seek + read 的平均耗时
+    两者之比即为“间隔多少帧以上 seek 更划算”的阈值
+    """
+
+    def __init__(self, default_gap: int = 300, min_gap: int = 30, max_gap: int = 5000, alpha: float = 0.2):
+        self.default_gap = default_gap
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.alpha = alpha
+        self.grab_cost: Optional[float] = None
+        self.seek_cost: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _update(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else (1 - self.alpha) * current + self.alpha * sample
+
+    def record_grabs(self, count: int, elapsed: float):
+        if count > 0:
+            with self._lock:
+                self.grab_cost = self._update(self.grab_cost, elapsed / count)
+
+    def record_seek(self, elapsed: float):
+        with self._lock:
+            self.seek_cost = self._update(self.seek_cost, elapsed)
+
+    def seek_gap(self) -> int:
+        """采样点间隔超过该帧数时使用 seek"""
+        with self._lock:
+            if not self.grab_cost or self.seek_cost is None:
+                return self.default_gap
+            gap = int(self.seek_cost / self.grab_cost)
+        return max(self.min_gap, min(self.max_gap, gap))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "grab_ms": round(self.grab_cost * 1000, 3) if self.grab_cost else None,
+                "seek_ms": round(self.seek_cost * 1000, 3) if self.seek_cost is not None else None,
+            }
+
+
+# 全局代价模型：同一素材库的编码参数相近，跨文件共享测量结果
+seek_cost_model = SeekCostModel()
+
+
+class DecodeStats(NamedTuple):
+    decode_time: float      # 秒
+    grabs: int              # 顺序前进的帧数
+    seeks: int              # seek 次数
+    backend: str = "cv2"
+
+
+def read_frames_at(
+    cap: "cv2.VideoCapture",
+    indices: List[int],
+    cost_model: SeekCostModel = seek_cost_model,
+) -> Tuple[List[Tuple[int, np.ndarray]], DecodeStats]:
+    """
+    按帧号读取帧（BGR），顺序前进为主，间隔过大时 seek
+
+    cap 须刚打开（位于第0帧）。文件实际帧数少于 CAP_PROP_FRAME_COUNT 时，读到末尾即停止。
+
+    返回:
+        ([(帧号, BGR帧)], DecodeStats)
+    """
+    start_time = time.perf_counter()
+    targets = sorted(set(int(i) for i in indices if i >= 0))
+    frames: List[Tuple[int, np.ndarray]] = []
+    position = 0
+    grabs = 0
+    seeks = 0
+    gap_limit = cost_model.seek_gap()
+
+    for target in targets:
+        gap = target - position
+        if gap > gap_limit:
+            seek_start = time.perf_counter()
+            cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            ret, frame = cap.read()
+            cost_model.record_seek(time.perf_counter() - seek_start)
+            seeks += 1
+            if not ret:
+                break
+        else:
+            grab_start = time.perf_counter()
+            ok = True
+            for _ in range(gap):
+                if not cap.grab():
+                    ok = False
+                    break
+            if gap > 0:
+                cost_model.record_grabs(gap, time.perf_counter() - grab_start)
+            grabs += gap
+            if not ok or not cap.grab():
+                break
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+        frames.append((target, frame))
+        position = target + 1
+
+    return frames, DecodeStats(time.perf_counter() - start_time, grabs, seeks)
+
+
+def sample_frame_indices(total_frames: int, num_frames: int) -> List[int]:
+    """均匀采样帧号"""
+    return np.linspace(0, total_frames - 1, num_frames, dtype=int).tolist()
+
+
+def scaled_size(width: int, height: int, short_side: int) -> Tuple[int, int]:
+    """等比缩放到短边为 short_side（不放大），宽高取偶数"""
+    if short_side <= 0 or min(width, height) <= short_side:
+        return width, height
+    scale = short_side / min(width, height)
+    return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+
+class CV2Decoder:
+    """OpenCV 解码后端（兜底）：全分辨率解码后缩放"""
+
+    name = "cv2"
+
+    def __init__(self, short_side: int = 224):
+        self.short_side = short_side
+
+    def _to_rgb(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        size = scaled_size(width, height, self.short_side)
+        if size != (width, height):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def sample(self, video_path: str, num_frames: int, keyframes_only: bool = False) -> Tuple[List[Tuple[int, np.ndarray]], DecodeStats]:
+        """均匀采样 num_frames 帧（cv2 不支持只解码I帧，keyframes_only 被忽略）"""
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"无法打开视频: {video_path}")
+        try:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            if total_frames == 0:
+                raise ValueError(f"视频帧数为0: {video_path}")
+            decoded, stats = read_frames_at(cap, sample_frame_indices(total_frames, num_frames))
+        finally:
+            cap.release()
+        return [(index, self._to_rgb(frame)) for index, frame in decoded], stats
+
+    def frame_at(self, video_path: str, time_sec: float) -> Optional[np.ndarray]:
+        """读取指定时间点的一帧"""
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            return None
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            decoded, _ = read_frames_at(cap, [int(time_sec * fps)])
+        finally:
+            cap.release()
+        return self._to_rgb(decoded[0][1]) if decoded else None
+
+
+class PyAVDecoder:
+    """
+    PyAV (FFmpeg) 解码后端
+
+    - 编解码器帧级/片级多线程（thread_type=AUTO）
+    - keyframes_only: 每个采样点 seek 到之前最近的关键帧，且解码器只输出I帧
+    - 否则顺序解码到各采样点，间隔超过 seek_cost_model 的阈值时 seek 到采样点前的关键帧再向前解码
+    - seek 的 pts 均加上视频流的 start_time（起始时间不为0的 MPEG-TS 等文件）
+    - 只对采样帧做像素转换，缩放与RGB转换在 swscale 中一步完成
+    """
+
+    name = "pyav"
+
+    def __init__(self, short_side: int = 224, threads: int = 0):
+        if av is None:
+            raise ImportError("PyAV 未安装（pip install av）")
+        self.short_side = short_side
+        self.threads = threads
+
+    def _open(self, video_path: str, keyframes_only: bool):
+        container = av.open(video_path)
+        if not container.streams.video:
+            container.close()
+            raise ValueError(f"没有视频流: {video_path}")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        stream.codec_context.thread_count = self.threads
+        if keyframes_only:
+            stream.codec_context.skip_frame = "NONKEY"
+        return container, stream
+
+    def _to_rgb(self, frame) -> np.ndarray:
+        width, height = scaled_size(frame.width, frame.height, self.short_side)
+        return frame.to_ndarray(width=width, height=height, format="rgb24")
+
+    @staticmethod
+    def _pts_of(stream, seconds: float) -> int:
+        return int(stream.start_time or 0) + int(seconds / stream.time_base)
+
+    @staticmethod
+    def _frame_count(stream, container) -> int:
+        if stream.frames:
+            return int(stream.frames)
+        rate = float(stream.average_rate or 0)
+        if stream.duration is not None and stream.time_base is not None:
+            return int(float(stream.duration * stream.time_base) * rate)
+        if container.duration:
+            return int(container.duration / av.time_base * rate)
+        return 0
+
+    def sample(self, video_path: str, num_frames: int, keyframes_only: bool = False) -> Tuple[List[Tuple[int, np.ndarray]], DecodeStats]:
+        start_time = time.perf_counter()
+        container, stream = self._open(video_path, keyframes_only)
+        frames: List[Tuple[int, np.ndarray]] = []
+        grabs = 0
+        seeks = 0
+        try:
+            total_frames = self._frame_count(stream, container)
+            if total_frames == 0:
+                raise ValueError(f"视频帧数为0: {video_path}")
+            targets = sample_frame_indices(total_frames, num_frames)
+
+            rate = float(stream.average_rate or 25)
+            if keyframes_only:
+                # 每个采样点只解码一个I帧
+                seen_pts = set()
+                for target in targets:
+                    pts = self._pts_of(stream, target / rate)
+                    container.seek(pts, stream=stream, backward=True, any_frame=False)
+                    seeks += 1
+                    frame = next(container.decode(stream), None)
+                    if frame is None or frame.pts in seen_pts:
+                        continue
+                    seen_pts.add(frame.pts)
+                    frames.append((target, self._to_rgb(frame)))
+            else:
+                frames, grabs, seeks = self._sample_sequential(container, stream, targets, rate)
+        finally:
+            container.close()
+        return frames, DecodeStats(time.perf_counter() - start_time, grabs, seeks, self.name)
+
+    def _sample_sequential(
+        self,
+        container,
+        stream,
+        targets: List[int],
+        rate: float,
+        cost_model: SeekCostModel = seek_cost_model,
+    ) -> Tuple[List[Tuple[int, np.ndarray]], int, int]:
+        """
+        顺序解码（多线程）到各采样点，只转换采样帧；与 read_frames_at 相同，
+        距当前位置超过 seek 阈值的采样点先 seek 到之前的关键帧
+
+        返回:
+            ([(帧号, RGB帧)], 顺序解码的帧数, seek 次数)
+        """
+        start = int(stream.start_time or 0)
+        frames: List[Tuple[int, np.ndarray]] = []
+        grabs = 0
+        seeks = 0
+        gap_limit = cost_model.seek_gap()
+        decoded = container.decode(stream)
+        position = 0
+
+        for target in targets:
+            seeking = target - position > gap_limit
+            step_start = time.perf_counter()
+            if seeking:
+                container.seek(self._pts_of(stream, target / rate), stream=stream, backward=True, any_frame=False)
+                decoded = container.decode(stream)
+                seeks += 1
+            steps = 0
+            found = None
+            for frame in decoded:
+                steps += 1
+                # 帧号按 pts 换算（seek 后无法顺序计数）；没有 pts 的帧按顺序计数
+                index = (
+                    int(round(float((frame.pts - start) * stream.time_base) * rate))
+                    if frame.pts is not None else position + steps - 1
+                )
+                if index >= target:
+                    found = (index, frame)
+                    break
+            elapsed = time.perf_counter() - step_start
+            if seeking:
+                cost_model.record_seek(elapsed)
+            else:
+                cost_model.record_grabs(steps, elapsed)
+                grabs += steps
+            if found is None:
+                break
+            index, frame = found
+            frames.append((target, self._to_rgb(frame)))
+            position = index + 1
+        return frames, grabs, seeks
+
+    def frame_at(self, video_path: str, time_sec: float) -> Optional[np.ndarray]:
+        container, stream = self._open(video_path, keyframes_only=False)
+        try:
+            target_pts = self._pts_of(stream, time_sec)
+            container.seek(target_pts, stream=stream, backward=True, any_frame=False)
+            # 从关键帧向前解码到目标时间
+            for frame in container.decode(stream):
+                if frame.pts is None or frame.pts >= target_pts:
+                    return self._to_rgb(frame)
+        finally:
+            container.close()
+        return None
+
+
+class FallbackDecoder:
+    """优先使用 PyAV，单个文件解码失败时回退到 cv2"""
+
+    def __init__(self, primary, fallback: CV2Decoder):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def sample(self, video_path: str, num_frames: int, keyframes_only: bool = False):
+        try:
+            frames, stats = self.primary.sample(video_path, num_frames, keyframes_only=keyframes_only)
+            if frames:
+                return frames, stats
+        except Exception as e:
+            logger.debug(f"{self.primary.name} 解码失败，回退到 {self.fallback.name}: {video_path}: {e}")
+        return self.fallback.sample(video_path, num_frames, keyframes_only=keyframes_only)
+
+    def frame_at(self, video_path: str, time_sec: float) -> Optional[np.ndarray]:
+        try:
+            frame = self.primary.frame_at(video_path, time_sec)
+            if frame is not None:
+                return frame
+        except Exception as e:
+            logger.debug(f"{self.primary.name} 解码失败，回退到 {self.fallback.name}: {video_path}: {e}")
+        return self.fallback.frame_at(video_path, time_sec)
+
+
+_decoder = None
+_decoder_lock = threading.Lock()
+
+
+def get_decoder():
+    """
+    按环境变量创建（并缓存）解码后端
+
+    CLIP_DECODE_BACKEND: auto（默认，有PyAV时用PyAV并以cv2兜底）| pyav | cv2
+    CLIP_DECODE_SIZE: 输出短边像素，默认224；0 表示不缩放
+    CLIP_DECODE_THREADS: PyAV 解码线程数，默认0（由FFmpeg决定）
+    """
+    global _decoder
+    with _decoder_lock:
+        if _decoder is None:
+            backend = os.getenv("CLIP_DECODE_BACKEND", "auto").lower()
+            short_side = int(os.getenv("CLIP_DECODE_SIZE", "224"))
+            threads = int(os.getenv("CLIP_DECODE_THREADS", "0"))
+            cv2_decoder = CV2Decoder(short_side)
+            if backend == "cv2" or (backend == "auto" and av is None):
+                _decoder = cv2_decoder
+            else:
+                _decoder = FallbackDecoder(PyAVDecoder(short_side, threads), cv2_decoder)
+            logger.info(f"视频解码后端: {_decoder.name}，输出短边 {short_side or '原始尺寸'}")
+        return _decoder
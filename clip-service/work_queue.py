@@ -0,0 +1,310 @@
+"""
+分布式扫描工作队列 - 在batch_scan.py中集成
+队列是共享文件系统上的一个SQLite文件，多个扫描进程/机器从中租用文件批次：
+
+- lease(): 领取一批待处理文件并获得租约（令牌 + 到期时间），同时回收已过期的租约
+- heartbeat(): 处理期间定期续约；返回 False 表示租约已过期并被他人领取，应放弃本批
+- commit(): 短事务校验租约 → 不持锁执行写入回调（可能是较慢的 HTTP 请求）→ 再次校验租约并标记完成。
+  提交前已失效的租约不会写入；写入期间租约失效或写入后标记前崩溃的批次会被重新处理，
+  而素材存储按 filePath 覆盖写入，重复提交不产生重复素材，效果等同恰好一次
+- 失败的文件重试 max_attempts 次后标记为 failed
+
+注意：网络文件系统（SMB/NFS）上不能使用 WAL，本模块使用默认的回滚日志模式。
+
+命令行:
+    python work_queue.py enqueue <queue.sqlite3> <目录> [--patterns *.mp4 *.mov]
+    python work_queue.py stats <queue.sqlite3>
+    python work_queue.py retry-failed <queue.sqlite3>
+"""
+import argparse
+import contextlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# 写锁等待时间（秒）：多台机器同时领取/提交时排队
+BUSY_TIMEOUT = 60.0
+
+
+def default_owner() -> str:
+    """工作者标识：主机名 + 进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Lease(NamedTuple):
+    token: str
+    owner: str
+    paths: List[str]
+    expires_at: float
+
+
+class LeaseLost(Exception):
+    """提交时租约已过期并被其他工作者领取"""
+
+
+class ScanWorkQueue:
+    """基于SQLite的租约工作队列，键为文件路径"""
+
+    def __init__(self, db_path, lease_seconds: float = 300.0, max_attempts: int = 3):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.RLock()
+        # 自动提交模式，事务由 _transaction 显式控制
+        self._conn = sqlite3.connect(
+            str(self.db_path), timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scan_tasks (
+                file_path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                lease_token TEXT,
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_scan_tasks_status ON scan_tasks (status, lease_expires)"
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE 写事务：跨进程/跨机器串行化领取与提交"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --------------------------------------------
+    # 生产者
+    # --------------------------------------------
+    def enqueue(self, paths: Iterable[str]) -> int:
+        """加入待处理文件（已在队列中的文件保持原状态），返回新增数量"""
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO scan_tasks (file_path, status, updated_at) VALUES (?, ?, ?)",
+                ((path, PENDING, now) for path in paths),
+            )
+            return conn.total_changes - before
+
+    def retry_failed(self) -> int:
+        """把失败的文件重置为待处理（重试次数清零）"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE scan_tasks SET status = ?, attempts = 0, error = NULL, updated_at = ? WHERE status = ?",
+                (PENDING, time.time(), FAILED),
+            )
+            return cursor.rowcount
+
+    # --------------------------------------------
+    # 工作者
+    # --------------------------------------------
+    def _reclaim_expired(self, conn: sqlite3.Connection, now: float) -> int:
+        """过期租约退回待处理；领取次数已达上限的标记为失败"""
+        conn.execute(
+            "UPDATE scan_tasks SET status = ?, error = '租约多次过期', lease_token = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, now, LEASED, now, self.max_attempts),
+        )
+        cursor = conn.execute(
+            "UPDATE scan_tasks SET status = ?, lease_token = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires < ?",
+            (PENDING, now, LEASED, now),
+        )
+        if cursor.rowcount:
+            logger.info(f"回收过期租约的文件 {cursor.rowcount} 个")
+        return cursor.rowcount
+
+    def lease(self, batch_size: int, owner: Optional[str] = None) -> Optional[Lease]:
+        """领取最多 batch_size 个文件；队列中没有待处理文件时返回 None"""
+        owner = owner or default_owner()
+        token = uuid.uuid4().hex
+        now = time.time()
+        expires_at = now + self.lease_seconds
+        with self._transaction() as conn:
+            self._reclaim_expired(conn, now)
+            paths = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT file_path FROM scan_tasks WHERE status = ? ORDER BY file_path LIMIT ?",
+                    (PENDING, batch_size),
+                )
+            ]
+            if not paths:
+                return None
+            conn.executemany(
+                "UPDATE scan_tasks SET status = ?, lease_token = ?, lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE file_path = ?",
+                ((LEASED, token, owner, expires_at, now, path) for path in paths),
+            )
+        return Lease(token, owner, paths, expires_at)
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """续约；返回 False 表示租约已失效（过期后被回收或被他人领取）"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE scan_tasks SET lease_expires = ?, updated_at = ? "
+                "WHERE lease_token = ? AND status = ? AND lease_expires >= ?",
+                (now + self.lease_seconds, now, lease.token, LEASED, now),
+            )
+            return cursor.rowcount > 0
+
+    @contextlib.contextmanager
+    def keep_alive(self, lease: Lease, interval: Optional[float] = None) -> Iterator[threading.Event]:
+        """
+        处理期间在后台线程中定期续约
+
+        产出一个 Event：租约丢失时被置位，调用方可据此提前放弃本批。
+        """
+        interval = interval or self.lease_seconds / 3
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    if not self.heartbeat(lease):
+                        logger.warning(f"租约已失效: {lease.token}")
+                        lost.set()
+                        return
+                except sqlite3.Error as e:
+                    # 共享存储短暂不可用时继续重试，直到租约真正过期
+                    logger.warning(f"续约失败: {e}")
+
+        thread = threading.Thread(target=beat, name="scan-lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def _held(self, conn: sqlite3.Connection, lease: Lease) -> set:
+        return {
+            row[0]
+            for row in conn.execute(
+                "SELECT file_path FROM scan_tasks WHERE lease_token = ? AND status = ?",
+                (lease.token, LEASED),
+            )
+        }
+
+    def commit(
+        self,
+        lease: Lease,
+        write: Callable[[List[str]], None],
+        failed: Optional[Dict[str, str]] = None,
+    ) -> List[str]:
+        """
+        提交一个批次
+
+        先在短事务中校验租约仍然有效，然后在不持有队列写锁的情况下调用 write(成功的文件列表)
+        （其他机器的领取、续约与提交不必等待写入），最后在第二个事务中再次按租约令牌校验，
+        把成功文件标记为 done、失败文件按重试次数退回或标记 failed。
+        write 必须幂等（按 filePath 覆盖写入）：写入期间租约失效时，结果可能已写入，
+        文件由新的租约持有者重新处理并覆盖。write 抛出异常时不做任何标记，租约保持不变。
+
+        返回成功提交的文件列表；租约失效时抛出 LeaseLost。
+        """
+        failed = failed or {}
+        with self._transaction() as conn:
+            held = self._held(conn, lease)
+        if not held:
+            raise LeaseLost(lease.token)
+        succeeded = [path for path in lease.paths if path in held and path not in failed]
+        if succeeded:
+            write(succeeded)
+
+        now = time.time()
+        with self._transaction() as conn:
+            held = self._held(conn, lease)
+            if not held:
+                raise LeaseLost(lease.token)
+            succeeded = [path for path in succeeded if path in held]
+            conn.executemany(
+                "UPDATE scan_tasks SET status = ?, lease_token = NULL, error = NULL, updated_at = ? "
+                "WHERE file_path = ? AND lease_token = ?",
+                ((DONE, now, path, lease.token) for path in succeeded),
+            )
+            conn.executemany(
+                "UPDATE scan_tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "lease_token = NULL, error = ?, updated_at = ? WHERE file_path = ? AND lease_token = ?",
+                (
+                    (self.max_attempts, FAILED, PENDING, error, now, path, lease.token)
+                    for path, error in failed.items()
+                    if path in held
+                ),
+            )
+        return succeeded
+
+    def release(self, lease: Lease):
+        """放弃租约（如进程退出），文件退回待处理，不计入重试次数"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE scan_tasks SET status = ?, lease_token = NULL, attempts = MAX(attempts - 1, 0), "
+                "updated_at = ? WHERE lease_token = ? AND status = ?",
+                (PENDING, time.time(), lease.token, LEASED),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM scan_tasks GROUP BY status"))
+        return {status: counts.get(status, 0) for status in (PENDING, LEASED, DONE, FAILED)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分布式扫描工作队列")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = sub.add_parser("enqueue", help="把目录下的视频文件加入队列")
+    enqueue_parser.add_argument("queue")
+    enqueue_parser.add_argument("directory")
+    enqueue_parser.add_argument("--patterns", nargs="+", default=["*.mp4", "*.mov", "*.avi", "*.mkv", "*.webm"])
+    stats_parser = sub.add_parser("stats", help="查看队列状态")
+    stats_parser.add_argument("queue")
+    retry_parser = sub.add_parser("retry-failed", help="重置失败的文件")
+    retry_parser.add_argument("queue")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    queue = ScanWorkQueue(args.queue)
+    if args.command == "enqueue":
+        paths = []
+        for pattern in args.patterns:
+            paths.extend(str(path) for path in Path(args.directory).rglob(pattern))
+        print(f"新增 {queue.enqueue(sorted(set(paths)))} 个文件（共发现 {len(set(paths))} 个）")
+    elif args.command == "retry-failed":
+        print(f"重置 {queue.retry_failed()} 个失败文件")
+    print(queue.stats())
+
+
+if __name__ == "__main__":
+    main()
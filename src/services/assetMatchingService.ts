@@ -97,6 +97,31 @@ export class AssetMatchingService {
   ): Promise<BatchMatchResult[]> {
     console.log(`[AssetMatching] 批量匹配 ${blocks.length} 个段落`);
 
+    // 优先使用批量搜索接口：所有段落一次请求
+    if (this.clipServiceAvailable && blocks.length > 0) {
+      try {
+        const searchQueries = blocks.map(block => this.buildSearchQuery(block));
+        const batchResult = await clipService.searchBatch(searchQueries, topK, 0.1);
+
+        return blocks.map((block, index) => {
+          const matches = batchResult.results[index]?.results ?? [];
+          const candidates = matches.length > 0
+            ? matches.map(match => this.convertClipMatch(match, 'clip_vector'))
+            : this.matchByEmotionTag(block, localShots, topK);
+
+          return {
+            blockId: block.id,
+            blockText: block.text,
+            candidates,
+            bestMatch: candidates.length > 0 ? candidates[0] : null,
+            searchQuery: searchQueries[index],
+          };
+        });
+      } catch (error) {
+        console.warn('[AssetMatching] 批量搜索失败，回退到逐段匹配:', error);
+      }
+    }
+
     const results: BatchMatchResult[] = [];
 
     for (const block of blocks) {
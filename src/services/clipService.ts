@@ -286,6 +286,44 @@ export class CLIPService {
     return await response.json();
   }
 
+  /**
+   * 批量文字搜索
+   * 
+   * 一次请求提交多个查询，每个查询返回独立的 top-k 结果（顺序与 queries 一致）
+   * 
+   * @param queries 搜索文本列表，如分镜中每个段落的查询
+   * @param topK 每个查询返回的结果数量
+   * @param threshold 相似度阈值，低于此值不返回
+   * @param filterTags 可选：按标签过滤
+   */
+  async searchBatch(
+    queries: string[],
+    topK: number = 10,
+    threshold: number = 0.0,
+    filterTags?: string[]
+  ): Promise<CLIPBatchSearchResult> {
+    console.log('[CLIPService] 批量搜索:', queries.length, '个查询, top_k:', topK);
+    
+    const response = await fetch(`${this.config.apiEndpoint}/search-batch`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({
+        queries,
+        top_k: topK,
+        threshold,
+        filter_tags: filterTags,
+      }),
+    });
+    
+    if (!response.ok) {
+      throw new Error(`CLIP 批量搜索失败: ${response.status} ${response.statusText}`);
+    }
+    
+    return await response.json();
+  }
+
   /**
    * 快速文字搜索（GET方式，便于简单调用）
    */
@@ -346,5 +384,20 @@ export interface CLIPMultiSearchResult {
   total: number;
 }
 
+/** 批量搜索中单个查询的结果 */
+export interface CLIPBatchSearchItem {
+  query: string;
+  results: CLIPSearchMatch[];
+  total: number;
+}
+
+/** 批量搜索响应 */
+export interface CLIPBatchSearchResult {
+  status: string;
+  results: CLIPBatchSearchItem[];
+  total: number;
+  searched?: number;
+}
+
 // 导出单例实例
 export const clipService = new CLIPService();
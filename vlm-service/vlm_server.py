@@ -13,12 +13,17 @@ import os
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 import sys
 import logging
-from typing import Optional
+from typing import Optional, Union
 from pathlib import Path
 
 import torch
+import numpy as np
 from PIL import Image
 import cv2
+try:
+    import av
+except ImportError:  # 可选依赖：未安装时使用 OpenCV 解码
+    av = None
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -107,7 +112,7 @@ class VLMModelManager:
             # 即使加载失败也标记为已加载，使用后备方案
             self.model_loaded = True
             
-    def generate_description(self, image: Image.Image, prompt: str = "描述这张图片的内容") -> str:
+    def generate_description(self, image: Union[Image.Image, np.ndarray], prompt: str = "描述这张图片的内容") -> str:
         """生成图像描述"""
         if not self.model_loaded:
             self.load_model()
@@ -125,7 +130,7 @@ class VLMModelManager:
             logger.error(f"描述生成失败: {e}")
             return "无法生成描述"
             
-    def _generate_clip_based_description(self, image: Image.Image) -> str:
+    def _generate_clip_based_description(self, image: Union[Image.Image, np.ndarray]) -> str:
         """基于CLIP特征的描述生成（后备方案）"""
         if self.clip_model is None or self.clip_processor is None:
             return "图像内容"
@@ -188,8 +193,42 @@ class BatchDescribeRequest(BaseModel):
 # ============================================
 # 视频处理
 # ============================================
-def extract_frame(video_path: str) -> Optional[Image.Image]:
-    """从视频提取中间帧"""
+# 输出短边像素（CLIP视觉塔输入为224），0 表示不缩放
+DECODE_SIZE = int(os.getenv("VLM_DECODE_SIZE", "224"))
+
+def _scaled_size(width: int, height: int) -> tuple:
+    """等比缩放到短边为 DECODE_SIZE（不放大），宽高取偶数"""
+    if DECODE_SIZE <= 0 or min(width, height) <= DECODE_SIZE:
+        return width, height
+    scale = DECODE_SIZE / min(width, height)
+    return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+def _extract_frame_pyav(video_path: str) -> Optional[np.ndarray]:
+    """PyAV：多线程解码，seek 到中点之前最近的I帧并只解码I帧，在 swscale 中缩放并转RGB"""
+    container = av.open(video_path)
+    try:
+        if not container.streams.video:
+            return None
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        stream.codec_context.skip_frame = "NONKEY"
+        if stream.duration is not None:
+            middle = stream.duration // 2
+        elif container.duration:
+            middle = int(container.duration / 2 / av.time_base / stream.time_base)
+        else:
+            middle = 0
+        container.seek(middle, stream=stream, backward=True, any_frame=False)
+        frame = next(container.decode(stream), None)
+        if frame is None:
+            return None
+        width, height = _scaled_size(frame.width, frame.height)
+        return frame.to_ndarray(width=width, height=height, format="rgb24")
+    finally:
+        container.close()
+
+def _extract_frame_cv2(video_path: str) -> Optional[np.ndarray]:
+    """OpenCV 兜底：解码中间帧后缩放"""
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         return None
@@ -204,10 +243,24 @@ def extract_frame(video_path: str) -> Optional[Image.Image]:
     ret, frame = cap.read()
     cap.release()
     
-    if ret:
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        return Image.fromarray(frame_rgb)
-    return None
+    if not ret:
+        return None
+    height, width = frame.shape[:2]
+    size = _scaled_size(width, height)
+    if size != (width, height):
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+def extract_frame(video_path: str) -> Optional[np.ndarray]:
+    """从视频提取中间帧（RGB数组）；有PyAV时优先使用，失败回退到OpenCV"""
+    if av is not None:
+        try:
+            frame = _extract_frame_pyav(video_path)
+            if frame is not None:
+                return frame
+        except Exception as e:
+            logger.debug(f"PyAV 解码失败，回退到 OpenCV: {video_path}: {e}")
+    return _extract_frame_cv2(video_path)
 
 # ============================================
 # API路由
@@ -302,7 +355,7 @@ async def batch_describe(request: BatchDescribeRequest):
     for video_path in video_files:
         try:
             frame = extract_frame(str(video_path))
-            if frame:
+            if frame is not None:
                 description = vlm_manager.generate_description(frame)
                 results.append({
                     "file_path": str(video_path),